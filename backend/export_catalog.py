@@ -0,0 +1,38 @@
+"""Dump the clinic/offer catalog as NDJSON.
+
+Usage:
+    python export_catalog.py [--since 2024-12-01T00:00:00Z] [--gzip] [-o catalog.ndjson.gz]
+
+Writes to stdout when no output file is given.
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+
+import server
+from server import gzip_stream, iter_catalog_export
+
+
+async def main(args):
+    server.connect_mongo()
+    chunks = iter_catalog_export(args.since)
+    if args.gzip:
+        chunks = gzip_stream(chunks)
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        server.client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export clinics with their offers as NDJSON")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="only clinics changed at or after this ISO timestamp")
+    parser.add_argument("--gzip", action="store_true", help="gzip-compress the output")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,27 @@
+"""Recompute clinic rating aggregates from the reviews collection.
+
+Reviews update each clinic's running rating_sum/review_count as they
+arrive; run this periodically (e.g. hourly from cron) to fix any drift.
+
+Usage:
+    python reconcile_ratings.py [clinic_id ...]
+"""
+import argparse
+import asyncio
+
+import server
+
+
+async def main(args):
+    server.connect_mongo()
+    try:
+        updated = await server.reconcile_ratings(args.clinic_ids or None)
+        print(f"{updated} clinics updated")
+    finally:
+        server.client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute clinic ratings from their reviews")
+    parser.add_argument("clinic_ids", nargs="*", help="only these clinics (default: all)")
+    asyncio.run(main(parser.parse_args()))
@@ -1,37 +1,660 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Response, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
 from fastapi.security import HTTPBearer
 from dotenv import load_dotenv
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import (
+    AutoReconnect, BulkWriteError, DuplicateKeyError, ExecutionTimeout, NetworkTimeout, OperationFailure,
+    PyMongoError, ServerSelectionTimeoutError
+)
+from pymongo.read_preferences import SecondaryPreferred
 import os
 import logging
+import asyncio
+import time
+import threading
+import sys
+import hmac
+import hashlib
+import ipaddress
+import random
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 import uuid
+import json
+import math
+import re
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import mmap
+import struct
+import fcntl
+import tempfile
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 import httpx
 
+try:
+    import brotli
+except ImportError:  # optional: responses are then offered as gzip or identity
+    brotli = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+MONGO_POOL_OPTIONS = {
+    "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '10')),
+    "maxIdleTimeMS": int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000')),
+    "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+    "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+    "socketTimeoutMS": int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '30000')),
+}
+if os.environ.get('MONGO_COMPRESSORS'):
+    # e.g. "zstd,snappy,zlib"; pymongo skips codecs whose library is missing
+    MONGO_POOL_OPTIONS["compressors"] = os.environ['MONGO_COMPRESSORS']
+
+# Catalog reads (treatments, clinics, clinic_treatments) tolerate slightly stale
+# data and go to secondaries; auth and session reads stay on the primary.
+# MongoDB rejects a max staleness below 90 seconds.
+CATALOG_MAX_STALENESS_SECONDS = int(os.environ.get('CATALOG_MAX_STALENESS_SECONDS', '90'))
+
+# The client is created per worker in the app lifespan, after any pre-fork:
+# a MongoClient inherited across fork() shares sockets and monitor threads.
+client: Optional[AsyncIOMotorClient] = None
+db = None
+catalog_db = None
+
+def create_mongo_client() -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        mongo_url,
+        event_listeners=[MongoTimingListener()],
+        **MONGO_POOL_OPTIONS
+    )
+
+def connect_mongo():
+    global client, db, catalog_db
+    client = create_mongo_client()
+    db = client[os.environ['DB_NAME']]
+    catalog_db = client.get_database(
+        os.environ['DB_NAME'],
+        read_preference=SecondaryPreferred(max_staleness=CATALOG_MAX_STALENESS_SECONDS)
+    )
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'denticompare-secret-key-2024')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_DAYS = 7
+# How often each worker pulls logouts recorded by the others
+SESSION_REVOCATION_SYNC_SECONDS = float(os.environ.get('SESSION_REVOCATION_SYNC_SECONDS', '5'))
+
+# Catalog export
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '200'))
+
+# Shared catalog snapshot (one memory-mapped file per host, see CATALOG SNAPSHOT)
+CATALOG_SNAPSHOT_ENABLED = os.environ.get('CATALOG_SNAPSHOT_ENABLED', 'true').lower() == 'true'
+CATALOG_SNAPSHOT_DIR = Path(os.environ.get(
+    'CATALOG_SNAPSHOT_DIR',
+    Path('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()) / f"denticompare-{os.environ['DB_NAME']}"
+))
+CATALOG_SNAPSHOT_CHECK_SECONDS = float(os.environ.get('CATALOG_SNAPSHOT_CHECK_SECONDS', '0.5'))
+CATALOG_SNAPSHOT_SYNC_SECONDS = float(os.environ.get('CATALOG_SNAPSHOT_SYNC_SECONDS', '10'))
+
+# Partner bulk price updates: items per request, and how long the
+# per-batch catalog_events entries are kept
+BULK_UPDATE_MAX_ITEMS = int(os.environ.get('BULK_UPDATE_MAX_ITEMS', '1000'))
+CATALOG_EVENTS_TTL_SECONDS = int(os.environ.get('CATALOG_EVENTS_TTL_SECONDS', str(7 * 86400)))
+
+# Appointment booking: how long a hold lasts unconfirmed, slots per listing
+BOOKING_HOLD_SECONDS = int(os.environ.get('BOOKING_HOLD_SECONDS', '600'))
+SLOTS_PAGE_SIZE = int(os.environ.get('SLOTS_PAGE_SIZE', '500'))
+
+# Largest page of GET /clinics/{id}/reviews
+REVIEWS_PAGE_MAX = int(os.environ.get('REVIEWS_PAGE_MAX', '100'))
+# Ratings moved by new reviews are published as one catalog change per
+# interval, however many reviews arrived
+RATING_PUBLISH_SECONDS = float(os.environ.get('RATING_PUBLISH_SECONDS', '30'))
+
+# Search analytics (write-behind to search_events) and the result cache
+# it prewarms with the PREWARM_TOP_N most popular searches per route
+SEARCH_ANALYTICS_ENABLED = os.environ.get('SEARCH_ANALYTICS_ENABLED', 'true').lower() == 'true'
+SEARCH_BUFFER_SIZE = int(os.environ.get('SEARCH_BUFFER_SIZE', '10000'))
+SEARCH_FLUSH_SECONDS = float(os.environ.get('SEARCH_FLUSH_SECONDS', '5'))
+SEARCH_FLUSH_BATCH = int(os.environ.get('SEARCH_FLUSH_BATCH', '1000'))
+SEARCH_EVENTS_TTL_DAYS = int(os.environ.get('SEARCH_EVENTS_TTL_DAYS', '7'))
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '2000'))
+PREWARM_TOP_N = int(os.environ.get('PREWARM_TOP_N', '20'))
+PREWARM_WINDOW_HOURS = float(os.environ.get('PREWARM_WINDOW_HOURS', '24'))
+
+# Pre-encoded response bodies (identity/gzip/br) of hot GET routes
+RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_BYTES', str(64 * 1024 * 1024)))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '9'))
+
+# Shared compare snapshots: per-worker LRU size and how long they are kept
+COMPARE_SNAPSHOT_CACHE_SIZE = int(os.environ.get('COMPARE_SNAPSHOT_CACHE_SIZE', '1000'))
+COMPARE_SNAPSHOT_TTL_SECONDS = int(os.environ.get('COMPARE_SNAPSHOT_TTL_SECONDS', str(30 * 86400)))
+
+# Live compare updates over SSE. CHANGE_FEED_MODE is "watch" (change
+# stream on catalog_events) or "poll"; watch falls back to poll by itself
+# on a standalone mongod.
+CHANGE_FEED_MODE = os.environ.get('CHANGE_FEED_MODE', 'watch')
+CHANGE_FEED_POLL_SECONDS = float(os.environ.get('CHANGE_FEED_POLL_SECONDS', '2'))
+LIVE_MAX_CLINICS = int(os.environ.get('LIVE_MAX_CLINICS', '20'))
+LIVE_QUEUE_SIZE = int(os.environ.get('LIVE_QUEUE_SIZE', '16'))
+LIVE_KEEPALIVE_SECONDS = float(os.environ.get('LIVE_KEEPALIVE_SECONDS', '15'))
+LIVE_RETRY_MS = int(os.environ.get('LIVE_RETRY_MS', '5000'))
+
+# Denormalized clinic_profiles read model (see CLINIC PROFILES)
+CLINIC_PROFILES_ENABLED = os.environ.get('CLINIC_PROFILES_ENABLED', 'false').lower() == 'true'
+
+# price_history time-series collection (see PRICE HISTORY); needs MongoDB 5.0+
+PRICE_HISTORY_ENABLED = os.environ.get('PRICE_HISTORY_ENABLED', 'false').lower() == 'true'
+PRICE_HISTORY_RETENTION_DAYS = int(os.environ.get('PRICE_HISTORY_RETENTION_DAYS', '0'))
+
+# Server-Timing header: always on, or per request with `X-Debug-Timing: 1`
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+
+# Admin-only endpoints and debug features require `X-Admin-Token: $ADMIN_TOKEN`
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Request profiler: admins send `X-Profile: 1`; PROFILER_SAMPLE_RATE also
+# profiles that fraction of all /api requests
+PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', '0'))
+PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', '2'))
+PROFILER_STORE_SIZE = int(os.environ.get('PROFILER_STORE_SIZE', '50'))
+
+# Per-route time budgets in milliseconds (0 = no deadline), overridable with
+# a JSON object in ROUTE_BUDGETS_MS
+REQUEST_BUDGET_MS = int(os.environ.get('REQUEST_BUDGET_MS', '5000'))
+# Sub-requests allowed in one POST /api/batch
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', '10'))
+ROUTE_BUDGETS_MS = {
+    "/api/auth/session": 10000,
+    "/api/seed": 30000,
+    "/api/export": 0,
+    "/api/admin/clinic-profiles/rebuild": 0,
+    "/api/compare/stream": 0,
+    "/api/admin/ratings/reconcile": 0,
+    **json.loads(os.environ.get('ROUTE_BUDGETS_MS', '{}'))
+}
+
+# Mongo circuit breaker
+BREAKER_WINDOW_SECONDS = int(os.environ.get('BREAKER_WINDOW_SECONDS', '30'))
+BREAKER_MIN_REQUESTS = int(os.environ.get('BREAKER_MIN_REQUESTS', '20'))
+BREAKER_ERROR_RATE = float(os.environ.get('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get('BREAKER_COOLDOWN_SECONDS', '15'))
+
+# Token-bucket rate limits per route and key ("ip" or "email"): `burst` tokens,
+# refilled at `rate` per second. RATE_LIMITS (JSON) overrides routes.
+# The "mongo" backend shares buckets across workers.
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+RATE_LIMITS = {
+    "auth/login": {"ip": {"burst": 20, "rate": 20 / 60}, "email": {"burst": 5, "rate": 5 / 300}},
+    "auth/register": {"ip": {"burst": 5, "rate": 5 / 600}, "email": {"burst": 3, "rate": 3 / 3600}},
+    "auth/session": {"ip": {"burst": 20, "rate": 20 / 60}},
+    "compare": {"ip": {"burst": 30, "rate": 1.0}},
+    "reviews": {"ip": {"burst": 10, "rate": 10 / 60}},
+    **json.loads(os.environ.get('RATE_LIMITS', '{}'))
+}
+# "ip" limits key on the caller's address. Behind a proxy or ingress, list
+# its addresses or CIDRs in TRUSTED_PROXIES (comma-separated, e.g.
+# "10.0.0.0/8"): for requests arriving from them the caller is the nearest
+# X-Forwarded-For entry not added by a trusted proxy. Left empty, the
+# socket peer is the caller and X-Forwarded-For is ignored.
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(proxy.strip(), strict=False)
+    for proxy in os.environ.get('TRUSTED_PROXIES', '').split(',') if proxy.strip()
+]
+
+# ==================== REQUEST TIMING ====================
+
+class RequestTiming:
+    """Per-request phase durations in milliseconds.
+
+    Mongo time is fed from the driver's command events, which Motor runs on
+    its executor threads with the request's context copied over, hence the lock.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.mongo_ms = 0.0
+        self.mongo_count = 0
+        self.auth_ms = 0.0
+        self.serialize_ms = 0.0
+        self._lock = threading.Lock()
+
+    def add_mongo(self, duration_ms: float):
+        with self._lock:
+            self.mongo_ms += duration_ms
+            self.mongo_count += 1
+
+    def header(self) -> str:
+        total_ms = (time.perf_counter() - self.started) * 1000
+        app_ms = max(total_ms - self.mongo_ms - self.auth_ms - self.serialize_ms, 0.0)
+        return ", ".join([
+            f'mongo;dur={self.mongo_ms:.2f};desc="{self.mongo_count} queries"',
+            f"auth;dur={self.auth_ms:.2f}",
+            f"app;dur={app_ms:.2f}",
+            f"serialize;dur={self.serialize_ms:.2f}",
+            f"total;dur={total_ms:.2f}",
+        ])
+
+request_timing: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+class MongoUsage:
+    """Whether a request has sent Mongo any command.
+
+    Only requests that reached Mongo tell the circuit breaker anything about
+    its health; snapshot and cache hits must not close or dilute it.
+    """
+
+    def __init__(self):
+        self.issued = False
+
+request_mongo_usage: ContextVar[Optional[MongoUsage]] = ContextVar("request_mongo_usage", default=None)
+
+def note_mongo_command():
+    usage = request_mongo_usage.get()
+    if usage:
+        usage.issued = True
+
+class MongoTimingListener(monitoring.CommandListener):
+    def started(self, event):
+        note_mongo_command()
+
+    def succeeded(self, event):
+        timing = request_timing.get()
+        if timing:
+            timing.add_mongo(event.duration_micros / 1000)
+
+    def failed(self, event):
+        timing = request_timing.get()
+        if timing:
+            timing.add_mongo(event.duration_micros / 1000)
+
+class TimedJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        timing = request_timing.get()
+        if not timing:
+            return super().render(content)
+        started = time.perf_counter()
+        body = super().render(content)
+        timing.serialize_ms += (time.perf_counter() - started) * 1000
+        return body
+
+# ==================== PROFILER ====================
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class TaskSampler:
+    """Samples one asyncio task's logical stack from a background thread.
+
+    While the task is suspended, its stack is rebuilt from the chain of
+    awaiting coroutines, so time waiting on Motor shows up under the query
+    that was awaited. While it runs on the loop thread, the thread's
+    synchronous frames (bcrypt, JSON rendering, ...) are appended.
+    """
+
+    def __init__(self, task: asyncio.Task, interval_s: float):
+        self.task = task
+        self.interval_s = interval_s
+        self.loop_thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            stack = self._sample()
+            if stack:
+                self.stacks[";".join(stack)] += 1
+                self.samples += 1
+
+    def _sample(self) -> List[str]:
+        stack = []
+        innermost = None
+        awaitable = self.task.get_coro()
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                break
+            stack.append(_frame_label(frame))
+            innermost = awaitable
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+            if awaitable is not None and not hasattr(awaitable, "cr_frame") and not hasattr(awaitable, "gi_frame"):
+                # A future: Motor executor work, httpx I/O, sleeps...
+                stack.append("[await]")
+                return stack
+
+        if innermost is not None and getattr(innermost, "cr_running", False):
+            thread_frame = sys._current_frames().get(self.loop_thread_id)
+            running = []
+            while thread_frame is not None and thread_frame is not innermost.cr_frame:
+                running.append(_frame_label(thread_frame))
+                thread_frame = thread_frame.f_back
+            if thread_frame is not None:
+                stack.extend(reversed(running))
+        return stack
+
+profile_store: "OrderedDict[str, dict]" = OrderedDict()
+
+def is_admin(request: Request) -> bool:
+    token = request.headers.get("X-Admin-Token")
+    return bool(ADMIN_TOKEN and token and hmac.compare_digest(token, ADMIN_TOKEN))
+
+def require_admin(request: Request):
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Acceso denegado")
+
+async def profile_request(request: Request):
+    """Profile the request if an admin asks for it or it is picked by sampling"""
+    requested = request.headers.get("X-Profile") == "1" and is_admin(request)
+    if not requested and not (PROFILER_SAMPLE_RATE and random.random() < PROFILER_SAMPLE_RATE):
+        yield
+        return
+
+    sampler = TaskSampler(asyncio.current_task(), PROFILER_INTERVAL_MS / 1000)
+    started_at = datetime.now(timezone.utc).isoformat()
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        profile_id = uuid.uuid4().hex[:12]
+        profile_store[profile_id] = {
+            "profile_id": profile_id,
+            "method": request.method,
+            "path": request.url.path,
+            "started_at": started_at,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "interval_ms": PROFILER_INTERVAL_MS,
+            "samples": sampler.samples,
+            "stacks": sampler.stacks
+        }
+        while len(profile_store) > PROFILER_STORE_SIZE:
+            profile_store.popitem(last=False)
+        request.state.profile_id = profile_id
+
+# ==================== DEADLINES ====================
+
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+def query_deadline_ms() -> Optional[int]:
+    """Remaining request budget, to pass as maxTimeMS to the next query"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return max(int((deadline - time.monotonic()) * 1000), 1)
+
+def aggregate_options() -> dict:
+    """The same budget for aggregate(), which sends its options verbatim"""
+    max_time_ms = query_deadline_ms()
+    return {} if max_time_ms is None else {"maxTimeMS": max_time_ms}
+
+def remaining_seconds(default: float) -> float:
+    """Timeout for an outbound call: the remaining budget, capped at `default`"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return default
+    return max(min(deadline - time.monotonic(), default), 0.001)
+
+class CircuitBreaker:
+    """Opens when errors dominate a rolling window of request outcomes.
+
+    While open, callers fail fast or serve degraded data; once the cooldown
+    has passed, the next outcome either closes it or opens it again.
+    """
+
+    def __init__(self, window_s: int, min_requests: int, error_rate: float, cooldown_s: float):
+        self.window_s = window_s
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.cooldown_s = cooldown_s
+        self.opened_at: Optional[float] = None
+        self._buckets = deque()  # [second, requests, failures], one per second
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if self.is_open() else "half_open"
+
+    def is_open(self) -> bool:
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown_s
+
+    def record(self, failed: bool):
+        now = time.monotonic()
+        if self.opened_at is not None:
+            if self.is_open():
+                return
+            # Half-open: this outcome decides
+            if failed:
+                self.opened_at = now
+            else:
+                self.opened_at = None
+                self._buckets.clear()
+            return
+
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        while self._buckets[0][0] <= second - self.window_s:
+            self._buckets.popleft()
+        self._buckets[-1][1] += 1
+        self._buckets[-1][2] += failed
+
+        requests = sum(b[1] for b in self._buckets)
+        failures = sum(b[2] for b in self._buckets)
+        if requests >= self.min_requests and failures / requests >= self.error_rate:
+            self.opened_at = now
+            logger.warning("Mongo circuit breaker opened: %s/%s requests failed", failures, requests)
+
+mongo_breaker = CircuitBreaker(
+    window_s=BREAKER_WINDOW_SECONDS,
+    min_requests=BREAKER_MIN_REQUESTS,
+    error_rate=BREAKER_ERROR_RATE,
+    cooldown_s=BREAKER_COOLDOWN_SECONDS
+)
+
+# Catalog reads that fall back to the snapshot while the breaker is open
+DEGRADABLE_ROUTES = {
+    "/api/treatments",
+    "/api/treatments/{treatment_id}",
+    "/api/clinics",
+    "/api/clinics/clusters",
+    "/api/clinics/{clinic_id}",
+    "/api/cities",
+    "/api/compare",
+    "/api/compare/{snapshot_id}",
+}
+
+def degraded_snapshot() -> "CatalogSnapshot":
+    """Snapshot to serve from while Mongo is failing, or fail fast"""
+    snapshot = catalog_snapshot()
+    if not snapshot:
+        raise HTTPException(status_code=503, detail="Servicio temporalmente no disponible")
+    return snapshot
+
+def degraded_response(content) -> JSONResponse:
+    return JSONResponse(content, headers={"X-Degraded": "1"})
+
+# Server error codes for queries that are invalid as sent: BadValue,
+# FailedToParse and an invalid $regex
+INVALID_QUERY_CODES = {2, 9, 51091}
+
+class DeadlineRoute(APIRoute):
+    """Runs each endpoint within its route's time budget.
+
+    The deadline is published through `request_deadline` so Mongo queries
+    (maxTimeMS) and outbound HTTP calls give up no later than the request.
+    Mongo failures and timeouts feed the circuit breaker, and so do the
+    outcomes of requests that sent Mongo at least one command.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        budget_ms = ROUTE_BUDGETS_MS.get(self.path, REQUEST_BUDGET_MS)
+        budget_s = budget_ms / 1000 if budget_ms else None
+        # A batch does no Mongo work of its own; its sub-requests are guarded
+        guarded = self.path not in ("/api/health", "/api/ready", "/api/batch") and not self.path.startswith("/api/admin/")
+        degradable = self.path in DEGRADABLE_ROUTES
+
+        async def deadline_handler(request: Request) -> Response:
+            if guarded and not degradable and mongo_breaker.is_open():
+                raise HTTPException(status_code=503, detail="Servicio temporalmente no disponible")
+            token = request_deadline.set(time.monotonic() + budget_s if budget_s else None)
+            usage = MongoUsage()
+            usage_token = request_mongo_usage.set(usage)
+            try:
+                async with asyncio.timeout(budget_s):
+                    response = await handler(request)
+            # Only an unreachable or slow Mongo feeds the breaker; errors a
+            # request brings on itself must not shut the site for everyone
+            except TimeoutError:
+                if guarded and usage.issued:
+                    mongo_breaker.record(failed=True)
+                raise HTTPException(status_code=504, detail="La solicitud ha excedido el tiempo límite")
+            except (ExecutionTimeout, NetworkTimeout):
+                if guarded:
+                    mongo_breaker.record(failed=True)
+                raise HTTPException(status_code=504, detail="La solicitud ha excedido el tiempo límite")
+            except (AutoReconnect, ServerSelectionTimeoutError):
+                logger.exception("Mongo unavailable on %s", self.path)
+                if guarded:
+                    mongo_breaker.record(failed=True)
+                raise HTTPException(status_code=503, detail="Servicio temporalmente no disponible")
+            except httpx.TimeoutException:
+                raise HTTPException(status_code=504, detail="La solicitud ha excedido el tiempo límite")
+            except HTTPException as e:
+                # A 404 or 401 still means Mongo answered
+                if guarded and usage.issued and e.status_code < 500:
+                    mongo_breaker.record(failed=False)
+                raise
+            except DuplicateKeyError:
+                raise HTTPException(status_code=409, detail="El recurso ya existe")
+            except OperationFailure as e:
+                if e.code in INVALID_QUERY_CODES:
+                    raise HTTPException(status_code=400, detail="Parámetros de búsqueda inválidos")
+                logger.exception("Mongo error on %s", self.path)
+                raise HTTPException(status_code=500, detail="Error interno del servidor")
+            except PyMongoError:
+                logger.exception("Mongo error on %s", self.path)
+                raise HTTPException(status_code=500, detail="Error interno del servidor")
+            finally:
+                request_mongo_usage.reset(usage_token)
+                request_deadline.reset(token)
+            if guarded and usage.issued and "X-Degraded" not in response.headers:
+                mongo_breaker.record(failed=False)
+            return response
+
+        return deadline_handler
+
+# ==================== LIFECYCLE ====================
+
+warmup_state = {"status": "pending", "duration_ms": None, "error": None}
+
+async def warm_up():
+    """Pre-open the minimum pool on the primary and catalog read targets"""
+    started = time.perf_counter()
+    warmup_state.update(status="warming", error=None)
+    try:
+        # Concurrent pings each check out their own connection
+        pings = max(MONGO_POOL_OPTIONS["minPoolSize"], 1)
+        await asyncio.gather(*(db.command("ping") for _ in range(pings)))
+        # command() runs on the primary unless told otherwise
+        await asyncio.gather(*(
+            catalog_db.command("ping", read_preference=catalog_db.read_preference) for _ in range(pings)
+        ))
+        await refresh_catalog_snapshot()
+        catalog_snapshot()
+        warmup_state["status"] = "ready"
+    except Exception as e:
+        logger.exception("Warm-up failed")
+        warmup_state.update(status="failed", error=str(e))
+    warmup_state["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+async def ensure_indexes():
+    await db.clinic_treatments.create_index("id")
+    await db.catalog_events.create_index("created_at", expireAfterSeconds=CATALOG_EVENTS_TTL_SECONDS)
+    await db.catalog_events.create_index("version")
+    await db.compare_snapshots.create_index("created_at", expireAfterSeconds=COMPARE_SNAPSHOT_TTL_SECONDS)
+    await db.slots.create_index("slot_id", unique=True)
+    await db.slots.create_index([("clinic_id", 1), ("treatment_id", 1), ("starts_at", 1)], unique=True)
+    await db.bookings.create_index("booking_id", unique=True)
+    await db.bookings.create_index("expires_at", expireAfterSeconds=0)
+    await db.reviews.create_index([("clinic_id", 1), ("user_id", 1)], unique=True)
+    await db.reviews.create_index([("clinic_id", 1), ("created_at", -1), ("review_id", -1)])
+    await db.search_events.create_index("at", expireAfterSeconds=SEARCH_EVENTS_TTL_DAYS * 86400)
+    await db.search_events.create_index([("route", 1), ("at", 1)])
+    await db.session_revocations.create_index("sid", unique=True)
+    await db.session_revocations.create_index("revoked_at")
+    await db.session_revocations.create_index("expires_at", expireAfterSeconds=0)
+    if CLINIC_PROFILES_ENABLED:
+        await db.clinic_profiles.create_index("clinic_id", unique=True)
+    if PRICE_HISTORY_ENABLED:
+        await ensure_price_history()
+    if RATE_LIMIT_BACKEND == "mongo":
+        await db.rate_limit_buckets.create_index("refilled_at", expireAfterSeconds=3600)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    connect_mongo()
+    try:
+        await ensure_indexes()
+    except PyMongoError:
+        logger.exception("Index creation failed")
+    await warm_up()
+    snapshot_sync = asyncio.create_task(catalog_snapshot_sync_loop())
+    search_analytics = asyncio.create_task(search_analytics_loop())
+    revocation_sync_task = asyncio.create_task(session_revocation_loop())
+    rating_publish = asyncio.create_task(rating_publish_loop())
+    yield
+    snapshot_sync.cancel()
+    search_analytics.cancel()
+    revocation_sync_task.cancel()
+    rating_publish.cancel()
+    change_feed.stop()
+    try:
+        while search_buffer:
+            await flush_searches()
+    except PyMongoError:
+        logger.exception("Final search analytics flush failed")
+    try:
+        await publish_rating_changes()
+    except PyMongoError:
+        logger.exception("Final rating publish failed")
+    client.close()
 
 # Create the main app
-app = FastAPI(title="DentiCompare API")
+app = FastAPI(title="DentiCompare API", lifespan=lifespan, default_response_class=TimedJSONResponse)
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=DeadlineRoute, dependencies=[Depends(profile_request)])
 
 security = HTTPBearer(auto_error=False)
 
@@ -97,9 +720,40 @@ class ClinicTreatment(BaseModel):
 class ClinicWithTreatments(Clinic):
     treatments: List[dict] = []
 
+class PriceChange(BaseModel):
+    id: str
+    price: float = Field(gt=0)
+    version: int = Field(ge=0)
+
+class BulkPriceUpdate(BaseModel):
+    items: List[PriceChange]
+
+class SlotCreate(BaseModel):
+    treatment_id: str
+    starts_at: datetime
+    capacity: int = Field(default=1, ge=1, le=100)
+
+class SlotBatch(BaseModel):
+    slots: List[SlotCreate]
+
+class HoldRequest(BaseModel):
+    slot_id: str
+
+class ReviewCreate(BaseModel):
+    rating: int = Field(ge=1, le=5)
+    comment: str = Field(default="", max_length=2000)
+
+class BatchItem(BaseModel):
+    path: str  # e.g. "/api/clinics/clinic-1"
+    params: dict = {}
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem] = Field(min_length=1)
+
 class CompareRequest(BaseModel):
     clinic_ids: List[str]
     treatment_id: str
+    share: bool = False  # persist the result and return a snapshot_id
 
 class SearchFilters(BaseModel):
     city: Optional[str] = None
@@ -116,14 +770,29 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
-def create_jwt_token(user_id: str) -> str:
+# Profile fields carried in session tokens, so requests need no user lookup
+SESSION_CLAIMS = ("email", "name", "picture", "created_at")
+
+def create_session_token(user: dict) -> str:
+    """Signed session for a user doc, for both password and Google logins"""
+    now = datetime.now(timezone.utc)
+    created_at = user["created_at"]
     payload = {
-        "user_id": user_id,
-        "exp": datetime.now(timezone.utc) + timedelta(days=JWT_EXPIRATION_DAYS),
-        "iat": datetime.now(timezone.utc)
+        "sub": user["user_id"],
+        "sid": uuid.uuid4().hex,
+        "email": user["email"],
+        "name": user["name"],
+        "picture": user.get("picture"),
+        "created_at": created_at if isinstance(created_at, str) else created_at.isoformat(),
+        "exp": now + timedelta(days=JWT_EXPIRATION_DAYS),
+        "iat": now
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+def is_signed_token(token: str) -> bool:
+    """Signed tokens are JWTs; older Google sessions are opaque strings"""
+    return token.count(".") == 2
+
 def decode_jwt_token(token: str) -> dict:
     try:
         return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
@@ -133,6 +802,19 @@ def decode_jwt_token(token: str) -> dict:
         raise HTTPException(status_code=401, detail="Token inválido")
 
 async def get_current_user(request: Request) -> User:
+    timing = request_timing.get()
+    if not timing:
+        return await _authenticate(request)
+    # Report auth's own work; its queries already count as Mongo time
+    started = time.perf_counter()
+    mongo_before = timing.mongo_ms
+    try:
+        return await _authenticate(request)
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        timing.auth_ms += max(elapsed_ms - (timing.mongo_ms - mongo_before), 0.0)
+
+def request_session_token(request: Request) -> Optional[str]:
     # Check cookie first
     session_token = request.cookies.get("session_token")
     
@@ -141,26 +823,35 @@ async def get_current_user(request: Request) -> User:
         auth_header = request.headers.get("Authorization")
         if auth_header and auth_header.startswith("Bearer "):
             session_token = auth_header.split(" ")[1]
+    return session_token
+
+async def _authenticate(request: Request) -> User:
+    session_token = request_session_token(request)
     
     if not session_token:
         raise HTTPException(status_code=401, detail="No autenticado")
     
-    # Check if it's a JWT token (for email/password auth)
-    try:
+    if is_signed_token(session_token):
         payload = decode_jwt_token(session_token)
+        if "sid" in payload:
+            if session_revoked(payload["sid"]):
+                raise HTTPException(status_code=401, detail="Sesión cerrada")
+            return User(user_id=payload["sub"], **{claim: payload.get(claim) for claim in SESSION_CLAIMS})
+        # Tokens from before sessions carried claims hold only the user id
         user_doc = await db.users.find_one(
-            {"user_id": payload["user_id"]},
-            {"_id": 0}
+            {"user_id": payload.get("user_id")},
+            {"_id": 0},
+            max_time_ms=query_deadline_ms()
         )
-        if user_doc:
-            return User(**user_doc)
-    except:
-        pass
+        if not user_doc:
+            raise HTTPException(status_code=401, detail="Usuario no encontrado")
+        return User(**user_doc)
     
-    # Check if it's a session token (for Google auth)
+    # Opaque session token from an earlier Google login
     session_doc = await db.user_sessions.find_one(
         {"session_token": session_token},
-        {"_id": 0}
+        {"_id": 0},
+        max_time_ms=query_deadline_ms()
     )
     
     if not session_doc:
@@ -177,7 +868,8 @@ async def get_current_user(request: Request) -> User:
     
     user_doc = await db.users.find_one(
         {"user_id": session_doc["user_id"]},
-        {"_id": 0}
+        {"_id": 0},
+        max_time_ms=query_deadline_ms()
     )
     
     if not user_doc:
@@ -185,12 +877,158 @@ async def get_current_user(request: Request) -> User:
     
     return User(**user_doc)
 
+# ==================== SESSION REVOCATION ====================
+
+# Session tokens are checked by signature alone. Logging out records the
+# session id in session_revocations until the token would have expired
+# anyway; every worker keeps those ids in memory and pulls new ones every
+# SESSION_REVOCATION_SYNC_SECONDS. A logout applies at once on the worker
+# that handled it and within one sync interval everywhere else.
+revoked_sessions: dict = {}  # sid -> token expiry (unix seconds)
+revocation_sync = {"since": None}
+
+# Re-read this much history on each sync, so revocations stamped by a
+# worker with a slightly late clock are not skipped
+REVOCATION_SYNC_OVERLAP = timedelta(seconds=60)
+
+def session_revoked(sid: str) -> bool:
+    return sid in revoked_sessions
+
+async def revoke_session(sid: str, expires_at: datetime):
+    revoked_sessions[sid] = expires_at.timestamp()
+    await db.session_revocations.update_one(
+        {"sid": sid},
+        {"$setOnInsert": {"sid": sid, "expires_at": expires_at, "revoked_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+async def sync_revocations() -> int:
+    """Pull revocations recorded since the last sync and forget expired ones"""
+    started = datetime.now(timezone.utc)
+    query = {"expires_at": {"$gt": started}}
+    if revocation_sync["since"]:
+        query["revoked_at"] = {"$gte": revocation_sync["since"]}
+    docs = await db.session_revocations.find(query, {"_id": 0, "sid": 1, "expires_at": 1}).to_list(None)
+    for doc in docs:
+        revoked_sessions[doc["sid"]] = _as_utc(doc["expires_at"]).timestamp()
+    now = started.timestamp()
+    for sid in [sid for sid, expires in revoked_sessions.items() if expires <= now]:
+        del revoked_sessions[sid]
+    revocation_sync["since"] = started - REVOCATION_SYNC_OVERLAP
+    return len(docs)
+
+async def session_revocation_loop():
+    while True:
+        try:
+            await sync_revocations()
+        except PyMongoError:
+            logger.exception("Session revocation sync failed")
+        await asyncio.sleep(SESSION_REVOCATION_SYNC_SECONDS)
+
+# ==================== RATE LIMITING ====================
+
+class TokenBucketLimiter:
+    """Per-worker token buckets kept in a bounded LRU.
+
+    Evicting a bucket only forgets that client's spent tokens, so under
+    key pressure the limiter errs towards letting requests through.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()  # key -> [tokens, refilled_at]
+
+    async def acquire(self, key: str, burst: float, rate: float) -> float:
+        """Take a token; return 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = [tokens, now]
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+class MongoTokenBucketLimiter:
+    """Token buckets in Mongo, shared by every worker.
+
+    Refill and take happen in one pipeline update on the server clock;
+    idle buckets are removed by a TTL index on `refilled_at`.
+    """
+
+    async def acquire(self, key: str, burst: float, rate: float) -> float:
+        elapsed_s = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$refilled_at", "$$NOW"]}]}, 1000]}
+        bucket = await db.rate_limit_buckets.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {
+                    "tokens": {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed_s, rate]}]}]},
+                    "refilled_at": "$$NOW"
+                }},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return 0.0 if bucket["allowed"] else (1 - bucket["tokens"]) / rate
+
+rate_limiter = MongoTokenBucketLimiter() if RATE_LIMIT_BACKEND == "mongo" else TokenBucketLimiter(RATE_LIMIT_MAX_KEYS)
+
+async def enforce_rate_limit(route: str, dimension: str, value: Optional[str]):
+    """Raise 429 with Retry-After when `value` is out of tokens for this route"""
+    limit = RATE_LIMITS.get(route, {}).get(dimension)
+    if not limit or not value:
+        return
+    try:
+        wait = await rate_limiter.acquire(f"{route}:{dimension}:{value.lower()}", limit["burst"], limit["rate"])
+    except PyMongoError:
+        logger.warning("Rate limiter backend unavailable, allowing request")
+        return
+    if wait > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiadas solicitudes, inténtalo más tarde",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+def _is_trusted_proxy(address: Optional[str]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except (TypeError, ValueError):
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def client_ip(request: Request) -> Optional[str]:
+    """The caller's address, seen through trusted proxies"""
+    peer = request.client.host if request.client else None
+    if not _is_trusted_proxy(peer):
+        return peer
+    hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+    # Walk back from our own proxy; anything left of the first untrusted
+    # hop was written by the client and may be forged
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+def rate_limit(route: str):
+    """Dependency limiting `route` per client IP"""
+    async def limit_by_ip(request: Request):
+        await enforce_rate_limit(route, "ip", client_ip(request))
+    return limit_by_ip
+
 # ==================== AUTH ENDPOINTS ====================
 
-@api_router.post("/auth/register")
+@api_router.post("/auth/register", dependencies=[Depends(rate_limit("auth/register"))])
 async def register(user_data: UserCreate, response: Response):
+    await enforce_rate_limit("auth/register", "email", user_data.email)
     # Check if user exists
-    existing = await db.users.find_one({"email": user_data.email})
+    existing = await db.users.find_one({"email": user_data.email}, max_time_ms=query_deadline_ms())
     if existing:
         raise HTTPException(status_code=400, detail="El email ya está registrado")
     
@@ -208,7 +1046,7 @@ async def register(user_data: UserCreate, response: Response):
     
     await db.users.insert_one(user_doc)
     
-    token = create_jwt_token(user_id)
+    token = create_session_token(user_doc)
     
     response.set_cookie(
         key="session_token",
@@ -227,9 +1065,10 @@ async def register(user_data: UserCreate, response: Response):
         "token": token
     }
 
-@api_router.post("/auth/login")
+@api_router.post("/auth/login", dependencies=[Depends(rate_limit("auth/login"))])
 async def login(credentials: UserLogin, response: Response):
-    user_doc = await db.users.find_one({"email": credentials.email}, {"_id": 0})
+    await enforce_rate_limit("auth/login", "email", credentials.email)
+    user_doc = await db.users.find_one({"email": credentials.email}, {"_id": 0}, max_time_ms=query_deadline_ms())
     
     if not user_doc:
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
@@ -237,7 +1076,7 @@ async def login(credentials: UserLogin, response: Response):
     if "password" not in user_doc or not verify_password(credentials.password, user_doc["password"]):
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
     
-    token = create_jwt_token(user_doc["user_id"])
+    token = create_session_token(user_doc)
     
     response.set_cookie(
         key="session_token",
@@ -257,7 +1096,7 @@ async def login(credentials: UserLogin, response: Response):
         "token": token
     }
 
-@api_router.post("/auth/session")
+@api_router.post("/auth/session", dependencies=[Depends(rate_limit("auth/session"))])
 async def process_session(request: Request, response: Response):
     """Process Google OAuth session_id and create local session"""
     body = await request.json()
@@ -267,7 +1106,7 @@ async def process_session(request: Request, response: Response):
         raise HTTPException(status_code=400, detail="session_id requerido")
     
     # Call Emergent auth to get user data
-    async with httpx.AsyncClient() as client_http:
+    async with httpx.AsyncClient(timeout=remaining_seconds(10.0)) as client_http:
         resp = await client_http.get(
             "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
             headers={"X-Session-ID": session_id}
@@ -279,7 +1118,7 @@ async def process_session(request: Request, response: Response):
         user_data = resp.json()
     
     # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data["email"]}, {"_id": 0})
+    existing_user = await db.users.find_one({"email": user_data["email"]}, {"_id": 0}, max_time_ms=query_deadline_ms())
     
     if existing_user:
         user_id = existing_user["user_id"]
@@ -291,26 +1130,20 @@ async def process_session(request: Request, response: Response):
                 "picture": user_data.get("picture")
             }}
         )
+        user_doc = {**existing_user, "name": user_data["name"], "picture": user_data.get("picture")}
     else:
         user_id = f"user_{uuid.uuid4().hex[:12]}"
-        await db.users.insert_one({
+        user_doc = {
             "user_id": user_id,
             "email": user_data["email"],
             "name": user_data["name"],
             "picture": user_data.get("picture"),
             "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        }
+        await db.users.insert_one(user_doc)
     
     # Create session
-    session_token = user_data.get("session_token", f"session_{uuid.uuid4().hex}")
-    expires_at = datetime.now(timezone.utc) + timedelta(days=7)
-    
-    await db.user_sessions.insert_one({
-        "user_id": user_id,
-        "session_token": session_token,
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    session_token = create_session_token(user_doc)
     
     response.set_cookie(
         key="session_token",
@@ -319,7 +1152,7 @@ async def process_session(request: Request, response: Response):
         secure=True,
         samesite="none",
         path="/",
-        max_age=7 * 24 * 60 * 60
+        max_age=JWT_EXPIRATION_DAYS * 24 * 60 * 60
     )
     
     return {
@@ -340,39 +1173,1129 @@ async def get_me(user: User = Depends(get_current_user)):
 
 @api_router.post("/auth/logout")
 async def logout(request: Request, response: Response):
-    session_token = request.cookies.get("session_token")
+    session_token = request_session_token(request)
     
-    if session_token:
+    if session_token and is_signed_token(session_token):
+        try:
+            payload = jwt.decode(session_token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        except jwt.InvalidTokenError:
+            payload = {}  # expired or forged: nothing to revoke
+        if "sid" in payload:
+            await revoke_session(payload["sid"], datetime.fromtimestamp(payload["exp"], timezone.utc))
+    elif session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
     
     response.delete_cookie(key="session_token", path="/", samesite="none", secure=True)
     
     return {"message": "Sesión cerrada correctamente"}
 
+# ==================== CATALOG ====================
+
+OFFER_FIELDS = ("price", "duration_days", "warranty_months", "process_steps", "includes")
+
+# Review bookkeeping kept on clinics (see REVIEW ENDPOINTS); never served
+RATING_AGGREGATE_FIELDS = ("rating_sum", "base_rating_sum", "base_review_count")
+CLINIC_PROJECTION = {"_id": 0, **{field: 0 for field in RATING_AGGREGATE_FIELDS}}
+
+def treatment_offer(treatment: dict, ct: dict) -> dict:
+    """Treatment details merged with one clinic's offer for it"""
+    return {**treatment, **{field: ct[field] for field in OFFER_FIELDS if field in ct}}
+
+def clinic_profile(clinic: dict, offers: List[dict], treatments_by_id: dict) -> dict:
+    """A clinic with its offers, as returned by GET /clinics/{id}"""
+    return {
+        **clinic,
+        "treatments": [
+            treatment_offer(treatments_by_id[ct["treatment_id"]], ct)
+            for ct in offers
+            if ct["treatment_id"] in treatments_by_id
+        ]
+    }
+
+# Sparse fieldsets: `fields=name,city,...` on the clinic endpoints selects
+# what is read from Mongo and sent. clinic_id is always included.
+OFFER_DETAIL_FIELDS = set(Treatment.model_fields) | (set(ClinicTreatment.model_fields) - {"id", "clinic_id"})
+CLINIC_LIST_FIELDS = set(Clinic.model_fields) | {"treatment_price", "treatment_duration"}
+CLINIC_DETAIL_FIELDS = set(Clinic.model_fields) | {"treatments"} | {f"treatments.{f}" for f in OFFER_DETAIL_FIELDS}
+
+def parse_fields(fields: Optional[str], allowed: set) -> Optional[str]:
+    """Validate a fields= value; return it canonical (sorted, deduplicated)"""
+    if not fields:
+        return None
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos no válidos: {', '.join(sorted(unknown))}")
+    if "treatments" in names:
+        names = {name for name in names if not name.startswith("treatments.")}
+    return ",".join(sorted(names)) or None
+
+def fields_projection(fields: str) -> dict:
+    return {"_id": 0, "clinic_id": 1, **{name: 1 for name in fields.split(",")}}
+
+def offer_fields(fields: str) -> Optional[set]:
+    """Requested fields of each offer: None for all of them"""
+    names = fields.split(",")
+    if "treatments" in names:
+        return None
+    return {name.split(".", 1)[1] for name in names if name.startswith("treatments.")}
+
+def sparse(doc: dict, fields: str) -> dict:
+    """Keep only the requested fields of a response document"""
+    names = fields.split(",")
+    out = {k: doc[k] for k in ["clinic_id", *names] if k in doc}
+    nested = [name.split(".", 1)[1] for name in names if name.startswith("treatments.")]
+    if nested and "treatments" in doc:
+        out["treatments"] = [{k: t[k] for k in nested if k in t} for t in doc["treatments"]]
+    return out
+
+async def get_catalog_version() -> int:
+    meta = await db.catalog_meta.find_one({"_id": "catalog"})
+    return meta["version"] if meta else 0
+
+async def bump_catalog_version() -> int:
+    """Record a catalog write and return the new catalog version"""
+    meta = await db.catalog_meta.find_one_and_update(
+        {"_id": "catalog"},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return meta["version"]
+
+# ==================== CATALOG SNAPSHOT ====================
+
+# Every worker on a host maps the same read-only snapshot file, so the catalog
+# lives once in the page cache instead of once per worker. The CURRENT file
+# names the live generation (the catalog version it was built from); writers
+# replace it atomically and readers switch on their next check.
+SNAPSHOT_MAGIC = b"DCSNAP01"
+SNAPSHOT_HEADER = struct.Struct("<8sQQQ")  # magic, generation, index offset, index length
+
+class CatalogSnapshot:
+    """Memory-mapped view of one catalog generation.
+
+    Records are ready-to-send JSON bodies located through a small
+    key -> (offset, length) index kept at the end of the file.
+    """
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, index_offset, index_length = SNAPSHOT_HEADER.unpack_from(self._mm)
+        if magic != SNAPSHOT_MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not a catalog snapshot")
+        self._index = json.loads(self._mm[index_offset:index_offset + index_length])
+
+    def raw(self, key: str) -> Optional[bytes]:
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self._mm[offset:offset + length]
+
+    def get(self, key: str):
+        body = self.raw(key)
+        return None if body is None else json.loads(body)
+
+    def close(self):
+        self._mm.close()
+
+_snapshot: Optional[CatalogSnapshot] = None
+_snapshot_checked_at = 0.0
+
+def _dump_json(obj) -> bytes:
+    # Same encoding as Starlette's JSONResponse
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+def _snapshot_path(generation: int) -> Path:
+    return CATALOG_SNAPSHOT_DIR / f"catalog-{generation}.snap"
+
+def _current_snapshot_generation() -> Optional[int]:
+    try:
+        return int((CATALOG_SNAPSHOT_DIR / "CURRENT").read_text())
+    except (OSError, ValueError):
+        return None
+
+def catalog_snapshot() -> Optional[CatalogSnapshot]:
+    """The snapshot this worker serves from, or None to fall back to Mongo"""
+    global _snapshot, _snapshot_checked_at
+    if not CATALOG_SNAPSHOT_ENABLED:
+        return None
+    now = time.monotonic()
+    if now - _snapshot_checked_at < CATALOG_SNAPSHOT_CHECK_SECONDS:
+        return _snapshot
+    _snapshot_checked_at = now
+
+    generation = _current_snapshot_generation()
+    if generation is None or (_snapshot and _snapshot.generation == generation):
+        return _snapshot
+    try:
+        fresh = CatalogSnapshot(_snapshot_path(generation))
+    except (OSError, ValueError):
+        logger.warning("Could not map catalog snapshot generation %s", generation)
+        return _snapshot
+    previous, _snapshot = _snapshot, fresh
+    if previous:
+        previous.close()
+    return _snapshot
+
+async def _build_snapshot_records() -> dict:
+    # Read from the primary: the snapshot must include the write that triggered it
+    treatments = await db.treatments.find({}, {"_id": 0}).to_list(None)
+    clinics = await db.clinics.find({}, CLINIC_PROJECTION).to_list(None)
+    offers = await db.clinic_treatments.find({}, {"_id": 0}).to_list(None)
+
+    treatments_by_id = {t["treatment_id"]: t for t in treatments}
+    offers_by_clinic = {}
+    for ct in offers:
+        offers_by_clinic.setdefault(ct["clinic_id"], []).append(ct)
+
+    records = {
+        "treatments": _dump_json([Treatment(**t).model_dump() for t in treatments]),
+        "cities": _dump_json(sorted(set(c["city"] for c in clinics))),
+        "clinics": _dump_json(clinics),
+        "offers": _dump_json(offers),
+    }
+    for t in treatments:
+        records[f"treatment:{t['treatment_id']}"] = _dump_json(Treatment(**t).model_dump())
+    for clinic in clinics:
+        records[f"clinic:{clinic['clinic_id']}"] = _dump_json(
+            clinic_profile(clinic, offers_by_clinic.get(clinic["clinic_id"], []), treatments_by_id)
+        )
+    return records
+
+def _write_snapshot(generation: int, records: dict) -> bool:
+    CATALOG_SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    with open(CATALOG_SNAPSHOT_DIR / "build.lock", "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another worker on this host is publishing
+            return False
+        current = _current_snapshot_generation()
+        if current is not None and current >= generation:
+            return False
+
+        path = _snapshot_path(generation)
+        tmp_path = path.with_suffix(".tmp")
+        index = {}
+        with open(tmp_path, "wb") as f:
+            f.write(bytes(SNAPSHOT_HEADER.size))
+            offset = SNAPSHOT_HEADER.size
+            for key, body in records.items():
+                f.write(body)
+                index[key] = (offset, len(body))
+                offset += len(body)
+            index_bytes = _dump_json(index)
+            f.write(index_bytes)
+            f.seek(0)
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, generation, offset, len(index_bytes)))
+        os.replace(tmp_path, path)
+
+        pointer_tmp = CATALOG_SNAPSHOT_DIR / "CURRENT.tmp"
+        pointer_tmp.write_text(str(generation))
+        os.replace(pointer_tmp, CATALOG_SNAPSHOT_DIR / "CURRENT")
+
+        # Workers still mapping an unlinked file keep reading it until they switch
+        for old in CATALOG_SNAPSHOT_DIR.glob("catalog-*.snap"):
+            if old != path:
+                old.unlink(missing_ok=True)
+        return True
+
+async def refresh_catalog_snapshot(version: Optional[int] = None):
+    """Publish a snapshot for `version` (default: current) if the host is behind"""
+    global _snapshot_checked_at
+    if not CATALOG_SNAPSHOT_ENABLED:
+        return
+    if version is None:
+        version = await get_catalog_version()
+    current = _current_snapshot_generation()
+    if current is not None and current >= version:
+        return
+    records = await _build_snapshot_records()
+    if await asyncio.to_thread(_write_snapshot, version, records):
+        logger.info("Published catalog snapshot generation %s", version)
+    # Make this worker pick up the new generation on its next read
+    _snapshot_checked_at = 0.0
+
+async def catalog_snapshot_sync_loop():
+    """Follow catalog writes made on other hosts"""
+    while True:
+        await asyncio.sleep(CATALOG_SNAPSHOT_SYNC_SECONDS)
+        try:
+            await refresh_catalog_snapshot()
+        except Exception:
+            logger.exception("Catalog snapshot sync failed")
+
+# ==================== CLINIC PROFILES ====================
+
+# Optional read model: one `clinic_profiles` document per clinic embedding
+# its offers with the treatment details copied in, i.e. exactly what
+# GET /clinics/{id} returns. Writers call refresh_clinic_profiles() for the
+# clinics they touched; rebuild_clinic_profiles() recomputes everything
+# server-side.
+PROFILE_PROJECTION = {"_id": 0, "build_id": 0}
+
+async def refresh_clinic_profiles(clinic_ids: List[str]):
+    """Recompute the profiles of the given clinics from the primary"""
+    if not CLINIC_PROFILES_ENABLED or not clinic_ids:
+        return
+    clinics = await db.clinics.find({"clinic_id": {"$in": clinic_ids}}, CLINIC_PROJECTION).to_list(None)
+    offers = await db.clinic_treatments.find({"clinic_id": {"$in": clinic_ids}}, {"_id": 0}).to_list(None)
+    treatments_by_id = {
+        t["treatment_id"]: t
+        for t in await db.treatments.find(
+            {"treatment_id": {"$in": list({ct["treatment_id"] for ct in offers})}},
+            {"_id": 0}
+        ).to_list(None)
+    }
+    offers_by_clinic = {}
+    for ct in offers:
+        offers_by_clinic.setdefault(ct["clinic_id"], []).append(ct)
+
+    # $set rather than replace keeps the build_id of the last full rebuild
+    ops = [
+        UpdateOne(
+            {"clinic_id": clinic["clinic_id"]},
+            {"$set": clinic_profile(clinic, offers_by_clinic.get(clinic["clinic_id"], []), treatments_by_id)},
+            upsert=True
+        )
+        for clinic in clinics
+    ]
+    if ops:
+        await db.clinic_profiles.bulk_write(ops, ordered=False)
+    removed = set(clinic_ids) - {c["clinic_id"] for c in clinics}
+    if removed:
+        await db.clinic_profiles.delete_many({"clinic_id": {"$in": list(removed)}})
+
+async def refresh_profiles_for_treatments(treatment_ids: List[str], refreshed: List[str] = ()):
+    """Recompute the profiles of every clinic offering one of the treatments,
+    except the `refreshed` ones"""
+    if not CLINIC_PROFILES_ENABLED or not treatment_ids:
+        return
+    clinic_ids = await db.clinic_treatments.distinct("clinic_id", {"treatment_id": {"$in": treatment_ids}})
+    await refresh_clinic_profiles(sorted(set(clinic_ids) - set(refreshed)))
+
+async def rebuild_clinic_profiles():
+    """Recompute every profile in one aggregation ending in $merge"""
+    build_id = uuid.uuid4().hex
+    await db.clinics.aggregate([
+        {"$lookup": {
+            "from": "clinic_treatments",
+            "localField": "clinic_id",
+            "foreignField": "clinic_id",
+            "pipeline": [
+                {"$lookup": {
+                    "from": "treatments",
+                    "localField": "treatment_id",
+                    "foreignField": "treatment_id",
+                    "as": "treatment"
+                }},
+                {"$unwind": "$treatment"},
+                {"$replaceWith": {"$mergeObjects": ["$treatment", {
+                    "price": "$price",
+                    "duration_days": "$duration_days",
+                    "warranty_months": "$warranty_months",
+                    "process_steps": "$process_steps",
+                    "includes": "$includes"
+                }]}},
+                {"$unset": "_id"}
+            ],
+            "as": "treatments"
+        }},
+        {"$unset": ["_id", *RATING_AGGREGATE_FIELDS]},
+        {"$set": {"build_id": build_id}},
+        {"$merge": {"into": "clinic_profiles", "on": "clinic_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]).to_list(None)
+    # Profiles of clinics that no longer exist were not rewritten
+    await db.clinic_profiles.delete_many({"build_id": {"$ne": build_id}})
+
+# ==================== PRICE HISTORY ====================
+
+# Every offer price written is appended to the `price_history` time-series
+# collection (MongoDB 5.0+), with the offer's clinic, treatment and city as
+# bucket metadata. Trends are downsampled server-side with $dateTrunc.
+PRICE_HISTORY_INTERVALS = {
+    # interval: (default lookback, maximum lookback)
+    "day": (timedelta(days=90), timedelta(days=366)),
+    "week": (timedelta(days=365), timedelta(days=5 * 366)),
+    "month": (timedelta(days=3 * 365), timedelta(days=20 * 366)),
+}
+
+async def ensure_price_history():
+    if "price_history" not in await db.list_collection_names(filter={"name": "price_history"}):
+        options = {"timeseries": {"timeField": "ts", "metaField": "meta", "granularity": "hours"}}
+        if PRICE_HISTORY_RETENTION_DAYS:
+            options["expireAfterSeconds"] = PRICE_HISTORY_RETENTION_DAYS * 86400
+        await db.create_collection("price_history", **options)
+    await db.price_history.create_index([("meta.treatment_id", 1), ("meta.city", 1), ("ts", 1)])
+
+async def record_prices(offers: List[dict], city_by_clinic: dict, ts: Optional[datetime] = None):
+    """Append the current price of each offer to the price history"""
+    if not PRICE_HISTORY_ENABLED or not offers:
+        return
+    ts = ts or datetime.now(timezone.utc)
+    await db.price_history.insert_many([
+        {
+            "ts": ts,
+            "meta": {
+                "clinic_id": ct["clinic_id"],
+                "treatment_id": ct["treatment_id"],
+                "city": city_by_clinic.get(ct["clinic_id"])
+            },
+            "price": ct["price"]
+        }
+        for ct in offers
+    ], ordered=False)
+
+# ==================== CATALOG EVENTS ====================
+
+async def publish_catalog_change(kind: str, clinic_ids: List[str], treatment_ids: List[str]) -> int:
+    """Announce one catalog write, however many rows it touched.
+
+    Bumps the catalog version, logs a `catalog_events` entry naming what
+    changed and refreshes this worker's derived views once. Other workers
+    pick the new version up on their next snapshot sync.
+    """
+    version = await bump_catalog_version()
+    await db.catalog_events.insert_one({
+        "version": version,
+        "kind": kind,
+        "clinic_ids": clinic_ids,
+        "treatment_ids": treatment_ids,
+        "created_at": datetime.now(timezone.utc)
+    })
+    await refresh_clinic_profiles(clinic_ids)
+    # Profiles embed treatment details, so clinics offering a changed
+    # treatment need refreshing too
+    await refresh_profiles_for_treatments(treatment_ids, refreshed=clinic_ids)
+    await refresh_catalog_snapshot(version)
+    return version
+
+# ==================== LIVE UPDATES ====================
+
+# Compare pages subscribe over SSE to a treatment at a few clinics. Each
+# worker follows catalog_events with one change stream (or one polling
+# query with CHANGE_FEED_MODE=poll, e.g. on a standalone mongod) and fans
+# each batch out to the affected subscriptions only.
+LIVE_OFFER_FIELDS = {"_id": 0, "clinic_id": 1, "treatment_id": 1, "price": 1,
+                     "duration_days": 1, "warranty_months": 1, "version": 1}
+
+class Subscription:
+    """One SSE client: a bounded queue of pending events"""
+    __slots__ = ("clinic_ids", "treatment_id", "queue", "sent")
+
+    def __init__(self, clinic_ids: List[str], treatment_id: str):
+        self.clinic_ids = clinic_ids
+        self.treatment_id = treatment_id
+        self.queue = asyncio.Queue(LIVE_QUEUE_SIZE)
+        self.sent = {}  # clinic_id -> last offer state sent
+
+    def push_offer(self, event_id: int, delta: dict):
+        """Queue an offer change unless the client already has this state"""
+        if self.sent.get(delta["clinic_id"]) != delta:
+            self.sent[delta["clinic_id"]] = delta
+            self.push(("offer", event_id, delta))
+
+    def push(self, event: tuple):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client this far behind gets the full state again instead
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(("resync", None, {}))
+
+def offer_delta(clinic_id: str, treatment_id: str, ct: Optional[dict]) -> dict:
+    if ct is None:
+        return {"clinic_id": clinic_id, "treatment_id": treatment_id, "removed": True}
+    return {**ct, "version": ct.get("version", 0)}
+
+def _newer_offer(delta: dict, than: dict) -> bool:
+    """Whether `delta` is a later state of the offer than `than`"""
+    if delta.get("removed"):
+        return not than.get("removed")
+    if than.get("removed"):
+        return True
+    return delta["version"] > than["version"]
+
+class CatalogChangeFeed:
+    """Per-worker fan-out of catalog changes to live subscriptions"""
+
+    def __init__(self):
+        self._by_clinic = {}
+        self._task: Optional[asyncio.Task] = None
+        self._mode = CHANGE_FEED_MODE
+        self.version = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return len({id(sub) for subs in self._by_clinic.values() for sub in subs})
+
+    async def subscribe(self, clinic_ids: List[str], treatment_id: str) -> Subscription:
+        """Register a client and load its current state into `sub.sent`"""
+        if self._task is None or self._task.done():
+            self.version = await get_catalog_version()
+            self._task = asyncio.create_task(self._run())
+        sub = Subscription(clinic_ids, treatment_id)
+        for clinic_id in clinic_ids:
+            self._by_clinic.setdefault(clinic_id, set()).add(sub)
+        try:
+            # Registered first, so no change dispatched from here on is missed
+            offers = await db.clinic_treatments.find(
+                {"clinic_id": {"$in": clinic_ids}, "treatment_id": treatment_id},
+                LIVE_OFFER_FIELDS,
+                max_time_ms=query_deadline_ms()
+            ).to_list(None)
+        except BaseException:
+            self.unsubscribe(sub)
+            raise
+        by_clinic = {ct["clinic_id"]: ct for ct in offers}
+        state = {c: offer_delta(c, treatment_id, by_clinic.get(c)) for c in clinic_ids}
+        # Changes dispatched during the read were read on other connections
+        # and may be newer or older than what it returned: keep the later
+        # state of each offer and send it as part of the initial one
+        other = []
+        while not sub.queue.empty():
+            event = sub.queue.get_nowait()
+            if event[0] != "offer":
+                other.append(event)
+            elif _newer_offer(event[2], state[event[2]["clinic_id"]]):
+                state[event[2]["clinic_id"]] = event[2]
+        for event in other:
+            sub.queue.put_nowait(event)
+        sub.sent.update(state)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        for clinic_id in sub.clinic_ids:
+            subs = self._by_clinic.get(clinic_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._by_clinic[clinic_id]
+        if not self._by_clinic and self._task:
+            self._task.cancel()
+            self._task = None
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if self._mode == "watch":
+                    await self._watch()
+                else:
+                    await self._poll()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == 40573:  # change streams need a replica set
+                    logger.warning("Change streams unavailable, polling catalog events")
+                    self._mode = "poll"
+                    continue
+                logger.exception("Catalog change feed failed")
+                await asyncio.sleep(CHANGE_FEED_POLL_SECONDS)
+            except Exception:
+                logger.exception("Catalog change feed failed")
+                await asyncio.sleep(CHANGE_FEED_POLL_SECONDS)
+
+    async def _watch(self):
+        async with db.catalog_events.watch([{"$match": {"operationType": "insert"}}]) as stream:
+            # Events written before the stream opened
+            await self._catch_up()
+            async for change in stream:
+                await self._dispatch(change["fullDocument"])
+
+    async def _poll(self):
+        while True:
+            await self._catch_up()
+            await asyncio.sleep(CHANGE_FEED_POLL_SECONDS)
+
+    async def _catch_up(self):
+        events = await db.catalog_events.find(
+            {"version": {"$gt": self.version}}, {"_id": 0}
+        ).sort("version", 1).to_list(None)
+        for event in events:
+            await self._dispatch(event)
+
+    async def _dispatch(self, event: dict):
+        if event["version"] <= self.version:
+            return
+        self.version = event["version"]
+        treatment_ids = set(event["treatment_ids"])
+        clinic_ids = [c for c in event["clinic_ids"] if c in self._by_clinic]
+        if not clinic_ids:
+            return
+        offers = await db.clinic_treatments.find(
+            {"clinic_id": {"$in": clinic_ids}, "treatment_id": {"$in": list(treatment_ids)}},
+            LIVE_OFFER_FIELDS
+        ).to_list(None)
+        by_key = {(ct["clinic_id"], ct["treatment_id"]): ct for ct in offers}
+        for clinic_id in clinic_ids:
+            for sub in tuple(self._by_clinic.get(clinic_id, ())):
+                if sub.treatment_id in treatment_ids:
+                    ct = by_key.get((clinic_id, sub.treatment_id))
+                    sub.push_offer(self.version, offer_delta(clinic_id, sub.treatment_id, ct))
+
+change_feed = CatalogChangeFeed()
+
+def sse_event(event: str, event_id: Optional[int], data: dict) -> bytes:
+    head = f"event: {event}\n" + (f"id: {event_id}\n" if event_id is not None else "")
+    return (head + f"data: {json.dumps(data, default=str)}\n\n").encode()
+
+# ==================== MAP CLUSTERS ====================
+
+# Clinics are bucketed by geohash once per catalog version, at every
+# precision from 1 up to GEO_MAX_PRECISION. A map request reads only the
+# cells covering its bounding box at a precision picked from the zoom, so
+# the response grows with the screen, not with the catalog.
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEO_MAX_PRECISION = 6
+MAP_MAX_CELLS = 1024
+MAP_CLINICS_MIN_ZOOM = 15  # from here on clinics are returned one by one
+
+def _geohash_bits(precision: int) -> tuple:
+    """(latitude bits, longitude bits) of a geohash of this length"""
+    return 5 * precision // 2, (5 * precision + 1) // 2
+
+def _geohash_cell(lat: float, lng: float, precision: int) -> tuple:
+    lat_bits, lng_bits = _geohash_bits(precision)
+    row = min(int((lat + 90) / 180 * (1 << lat_bits)), (1 << lat_bits) - 1)
+    col = min(int((lng + 180) / 360 * (1 << lng_bits)), (1 << lng_bits) - 1)
+    return row, col
+
+def _geohash_from_cell(row: int, col: int, precision: int) -> str:
+    lat_bits, lng_bits = _geohash_bits(precision)
+    value = 0
+    for i in range(5 * precision):
+        # Bits alternate longitude, latitude, ... starting from the top
+        if i % 2 == 0:
+            lng_bits -= 1
+            value = value << 1 | (col >> lng_bits) & 1
+        else:
+            lat_bits -= 1
+            value = value << 1 | (row >> lat_bits) & 1
+    return "".join(GEOHASH_BASE32[(value >> shift) & 31] for shift in range(5 * (precision - 1), -1, -5))
+
+def geohash_encode(lat: float, lng: float, precision: int) -> str:
+    return _geohash_from_cell(*_geohash_cell(lat, lng, precision), precision)
+
+def covering_geohashes(south: float, west: float, north: float, east: float, precision: int) -> List[str]:
+    """Geohash cells of one precision intersecting a bounding box"""
+    bottom, left = _geohash_cell(south, west, precision)
+    top, right = _geohash_cell(north, east, precision)
+    cols = 1 << _geohash_bits(precision)[1]
+    # A box crossing the antimeridian has west > east
+    width = (right - left) % cols + 1
+    return [
+        _geohash_from_cell(row, (left + c) % cols, precision)
+        for row in range(bottom, top + 1)
+        for c in range(width)
+    ]
+
+def covering_cell_count(south: float, west: float, north: float, east: float, precision: int) -> int:
+    bottom, left = _geohash_cell(south, west, precision)
+    top, right = _geohash_cell(north, east, precision)
+    cols = 1 << _geohash_bits(precision)[1]
+    return (top - bottom + 1) * ((right - left) % cols + 1)
+
+def zoom_precision(zoom: int) -> int:
+    """Finest geohash precision whose cells are still about a quarter tile wide"""
+    target = 360 / (1 << (zoom + 2))
+    precision = 1
+    while precision < GEO_MAX_PRECISION and 360 / (1 << _geohash_bits(precision + 1)[1]) >= target:
+        precision += 1
+    return precision
+
+class GeoBucket:
+    __slots__ = ("lat_sum", "lng_sum", "count", "min_prices", "clinics")
+
+    def __init__(self):
+        self.lat_sum = 0.0
+        self.lng_sum = 0.0
+        self.count = 0
+        self.min_prices = {}
+        self.clinics = []
+
+    def add(self, clinic: dict, prices: dict):
+        self.lat_sum += clinic["latitude"]
+        self.lng_sum += clinic["longitude"]
+        self.count += 1
+        for treatment_id, price in prices.items():
+            if price < self.min_prices.get(treatment_id, math.inf):
+                self.min_prices[treatment_id] = price
+
+class ClinicGeoIndex:
+    """Geohash buckets of one catalog version"""
+
+    def __init__(self, version: int, clinics: List[dict], offers: List[dict]):
+        self.version = version
+        prices_by_clinic = {}
+        for ct in offers:
+            prices_by_clinic.setdefault(ct["clinic_id"], {})[ct["treatment_id"]] = ct["price"]
+
+        self.levels = {precision: {} for precision in range(1, GEO_MAX_PRECISION + 1)}
+        for clinic in clinics:
+            summary = {
+                "clinic_id": clinic["clinic_id"],
+                "name": clinic["name"],
+                "city": clinic["city"],
+                "latitude": clinic["latitude"],
+                "longitude": clinic["longitude"],
+                "rating": clinic["rating"],
+                "prices": prices_by_clinic.get(clinic["clinic_id"], {})
+            }
+            geohash = geohash_encode(clinic["latitude"], clinic["longitude"], GEO_MAX_PRECISION)
+            for precision, buckets in self.levels.items():
+                bucket = buckets.get(geohash[:precision])
+                if bucket is None:
+                    bucket = buckets[geohash[:precision]] = GeoBucket()
+                bucket.add(summary, summary["prices"])
+            self.levels[GEO_MAX_PRECISION][geohash].clinics.append(summary)
+
+    def clusters(self, south: float, west: float, north: float, east: float, zoom: int,
+                 treatment_id: Optional[str] = None) -> dict:
+        precision = zoom_precision(zoom)
+        while precision > 1 and covering_cell_count(south, west, north, east, precision) > MAP_MAX_CELLS:
+            precision -= 1
+        individual = zoom >= MAP_CLINICS_MIN_ZOOM and precision == GEO_MAX_PRECISION
+
+        def clinic_point(clinic: dict) -> dict:
+            point = {k: v for k, v in clinic.items() if k != "prices"}
+            point["price"] = clinic["prices"].get(treatment_id) if treatment_id else None
+            return point
+
+        clusters = []
+        clinics = []
+        buckets = self.levels[precision]
+        for geohash in covering_geohashes(south, west, north, east, precision):
+            bucket = buckets.get(geohash)
+            if bucket is None:
+                continue
+            if individual:
+                clinics.extend(
+                    clinic_point(c) for c in bucket.clinics
+                    if south <= c["latitude"] <= north and _in_longitudes(c["longitude"], west, east)
+                )
+                continue
+            clusters.append({
+                "geohash": geohash,
+                "latitude": bucket.lat_sum / bucket.count,
+                "longitude": bucket.lng_sum / bucket.count,
+                "count": bucket.count,
+                "min_price": bucket.min_prices.get(treatment_id) if treatment_id else None
+            })
+        return {"version": self.version, "precision": precision, "clusters": clusters, "clinics": clinics}
+
+def _in_longitudes(lng: float, west: float, east: float) -> bool:
+    return west <= lng <= east if west <= east else lng >= west or lng <= east
+
+_geo_index: Optional[ClinicGeoIndex] = None
+_geo_index_lock = asyncio.Lock()
+
+async def clinic_geo_index(snapshot: Optional[CatalogSnapshot]) -> ClinicGeoIndex:
+    """The geohash index of the current catalog, rebuilt when it changes"""
+    global _geo_index
+    version = snapshot.generation if snapshot else await get_catalog_version()
+    if _geo_index and _geo_index.version == version:
+        return _geo_index
+    async with _geo_index_lock:
+        if _geo_index and _geo_index.version == version:
+            return _geo_index
+        if snapshot:
+            clinics, offers = snapshot.get("clinics"), snapshot.get("offers")
+        else:
+            clinics = await db.clinics.find(
+                {}, {"_id": 0, "clinic_id": 1, "name": 1, "city": 1, "latitude": 1, "longitude": 1, "rating": 1}
+            ).to_list(None)
+            offers = await db.clinic_treatments.find(
+                {}, {"_id": 0, "clinic_id": 1, "treatment_id": 1, "price": 1}
+            ).to_list(None)
+        _geo_index = await asyncio.to_thread(ClinicGeoIndex, version, clinics, offers)
+    return _geo_index
+
+# ==================== SEARCH ANALYTICS ====================
+
+# Every /clinics and /compare request appends its normalized parameters to
+# a bounded in-memory buffer; a background task flushes it to the
+# `search_events` collection with insert_many. If Mongo falls behind, the
+# oldest unflushed searches are dropped rather than growing the buffer.
+search_buffer: deque = deque(maxlen=SEARCH_BUFFER_SIZE)
+search_stats = {"recorded": 0, "dropped": 0, "flushed": 0, "prewarmed_generation": None}
+
+# How to recompute a recorded search of each route
+PREWARM_ROUTES = {
+    "clinics": lambda generation, params: encoded_bodies(
+        generation, "clinics", params, lambda source: search_clinics(**params, source=source)
+    ),
+    "compare": lambda generation, params: cached_result(
+        "compare", params, lambda source: run_comparison(CompareRequest(**params), source)
+    ),
+}
+
+def search_key(route: str, params: dict) -> str:
+    return json.dumps([route, params], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+def normalize_search(params: dict) -> dict:
+    return {k: v for k, v in sorted(params.items()) if v is not None and v != ""}
+
+def record_search(route: str, params: dict):
+    if not SEARCH_ANALYTICS_ENABLED:
+        return
+    params = normalize_search(params)
+    if len(search_buffer) == search_buffer.maxlen:
+        search_stats["dropped"] += 1
+    search_buffer.append({
+        "route": route,
+        "params": params,
+        "key": search_key(route, params),
+        "at": datetime.now(timezone.utc)
+    })
+    search_stats["recorded"] += 1
+
+async def flush_searches():
+    batch = []
+    while search_buffer and len(batch) < SEARCH_FLUSH_BATCH:
+        batch.append(search_buffer.popleft())
+    if batch:
+        await db.search_events.insert_many(batch, ordered=False)
+        search_stats["flushed"] += len(batch)
+
+async def top_searches(route: str, limit: int, hours: float = 24) -> List[dict]:
+    """Most frequent parameter combinations of a route in the last `hours`"""
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    return await db.search_events.aggregate([
+        {"$match": {"route": route, "at": {"$gte": since}}},
+        {"$group": {"_id": "$key", "params": {"$first": "$params"}, "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "params": 1, "count": 1}}
+    ]).to_list(None)
+
+async def prewarm_result_cache() -> int:
+    """Compute the most popular searches into the result caches"""
+    snapshot = catalog_snapshot()
+    if not snapshot:
+        return 0
+    warmed = 0
+    for route, warm in PREWARM_ROUTES.items():
+        for search in await top_searches(route, PREWARM_TOP_N, PREWARM_WINDOW_HOURS):
+            try:
+                await warm(snapshot.generation, search["params"])
+                warmed += 1
+            except (HTTPException, ValueError, TypeError):
+                # Searches that fail (unknown treatment, stale params) are not worth keeping
+                continue
+    return warmed
+
+async def search_analytics_loop():
+    """Flush recorded searches; prewarm after startup and each catalog change"""
+    while True:
+        try:
+            while search_buffer:
+                await flush_searches()
+            snapshot = catalog_snapshot()
+            if snapshot and snapshot.generation != search_stats["prewarmed_generation"] and not mongo_breaker.is_open():
+                search_stats["prewarmed_generation"] = snapshot.generation
+                warmed = await prewarm_result_cache()
+                logger.info("Prewarmed %d popular searches for catalog generation %s", warmed, snapshot.generation)
+        except Exception:
+            logger.exception("Search analytics flush failed")
+        await asyncio.sleep(SEARCH_FLUSH_SECONDS)
+
+# ==================== RESULT CACHE ====================
+
+# Results are keyed by the snapshot generation they were computed from, so
+# a catalog change makes older entries unreachable. Without a mapped
+# snapshot nothing is cached: checking the catalog version would cost a
+# query of its own.
+#
+# Entries outlive the request that fills them, so misses are computed
+# from the primary: right after a catalog change a secondary may not have
+# the write yet, and a pre-write result would stick for the whole
+# generation. `compute(source)` takes the database to read from.
+#
+# /compare results per parameter set, as objects: shared snapshots add
+# their id to them.
+result_cache: "OrderedDict[str, object]" = OrderedDict()
+
+async def cached_result(route: str, params: dict, compute):
+    snapshot = catalog_snapshot()
+    if not snapshot or not RESULT_CACHE_SIZE:
+        return await compute(catalog_db)
+    key = f"{snapshot.generation}:{search_key(route, normalize_search(params))}"
+    result = result_cache.get(key)
+    if result is not None:
+        result_cache.move_to_end(key)
+        return result
+    result = await compute(db)
+    result_cache[key] = result
+    while len(result_cache) > RESULT_CACHE_SIZE:
+        result_cache.popitem(last=False)
+    return result
+
+# Final response bytes of hot GET routes, encoded once per catalog
+# generation as identity, gzip and (with the brotli package) br. A hit
+# picks an encoding from Accept-Encoding and writes the stored bytes:
+# no JSON rendering and no compression per request.
+class ResponseCache:
+    """Encoded response bodies in an LRU bounded by their total size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()  # key -> {encoding: bytes}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[dict]:
+        bodies = self._entries.get(key)
+        if bodies is not None:
+            self._entries.move_to_end(key)
+        return bodies
+
+    def put(self, key: str, bodies: dict):
+        size = sum(len(body) for body in bodies.values())
+        # One huge body must not flush everything else
+        if size > self.max_bytes // 4:
+            return
+        previous = self._entries.pop(key, None)
+        if previous:
+            self.size -= sum(len(body) for body in previous.values())
+        self._entries[key] = bodies
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= sum(len(body) for body in evicted.values())
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+response_cache = ResponseCache(RESPONSE_CACHE_BYTES)
+
+def encode_body(body: bytes) -> dict:
+    """A body in every encoding we serve, minus those that do not shrink it"""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    bodies = {"identity": body, "gzip": compressor.compress(body) + compressor.flush()}
+    if brotli:
+        bodies["br"] = brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    return {encoding: data for encoding, data in bodies.items() if encoding == "identity" or len(data) < len(body)}
+
+def choose_encoding(accept_encoding: str, available) -> str:
+    """Best of br > gzip > identity that the client accepts"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name] = q
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return "identity"
+
+async def encoded_bodies(generation: int, route: str, params: dict, compute) -> dict:
+    key = f"{generation}:{search_key(route, normalize_search(params))}"
+    bodies = response_cache.get(key)
+    if bodies is None:
+        content = compute(db)
+        if asyncio.iscoroutine(content):
+            content = await content
+        bodies = encode_body(content if isinstance(content, bytes) else _dump_json(jsonable_encoder(content)))
+        response_cache.put(key, bodies)
+    return bodies
+
+def encoded_response(request: Request, bodies: dict) -> Response:
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""), bodies)
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(bodies[encoding], media_type="application/json", headers=headers)
+
+async def cached_response(request: Request, route: str, params: dict, compute):
+    """`compute(source)`'s response, served from the response cache while a snapshot is mapped"""
+    snapshot = catalog_snapshot()
+    if not snapshot or not RESPONSE_CACHE_BYTES:
+        return await compute(catalog_db)
+    return encoded_response(request, await encoded_bodies(snapshot.generation, route, params, compute))
+
+
 # ==================== TREATMENTS ENDPOINTS ====================
 
 @api_router.get("/treatments", response_model=List[Treatment])
-async def get_treatments():
-    treatments = await db.treatments.find({}, {"_id": 0}).to_list(100)
+async def get_treatments(request: Request):
+    snapshot = catalog_snapshot()
+    if snapshot:
+        bodies = await encoded_bodies(snapshot.generation, "treatments", {}, lambda source: snapshot.raw("treatments"))
+        return encoded_response(request, bodies)
+    treatments = await catalog_db.treatments.find({}, {"_id": 0}, max_time_ms=query_deadline_ms()).to_list(100)
     return treatments
 
 @api_router.get("/treatments/{treatment_id}", response_model=Treatment)
 async def get_treatment(treatment_id: str):
-    treatment = await db.treatments.find_one({"treatment_id": treatment_id}, {"_id": 0})
+    snapshot = catalog_snapshot()
+    if snapshot:
+        body = snapshot.raw(f"treatment:{treatment_id}")
+        if body is None:
+            raise HTTPException(status_code=404, detail="Tratamiento no encontrado")
+        return Response(body, media_type="application/json")
+    treatment = await catalog_db.treatments.find_one({"treatment_id": treatment_id}, {"_id": 0}, max_time_ms=query_deadline_ms())
     if not treatment:
         raise HTTPException(status_code=404, detail="Tratamiento no encontrado")
     return treatment
 
+@api_router.get("/treatments/{treatment_id}/price-history")
+async def get_price_history(
+    treatment_id: str,
+    interval: str = "week",
+    city: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    """Price trend of a treatment: min/avg/max of recorded prices per bucket"""
+    if not PRICE_HISTORY_ENABLED:
+        raise HTTPException(status_code=404, detail="Historial de precios no disponible")
+    if interval not in PRICE_HISTORY_INTERVALS:
+        raise HTTPException(status_code=400, detail="Intervalo no válido (day, week o month)")
+    default_lookback, max_lookback = PRICE_HISTORY_INTERVALS[interval]
+    until = until or datetime.now(timezone.utc)
+    since = since or until - default_lookback
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=timezone.utc)
+    if since >= until or until - since > max_lookback:
+        raise HTTPException(status_code=400, detail="Rango de fechas no válido para el intervalo")
+
+    match = {"meta.treatment_id": treatment_id, "ts": {"$gte": since, "$lt": until}}
+    if city:
+        match["meta.city"] = city
+    bucket = {"$dateTrunc": {"date": "$ts", "unit": interval, "startOfWeek": "monday"}}
+    points = await catalog_db.price_history.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": bucket,
+            "min_price": {"$min": "$price"},
+            "avg_price": {"$avg": "$price"},
+            "max_price": {"$max": "$price"},
+            "samples": {"$sum": 1},
+            "clinics": {"$addToSet": "$meta.clinic_id"}
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {
+            "_id": 0,
+            "bucket": "$_id",
+            "min_price": 1,
+            "avg_price": {"$round": ["$avg_price", 2]},
+            "max_price": 1,
+            "samples": 1,
+            "clinics": {"$size": "$clinics"}
+        }}
+    ], **aggregate_options()).to_list(None)
+
+    return {
+        "treatment_id": treatment_id,
+        "interval": interval,
+        "city": city,
+        "since": since,
+        "until": until,
+        "points": points
+    }
+
 # ==================== CLINICS ENDPOINTS ====================
 
+def filter_by_offer(clinics: list, clinic_treatments: list, min_price: Optional[float], max_price: Optional[float]) -> list:
+    """Keep clinics offering the treatment within the price range, with its price and duration"""
+    clinic_ids_with_treatment = {ct["clinic_id"] for ct in clinic_treatments}
+    clinics = [c for c in clinics if c["clinic_id"] in clinic_ids_with_treatment]
+    
+    # Add treatment info to each clinic
+    treatment_by_clinic = {ct["clinic_id"]: ct for ct in clinic_treatments}
+    for clinic in clinics:
+        ct = treatment_by_clinic.get(clinic["clinic_id"])
+        if ct:
+            # Apply price filters
+            if min_price and ct["price"] < min_price:
+                continue
+            if max_price and ct["price"] > max_price:
+                continue
+            clinic["treatment_price"] = ct["price"]
+            clinic["treatment_duration"] = ct["duration_days"]
+    
+    # Filter by price after adding
+    if min_price or max_price:
+        clinics = [c for c in clinics if "treatment_price" in c]
+        if min_price:
+            clinics = [c for c in clinics if c["treatment_price"] >= min_price]
+        if max_price:
+            clinics = [c for c in clinics if c["treatment_price"] <= max_price]
+
+    return clinics
+
 @api_router.get("/clinics")
 async def get_clinics(
+    request: Request,
     city: Optional[str] = None,
     treatment_id: Optional[str] = None,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
-    min_rating: Optional[float] = None
+    min_rating: Optional[float] = None,
+    fields: Optional[str] = None
 ):
+    params = {
+        "city": city,
+        "treatment_id": treatment_id,
+        "min_price": min_price,
+        "max_price": max_price,
+        "min_rating": min_rating,
+        "fields": parse_fields(fields, CLINIC_LIST_FIELDS)
+    }
+    # `city` is matched as a pattern; reject a broken one before Mongo does
+    try:
+        city_pattern = re.compile(city, re.IGNORECASE) if city else None
+    except re.error:
+        raise HTTPException(status_code=400, detail="Patrón de ciudad inválido")
+    record_search("clinics", params)
+    if mongo_breaker.is_open():
+        snapshot = degraded_snapshot()
+        clinics = [
+            c for c in snapshot.get("clinics")
+            if (not city_pattern or city_pattern.search(c["city"]))
+            and (not min_rating or c["rating"] >= min_rating)
+        ][:100]
+        if treatment_id:
+            clinic_treatments = [ct for ct in snapshot.get("offers") if ct["treatment_id"] == treatment_id]
+            clinics = filter_by_offer(clinics, clinic_treatments, min_price, max_price)
+        if params["fields"]:
+            clinics = [sparse(c, params["fields"]) for c in clinics]
+        return degraded_response(clinics)
+
+    return await cached_response(request, "clinics", params, lambda source: search_clinics(**params, source=source))
+
+async def search_clinics(
+    city: Optional[str] = None,
+    treatment_id: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_rating: Optional[float] = None,
+    fields: Optional[str] = None,
+    source=None
+) -> list:
+    if source is None:
+        source = catalog_db
     # Build query
     query = {}
     if city:
@@ -380,118 +2303,404 @@ async def get_clinics(
     if min_rating:
         query["rating"] = {"$gte": min_rating}
     
-    clinics = await db.clinics.find(query, {"_id": 0}).to_list(100)
+    clinics = await source.clinics.find(
+        query,
+        fields_projection(fields) if fields else CLINIC_PROJECTION,
+        max_time_ms=query_deadline_ms()
+    ).to_list(100)
     
     # If treatment filter, get clinics that offer it
     if treatment_id:
-        clinic_treatments = await db.clinic_treatments.find(
+        clinic_treatments = await source.clinic_treatments.find(
             {"treatment_id": treatment_id},
-            {"_id": 0}
+            {"_id": 0, "clinic_id": 1, "price": 1, "duration_days": 1},
+            max_time_ms=query_deadline_ms()
         ).to_list(1000)
-        
-        clinic_ids_with_treatment = {ct["clinic_id"] for ct in clinic_treatments}
-        clinics = [c for c in clinics if c["clinic_id"] in clinic_ids_with_treatment]
-        
-        # Add treatment info to each clinic
-        treatment_by_clinic = {ct["clinic_id"]: ct for ct in clinic_treatments}
-        for clinic in clinics:
-            ct = treatment_by_clinic.get(clinic["clinic_id"])
-            if ct:
-                # Apply price filters
-                if min_price and ct["price"] < min_price:
-                    continue
-                if max_price and ct["price"] > max_price:
-                    continue
-                clinic["treatment_price"] = ct["price"]
-                clinic["treatment_duration"] = ct["duration_days"]
-        
-        # Filter by price after adding
-        if min_price or max_price:
-            clinics = [c for c in clinics if "treatment_price" in c]
-            if min_price:
-                clinics = [c for c in clinics if c["treatment_price"] >= min_price]
-            if max_price:
-                clinics = [c for c in clinics if c["treatment_price"] <= max_price]
+        clinics = filter_by_offer(clinics, clinic_treatments, min_price, max_price)
     
-    return clinics
+    return [sparse(c, fields) for c in clinics] if fields else clinics
+
+@api_router.get("/clinics/clusters")
+async def get_clinic_clusters(
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    zoom: int,
+    treatment_id: Optional[str] = None
+):
+    """Map clusters (centroid, count, cheapest price) for a bounding box"""
+    if not (-90 <= south < north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise HTTPException(status_code=400, detail="Área del mapa no válida")
+    if not 0 <= zoom <= 22:
+        raise HTTPException(status_code=400, detail="Zoom no válido")
+    if mongo_breaker.is_open():
+        index = await clinic_geo_index(degraded_snapshot())
+        return degraded_response(index.clusters(south, west, north, east, zoom, treatment_id))
+    index = await clinic_geo_index(catalog_snapshot())
+    return index.clusters(south, west, north, east, zoom, treatment_id)
 
 @api_router.get("/clinics/{clinic_id}")
-async def get_clinic(clinic_id: str):
-    clinic = await db.clinics.find_one({"clinic_id": clinic_id}, {"_id": 0})
+async def get_clinic(clinic_id: str, fields: Optional[str] = None):
+    fields = parse_fields(fields, CLINIC_DETAIL_FIELDS)
+    snapshot = catalog_snapshot()
+    if snapshot:
+        if fields:
+            clinic = snapshot.get(f"clinic:{clinic_id}")
+            if clinic is None:
+                raise HTTPException(status_code=404, detail="Clínica no encontrada")
+            return sparse(clinic, fields)
+        body = snapshot.raw(f"clinic:{clinic_id}")
+        if body is None:
+            raise HTTPException(status_code=404, detail="Clínica no encontrada")
+        return Response(body, media_type="application/json")
+
+    if CLINIC_PROFILES_ENABLED:
+        profile = await catalog_db.clinic_profiles.find_one(
+            {"clinic_id": clinic_id},
+            fields_projection(fields) if fields else PROFILE_PROJECTION,
+            max_time_ms=query_deadline_ms()
+        )
+        if not profile:
+            raise HTTPException(status_code=404, detail="Clínica no encontrada")
+        return profile
+
+    clinic = await catalog_db.clinics.find_one(
+        {"clinic_id": clinic_id},
+        fields_projection(fields) if fields else CLINIC_PROJECTION,
+        max_time_ms=query_deadline_ms()
+    )
     if not clinic:
         raise HTTPException(status_code=404, detail="Clínica no encontrada")
     
+    offer_projection = treatment_projection = {"_id": 0}
+    nested = offer_fields(fields) if fields else None
+    if nested is not None:
+        if not nested:
+            return clinic
+        # Only the offer and treatment fields asked for
+        offer_projection = {"_id": 0, "treatment_id": 1, **{k: 1 for k in nested & set(OFFER_FIELDS)}}
+        treatment_projection = {"_id": 0, "treatment_id": 1, **{k: 1 for k in nested - set(OFFER_FIELDS)}}
+    
     # Get treatments for this clinic
-    clinic_treatments = await db.clinic_treatments.find(
+    clinic_treatments = await catalog_db.clinic_treatments.find(
         {"clinic_id": clinic_id},
-        {"_id": 0}
+        offer_projection,
+        max_time_ms=query_deadline_ms()
     ).to_list(100)
     
-    # Get treatment details
-    treatments_with_details = []
-    for ct in clinic_treatments:
-        treatment = await db.treatments.find_one(
-            {"treatment_id": ct["treatment_id"]},
-            {"_id": 0}
-        )
-        if treatment:
-            treatments_with_details.append({
-                **treatment,
-                "price": ct["price"],
-                "duration_days": ct["duration_days"],
-                "warranty_months": ct["warranty_months"],
-                "process_steps": ct["process_steps"],
-                "includes": ct["includes"]
-            })
-    
-    clinic["treatments"] = treatments_with_details
-    return clinic
+    # Get treatment details in one query
+    treatments_by_id = {
+        t["treatment_id"]: t
+        for t in await catalog_db.treatments.find(
+            {"treatment_id": {"$in": [ct["treatment_id"] for ct in clinic_treatments]}},
+            treatment_projection,
+            max_time_ms=query_deadline_ms()
+        ).to_list(None)
+    }
+    profile = clinic_profile(clinic, clinic_treatments, treatments_by_id)
+    return sparse(profile, fields) if fields else profile
 
 @api_router.get("/cities")
-async def get_cities():
+async def get_cities(request: Request):
     """Get unique cities from clinics"""
-    clinics = await db.clinics.find({}, {"_id": 0, "city": 1}).to_list(1000)
+    snapshot = catalog_snapshot()
+    if snapshot:
+        bodies = await encoded_bodies(snapshot.generation, "cities", {}, lambda source: snapshot.raw("cities"))
+        return encoded_response(request, bodies)
+    clinics = await catalog_db.clinics.find({}, {"_id": 0, "city": 1}, max_time_ms=query_deadline_ms()).to_list(1000)
     cities = list(set(c["city"] for c in clinics))
     return sorted(cities)
 
+# ==================== PARTNER ENDPOINTS ====================
+
+async def partner_clinics(request: Request) -> Optional[set]:
+    """Clinics the caller may edit; None means all (admin token)"""
+    if is_admin(request):
+        return None
+    user = await get_current_user(request)
+    # Grants change without a new login, so they are not taken from the token
+    user_doc = await db.users.find_one(
+        {"user_id": user.user_id},
+        {"_id": 0, "clinic_ids": 1},
+        max_time_ms=query_deadline_ms()
+    )
+    clinic_ids = (user_doc or {}).get("clinic_ids")
+    if not clinic_ids:
+        raise HTTPException(status_code=403, detail="Acceso denegado")
+    return set(clinic_ids)
+
+@api_router.post("/clinic-treatments/prices")
+async def bulk_update_prices(update: BulkPriceUpdate, allowed: Optional[set] = Depends(partner_clinics)):
+    """Apply many price changes with one unordered bulk write.
+
+    Each item carries the offer `version` it was read at and only applies if
+    the offer is still at that version (offers written before versioning
+    count as 0). Results come back per item, in request order.
+    """
+    if not update.items:
+        raise HTTPException(status_code=400, detail="No hay cambios de precio")
+    if len(update.items) > BULK_UPDATE_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Máximo {BULK_UPDATE_MAX_ITEMS} cambios por petición")
+    if len({item.id for item in update.items}) < len(update.items):
+        raise HTTPException(status_code=400, detail="Oferta repetida en la petición")
+
+    ids = [item.id for item in update.items]
+    current = {
+        ct["id"]: ct
+        for ct in await db.clinic_treatments.find(
+            {"id": {"$in": ids}},
+            {"_id": 0, "id": 1, "clinic_id": 1, "treatment_id": 1, "version": 1},
+            max_time_ms=query_deadline_ms()
+        ).to_list(None)
+    }
+
+    now = datetime.now(timezone.utc).isoformat()
+    results = {}
+    ops = []
+    op_items = []
+    for item in update.items:
+        ct = current.get(item.id)
+        if not ct:
+            results[item.id] = {"status": "not_found"}
+        elif allowed is not None and ct["clinic_id"] not in allowed:
+            results[item.id] = {"status": "forbidden"}
+        elif ct.get("version", 0) != item.version:
+            results[item.id] = {"status": "conflict", "version": ct.get("version", 0)}
+        else:
+            ops.append(UpdateOne(
+                {"id": item.id, "version": item.version or {"$in": [0, None]}},
+                {"$set": {"price": item.price, "updated_at": now}, "$inc": {"version": 1}}
+            ))
+            op_items.append(item)
+
+    failed = {}
+    if ops:
+        try:
+            result = await db.clinic_treatments.bulk_write(ops, ordered=False)
+            matched = result.matched_count
+        except BulkWriteError as e:
+            failed = {op_items[err["index"]].id: err["errmsg"] for err in e.details["writeErrors"]}
+            matched = e.details["nMatched"]
+        if matched + len(failed) < len(ops):
+            # Someone else won a race since the read: see who
+            versions = {
+                ct["id"]: ct.get("version", 0)
+                for ct in await db.clinic_treatments.find(
+                    {"id": {"$in": [item.id for item in op_items]}},
+                    {"_id": 0, "id": 1, "version": 1}
+                ).to_list(None)
+            }
+        else:
+            versions = {item.id: item.version + 1 for item in op_items}
+        for item in op_items:
+            if item.id in failed:
+                results[item.id] = {"status": "error", "detail": failed[item.id]}
+            elif versions.get(item.id) == item.version + 1:
+                results[item.id] = {"status": "updated", "version": item.version + 1}
+            elif item.id in versions:
+                results[item.id] = {"status": "conflict", "version": versions[item.id]}
+            else:
+                results[item.id] = {"status": "not_found"}
+
+    updated = [
+        {**current[item.id], "price": item.price}
+        for item in op_items
+        if results[item.id]["status"] == "updated"
+    ]
+    version = None
+    if updated:
+        clinic_ids = sorted({ct["clinic_id"] for ct in updated})
+        cities = await db.clinics.find(
+            {"clinic_id": {"$in": clinic_ids}}, {"_id": 0, "clinic_id": 1, "city": 1}
+        ).to_list(None)
+        await record_prices(updated, {c["clinic_id"]: c["city"] for c in cities})
+        version = await publish_catalog_change(
+            "prices", clinic_ids, sorted({ct["treatment_id"] for ct in updated})
+        )
+
+    return {
+        "updated": len(updated),
+        "catalog_version": version,
+        "results": [{"id": item.id, **results[item.id]} for item in update.items]
+    }
+
+# ==================== COMPARE SNAPSHOTS ====================
+
+# Shared compare links: a result is stored under a hash of what it was
+# computed from, including the catalog version, so a catalog write makes
+# every older snapshot stale without touching it. Views are served from a
+# per-worker LRU in front of the TTL'd `compare_snapshots` collection.
+compare_snapshot_cache: "OrderedDict[str, dict]" = OrderedDict()
+
+def compare_snapshot_id(clinic_ids: List[str], treatment_id: str, version: int) -> str:
+    key = json.dumps([sorted(set(clinic_ids)), treatment_id, version], separators=(",", ":"))
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+def _cache_compare_snapshot(snapshot_id: str, stored: dict):
+    compare_snapshot_cache[snapshot_id] = stored
+    compare_snapshot_cache.move_to_end(snapshot_id)
+    while len(compare_snapshot_cache) > COMPARE_SNAPSHOT_CACHE_SIZE:
+        compare_snapshot_cache.popitem(last=False)
+
+async def load_compare_snapshot(snapshot_id: str) -> Optional[dict]:
+    stored = compare_snapshot_cache.get(snapshot_id)
+    if stored:
+        compare_snapshot_cache.move_to_end(snapshot_id)
+        return stored
+    stored = await db.compare_snapshots.find_one(
+        {"_id": snapshot_id},
+        {"_id": 0, "created_at": 0},
+        max_time_ms=query_deadline_ms()
+    )
+    if stored:
+        _cache_compare_snapshot(snapshot_id, stored)
+    return stored
+
+def in_request_order(result: dict, clinic_ids: List[str]) -> dict:
+    """A stored (clinic-id ordered) comparison in the order a request asked for"""
+    by_clinic = {c["clinic"]["clinic_id"]: c for c in result["comparisons"]}
+    ordered = [by_clinic[clinic_id] for clinic_id in dict.fromkeys(clinic_ids) if clinic_id in by_clinic]
+    return {**result, "comparisons": ordered}
+
+async def save_compare_snapshot(snapshot_id: str, version: int, compare_data: CompareRequest, result: dict):
+    stored = {
+        "version": version,
+        "clinic_ids": compare_data.clinic_ids,
+        "treatment_id": compare_data.treatment_id,
+        "result": result
+    }
+    # Same id, same content: whoever stores it first wins
+    await db.compare_snapshots.update_one(
+        {"_id": snapshot_id},
+        {"$setOnInsert": {**stored, "created_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    _cache_compare_snapshot(snapshot_id, stored)
+
 # ==================== COMPARE ENDPOINTS ====================
 
-@api_router.post("/compare")
+@api_router.post("/compare", dependencies=[Depends(rate_limit("compare"))])
 async def compare_treatments(compare_data: CompareRequest):
     if len(compare_data.clinic_ids) < 2:
         raise HTTPException(status_code=400, detail="Se necesitan al menos 2 clínicas para comparar")
+    params = {"clinic_ids": compare_data.clinic_ids, "treatment_id": compare_data.treatment_id}
+    record_search("compare", params)
+    
+    if mongo_breaker.is_open():
+        snapshot = degraded_snapshot()
+        treatment = snapshot.get(f"treatment:{compare_data.treatment_id}")
+        if not treatment:
+            raise HTTPException(status_code=404, detail="Tratamiento no encontrado")
+        wanted = set(compare_data.clinic_ids)
+        clinics_by_id = {c["clinic_id"]: c for c in snapshot.get("clinics") if c["clinic_id"] in wanted}
+        offers_by_clinic = {
+            ct["clinic_id"]: ct for ct in snapshot.get("offers")
+            if ct["clinic_id"] in wanted and ct["treatment_id"] == compare_data.treatment_id
+        }
+        return degraded_response(
+            build_comparison(treatment, compare_data.clinic_ids, clinics_by_id, offers_by_clinic)
+        )
+    
+    if not compare_data.share:
+        return await cached_result("compare", params, lambda source: run_comparison(compare_data, source))
+    
+    snapshot = catalog_snapshot()
+    version = snapshot.generation if snapshot else await get_catalog_version()
+    # Stored in clinic id order, like the id is hashed; each sharer gets
+    # it back in their own order
+    canonical = CompareRequest(
+        clinic_ids=sorted(set(compare_data.clinic_ids)), treatment_id=compare_data.treatment_id, share=True
+    )
+    snapshot_id = compare_snapshot_id(canonical.clinic_ids, canonical.treatment_id, version)
+    stored = await load_compare_snapshot(snapshot_id)
+    if stored:
+        result = stored["result"]
+    else:
+        canonical_params = {"clinic_ids": canonical.clinic_ids, "treatment_id": canonical.treatment_id}
+        result = await cached_result("compare", canonical_params, lambda source: run_comparison(canonical, source))
+        await save_compare_snapshot(snapshot_id, version, canonical, result)
+    return {**in_request_order(result, compare_data.clinic_ids), "snapshot_id": snapshot_id}
+
+async def run_comparison(compare_data: CompareRequest, source=None) -> dict:
+    if source is None:
+        source = catalog_db
+    if CLINIC_PROFILES_ENABLED:
+        return await compare_from_profiles(compare_data, source)
     
     # Get treatment info
-    treatment = await db.treatments.find_one(
+    treatment = await source.treatments.find_one(
         {"treatment_id": compare_data.treatment_id},
-        {"_id": 0}
+        {"_id": 0},
+        max_time_ms=query_deadline_ms()
     )
     if not treatment:
         raise HTTPException(status_code=404, detail="Tratamiento no encontrado")
     
-    comparison_data = []
+    clinics_by_id = {
+        c["clinic_id"]: c
+        for c in await source.clinics.find(
+            {"clinic_id": {"$in": compare_data.clinic_ids}},
+            CLINIC_PROJECTION,
+            max_time_ms=query_deadline_ms()
+        ).to_list(None)
+    }
+    offers_by_clinic = {
+        ct["clinic_id"]: ct
+        for ct in await source.clinic_treatments.find(
+            {"clinic_id": {"$in": compare_data.clinic_ids}, "treatment_id": compare_data.treatment_id},
+            {"_id": 0},
+            max_time_ms=query_deadline_ms()
+        ).to_list(None)
+    }
     
-    for clinic_id in compare_data.clinic_ids:
-        clinic = await db.clinics.find_one({"clinic_id": clinic_id}, {"_id": 0})
-        if not clinic:
-            continue
-        
-        clinic_treatment = await db.clinic_treatments.find_one(
-            {"clinic_id": clinic_id, "treatment_id": compare_data.treatment_id},
-            {"_id": 0}
+    return build_comparison(treatment, compare_data.clinic_ids, clinics_by_id, offers_by_clinic)
+
+async def compare_from_profiles(compare_data: CompareRequest, source) -> dict:
+    """Compare with one read: each profile with only the requested offer"""
+    profiles = await source.clinic_profiles.aggregate([
+        {"$match": {"clinic_id": {"$in": compare_data.clinic_ids}}},
+        {"$set": {"treatments": {"$filter": {
+            "input": "$treatments",
+            "cond": {"$eq": ["$$this.treatment_id", compare_data.treatment_id]}
+        }}}},
+        {"$project": PROFILE_PROJECTION}
+    ], **aggregate_options()).to_list(None)
+
+    offers_by_clinic = {}
+    clinics_by_id = {}
+    for profile in profiles:
+        offers = profile.pop("treatments", None)
+        clinics_by_id[profile["clinic_id"]] = profile
+        if offers:
+            offers_by_clinic[profile["clinic_id"]] = offers[0]
+
+    if offers_by_clinic:
+        offer = next(iter(offers_by_clinic.values()))
+        treatment = {k: v for k, v in offer.items() if k not in OFFER_FIELDS}
+    else:
+        # Nobody offers it: still tell an unknown treatment apart
+        treatment = await source.treatments.find_one(
+            {"treatment_id": compare_data.treatment_id},
+            {"_id": 0},
+            max_time_ms=query_deadline_ms()
         )
+        if not treatment:
+            raise HTTPException(status_code=404, detail="Tratamiento no encontrado")
+    return build_comparison(treatment, compare_data.clinic_ids, clinics_by_id, offers_by_clinic)
+
+def build_comparison(treatment: dict, clinic_ids: List[str], clinics_by_id: dict, offers_by_clinic: dict) -> dict:
+    """Side-by-side offers in request order, flagging the cheapest"""
+    comparison_data = []
+    
+    for clinic_id in clinic_ids:
+        clinic = clinics_by_id.get(clinic_id)
+        clinic_treatment = offers_by_clinic.get(clinic_id)
         
-        if clinic_treatment:
+        if clinic and clinic_treatment:
             comparison_data.append({
                 "clinic": clinic,
-                "treatment": {
-                    **treatment,
-                    "price": clinic_treatment["price"],
-                    "duration_days": clinic_treatment["duration_days"],
-                    "warranty_months": clinic_treatment["warranty_months"],
-                    "process_steps": clinic_treatment["process_steps"],
-                    "includes": clinic_treatment["includes"]
-                }
+                "treatment": treatment_offer(treatment, clinic_treatment)
             })
     
     # Find best value (lowest price)
@@ -505,6 +2714,510 @@ async def compare_treatments(compare_data: CompareRequest):
         "comparisons": comparison_data
     }
 
+@api_router.get("/compare/stream")
+async def stream_compare(clinic_ids: str, treatment_id: str):
+    """Server-Sent Events: the compared offers now, then every change to them"""
+    ids = list(dict.fromkeys(c for c in clinic_ids.split(",") if c))
+    if not 1 <= len(ids) <= LIVE_MAX_CLINICS:
+        raise HTTPException(status_code=400, detail=f"Entre 1 y {LIVE_MAX_CLINICS} clínicas")
+
+    sub = await change_feed.subscribe(ids, treatment_id)
+    initial = list(sub.sent.values())
+    version = change_feed.version
+
+    async def events():
+        try:
+            yield f"retry: {LIVE_RETRY_MS}\n\n".encode()
+            for delta in initial:
+                yield sse_event("offer", version, delta)
+            while True:
+                try:
+                    event, event_id, data = await asyncio.wait_for(sub.queue.get(), LIVE_KEEPALIVE_SECONDS)
+                except TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield sse_event(event, event_id, data)
+                if event == "resync":
+                    return
+        finally:
+            change_feed.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@api_router.get("/compare/{snapshot_id}")
+async def get_compare_snapshot(snapshot_id: str):
+    """A shared comparison; recomputed under a new id once the catalog has changed"""
+    if mongo_breaker.is_open():
+        stored = compare_snapshot_cache.get(snapshot_id)
+        if not stored:
+            raise HTTPException(status_code=503, detail="Servicio temporalmente no disponible")
+        return degraded_response({**stored["result"], "snapshot_id": snapshot_id})
+
+    stored = await load_compare_snapshot(snapshot_id)
+    if not stored:
+        raise HTTPException(status_code=404, detail="Comparación no encontrada")
+    snapshot = catalog_snapshot()
+    version = snapshot.generation if snapshot else await get_catalog_version()
+    if stored["version"] == version:
+        return {**stored["result"], "snapshot_id": snapshot_id}
+
+    compare_snapshot_cache.pop(snapshot_id, None)
+    compare_data = CompareRequest(clinic_ids=stored["clinic_ids"], treatment_id=stored["treatment_id"], share=True)
+    fresh_id = compare_snapshot_id(compare_data.clinic_ids, compare_data.treatment_id, version)
+    fresh = await load_compare_snapshot(fresh_id)
+    if not fresh:
+        result = await run_comparison(compare_data, db)
+        await save_compare_snapshot(fresh_id, version, compare_data, result)
+        return {**result, "snapshot_id": fresh_id}
+    return {**fresh["result"], "snapshot_id": fresh_id}
+
+# ==================== BOOKING ENDPOINTS ====================
+
+# Each slot document carries its own inventory: `available` plus the
+# active `holds` and confirmed `bookings`. Every state change is a single
+# conditional update on that document, so concurrent requests for the
+# last place cannot both win. Unconfirmed holds expire: their `bookings`
+# entry is removed by a TTL index and the place is returned to the slot
+# by the next request that finds it sold out.
+
+def _as_utc(value) -> datetime:
+    """`value` in UTC; naive values are taken to be UTC already.
+
+    Slot times are stored and range-queried as ISO strings, which only
+    compare correctly when they all share the same offset.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+async def release_expired_holds(slot: dict) -> int:
+    """Return a slot's expired holds to its inventory"""
+    now = datetime.now(timezone.utc)
+    released = 0
+    for hold in slot.get("holds", []):
+        if _as_utc(hold["expires_at"]) <= now:
+            # Conditional on the hold still being there: confirm, cancel
+            # and other releases race for it
+            result = await db.slots.update_one(
+                {"slot_id": slot["slot_id"], "holds.hold_id": hold["hold_id"]},
+                {"$pull": {"holds": {"hold_id": hold["hold_id"]}}, "$inc": {"available": 1}}
+            )
+            released += result.modified_count
+    return released
+
+def slot_view(slot: dict) -> dict:
+    now = datetime.now(timezone.utc)
+    expired = sum(1 for h in slot.get("holds", []) if _as_utc(h["expires_at"]) <= now)
+    view = {k: v for k, v in slot.items() if k not in ("holds", "bookings")}
+    view["available"] = slot["available"] + expired
+    return view
+
+@api_router.post("/clinics/{clinic_id}/slots")
+async def create_slots(clinic_id: str, batch: SlotBatch, allowed: Optional[set] = Depends(partner_clinics)):
+    """Open appointment slots; slots that already exist are left as they are"""
+    if allowed is not None and clinic_id not in allowed:
+        raise HTTPException(status_code=403, detail="Acceso denegado")
+    offered = set(await db.clinic_treatments.distinct("treatment_id", {"clinic_id": clinic_id}))
+    unknown = {s.treatment_id for s in batch.slots} - offered
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Tratamientos no ofrecidos: {', '.join(sorted(unknown))}")
+    if not batch.slots:
+        return {"created": 0}
+
+    now = datetime.now(timezone.utc).isoformat()
+    docs = [
+        {
+            "slot_id": f"slot_{uuid.uuid4().hex[:12]}",
+            "clinic_id": clinic_id,
+            "treatment_id": s.treatment_id,
+            "starts_at": _as_utc(s.starts_at).isoformat(),
+            "capacity": s.capacity,
+            "available": s.capacity,
+            "holds": [],
+            "bookings": [],
+            "created_at": now
+        }
+        for s in batch.slots
+    ]
+    try:
+        result = await db.slots.insert_many(docs, ordered=False)
+        created = len(result.inserted_ids)
+    except BulkWriteError as e:
+        if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+            raise
+        created = e.details["nInserted"]
+    return {"created": created}
+
+@api_router.get("/clinics/{clinic_id}/slots")
+async def get_slots(
+    clinic_id: str,
+    treatment_id: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+):
+    query = {"clinic_id": clinic_id}
+    if treatment_id:
+        query["treatment_id"] = treatment_id
+    query["starts_at"] = {"$gte": _as_utc(date_from or datetime.now(timezone.utc)).isoformat()}
+    if date_to:
+        query["starts_at"]["$lt"] = _as_utc(date_to).isoformat()
+    slots = await db.slots.find(
+        query,
+        {"_id": 0, "bookings": 0},
+        max_time_ms=query_deadline_ms()
+    ).sort("starts_at", 1).to_list(SLOTS_PAGE_SIZE)
+    return [slot_view(slot) for slot in slots]
+
+@api_router.post("/bookings")
+async def hold_slot(hold: HoldRequest, user: User = Depends(get_current_user)):
+    """Hold one place in a slot for BOOKING_HOLD_SECONDS until it is confirmed"""
+    booking_id = f"booking_{uuid.uuid4().hex[:12]}"
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=BOOKING_HOLD_SECONDS)
+    for attempt in range(2):
+        result = await db.slots.update_one(
+            {
+                "slot_id": hold.slot_id,
+                "available": {"$gt": 0},
+                "holds.user_id": {"$ne": user.user_id},
+                "bookings.user_id": {"$ne": user.user_id}
+            },
+            {
+                "$inc": {"available": -1},
+                "$push": {"holds": {"hold_id": booking_id, "user_id": user.user_id, "expires_at": expires_at}}
+            }
+        )
+        if result.modified_count:
+            break
+        slot = await db.slots.find_one(
+            {"slot_id": hold.slot_id},
+            {"_id": 0, "slot_id": 1, "holds": 1, "bookings": 1}
+        )
+        if not slot:
+            raise HTTPException(status_code=404, detail="Cita no encontrada")
+        if attempt == 0 and await release_expired_holds(slot):
+            continue
+        if any(b["user_id"] == user.user_id for b in slot["holds"] + slot["bookings"]):
+            raise HTTPException(status_code=409, detail="Ya tienes una reserva en esta cita")
+        raise HTTPException(status_code=409, detail="No quedan plazas en esta cita")
+
+    booking = {
+        "booking_id": booking_id,
+        "slot_id": hold.slot_id,
+        "user_id": user.user_id,
+        "status": "held",
+        "expires_at": expires_at,
+        "created_at": now.isoformat()
+    }
+    await db.bookings.insert_one(booking)
+    booking.pop("_id", None)
+    return booking
+
+@api_router.post("/bookings/{booking_id}/confirm")
+async def confirm_booking(booking_id: str, user: User = Depends(get_current_user)):
+    booking = await db.bookings.find_one({"booking_id": booking_id, "user_id": user.user_id}, {"_id": 0})
+    if not booking:
+        raise HTTPException(status_code=404, detail="Reserva no encontrada")
+    if booking["status"] == "confirmed":
+        return booking
+
+    now = datetime.now(timezone.utc)
+    result = await db.slots.update_one(
+        {
+            "slot_id": booking["slot_id"],
+            "holds": {"$elemMatch": {"hold_id": booking_id, "expires_at": {"$gt": now}}}
+        },
+        {
+            "$pull": {"holds": {"hold_id": booking_id}},
+            "$push": {"bookings": {"booking_id": booking_id, "user_id": user.user_id, "confirmed_at": now.isoformat()}}
+        }
+    )
+    if not result.modified_count:
+        raise HTTPException(status_code=410, detail="La reserva ha expirado")
+    await db.bookings.update_one(
+        {"booking_id": booking_id},
+        {"$set": {"status": "confirmed", "confirmed_at": now.isoformat()}, "$unset": {"expires_at": ""}}
+    )
+    booking.pop("expires_at", None)
+    return {**booking, "status": "confirmed", "confirmed_at": now.isoformat()}
+
+@api_router.delete("/bookings/{booking_id}")
+async def cancel_booking(booking_id: str, user: User = Depends(get_current_user)):
+    booking = await db.bookings.find_one({"booking_id": booking_id, "user_id": user.user_id}, {"_id": 0})
+    if not booking:
+        raise HTTPException(status_code=404, detail="Reserva no encontrada")
+    # Gives the place back only if the hold or booking is still on the slot
+    await db.slots.update_one(
+        {"slot_id": booking["slot_id"], "$or": [
+            {"holds.hold_id": booking_id},
+            {"bookings.booking_id": booking_id}
+        ]},
+        {
+            "$pull": {"holds": {"hold_id": booking_id}, "bookings": {"booking_id": booking_id}},
+            "$inc": {"available": 1}
+        }
+    )
+    await db.bookings.update_one(
+        {"booking_id": booking_id},
+        {"$set": {"status": "cancelled"}, "$unset": {"expires_at": ""}}
+    )
+    return {"message": "Reserva cancelada"}
+
+# ==================== REVIEW ENDPOINTS ====================
+
+# A clinic's rating is kept as a running `rating_sum` / `review_count`
+# pair, bumped with $inc as each review arrives. The `base_*` fields hold
+# the ratings the clinic had before reviews were collected here (the
+# seeded figures). reconcile_ratings() recomputes both from the reviews
+# collection to fix drift, e.g. from a crash between the two writes.
+#
+# Publishing a catalog change rebuilds the snapshot and drops every cache,
+# so reviews don't publish one each: the clinics they touch are collected
+# and published together every RATING_PUBLISH_SECONDS.
+
+# Clinics whose rating changed since the last publish
+pending_rating_clinics: set = set()
+
+def _rating(rating_sum: float, review_count: int) -> float:
+    return round(rating_sum / review_count, 1) if review_count else 0.0
+
+async def publish_rating_changes() -> int:
+    """Publish the pending rating changes as one catalog change"""
+    if not pending_rating_clinics:
+        return 0
+    clinic_ids = sorted(pending_rating_clinics)
+    pending_rating_clinics.clear()
+    try:
+        await publish_catalog_change("ratings", clinic_ids, [])
+    except Exception:
+        pending_rating_clinics.update(clinic_ids)
+        raise
+    return len(clinic_ids)
+
+async def rating_publish_loop():
+    while True:
+        await asyncio.sleep(RATING_PUBLISH_SECONDS)
+        try:
+            await publish_rating_changes()
+        except Exception:
+            logger.exception("Rating publish failed")
+
+async def reconcile_ratings(clinic_ids: Optional[List[str]] = None, defer_publish: bool = False) -> int:
+    """Recompute rating aggregates from the reviews; return how many changed.
+
+    With `defer_publish` the changed clinics wait for the next rating publish.
+    """
+    clinic_query = {"clinic_id": {"$in": clinic_ids}} if clinic_ids is not None else {}
+    clinics = await db.clinics.find(
+        clinic_query,
+        {"_id": 0, "clinic_id": 1, "rating": 1, "review_count": 1, "rating_sum": 1,
+         "base_rating_sum": 1, "base_review_count": 1}
+    ).to_list(None)
+    totals = {
+        row["_id"]: row
+        for row in await db.reviews.aggregate([
+            {"$match": clinic_query},
+            {"$group": {"_id": "$clinic_id", "sum": {"$sum": "$rating"}, "count": {"$sum": 1}}}
+        ]).to_list(None)
+    }
+
+    changed = []
+    ops = []
+    for clinic in clinics:
+        if "base_review_count" in clinic:
+            base_sum, base_count = clinic["base_rating_sum"], clinic["base_review_count"]
+        elif "rating_sum" not in clinic:
+            # Never reviewed here: its current figures are the baseline
+            base_sum, base_count = clinic["rating"] * clinic["review_count"], clinic["review_count"]
+        else:
+            base_sum, base_count = 0, 0
+        total = totals.get(clinic["clinic_id"], {"sum": 0, "count": 0})
+        rating_sum = base_sum + total["sum"]
+        review_count = base_count + total["count"]
+        aggregates = {
+            "rating_sum": rating_sum,
+            "review_count": review_count,
+            "rating": _rating(rating_sum, review_count),
+            "base_rating_sum": base_sum,
+            "base_review_count": base_count
+        }
+        if any(clinic.get(k) != v for k, v in aggregates.items()):
+            changed.append(clinic["clinic_id"])
+            ops.append(UpdateOne(
+                {"clinic_id": clinic["clinic_id"]},
+                {"$set": {**aggregates, "updated_at": datetime.now(timezone.utc).isoformat()}}
+            ))
+    if ops:
+        await db.clinics.bulk_write(ops, ordered=False)
+        if defer_publish:
+            pending_rating_clinics.update(changed)
+        else:
+            await publish_catalog_change("ratings", changed, [])
+    return len(changed)
+
+@api_router.post("/clinics/{clinic_id}/reviews", dependencies=[Depends(rate_limit("reviews"))])
+async def create_review(clinic_id: str, review: ReviewCreate, user: User = Depends(get_current_user)):
+    review_doc = {
+        "review_id": f"review_{uuid.uuid4().hex[:12]}",
+        "clinic_id": clinic_id,
+        "user_id": user.user_id,
+        "user_name": user.name,
+        "rating": review.rating,
+        "comment": review.comment,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    if not await db.clinics.find_one({"clinic_id": clinic_id}, {"_id": 1}, max_time_ms=query_deadline_ms()):
+        raise HTTPException(status_code=404, detail="Clínica no encontrada")
+    try:
+        await db.reviews.insert_one(review_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Ya has valorado esta clínica")
+    review_doc.pop("_id", None)
+
+    clinic = await db.clinics.find_one_and_update(
+        {"clinic_id": clinic_id, "rating_sum": {"$exists": True}},
+        {"$inc": {"rating_sum": review.rating, "review_count": 1}},
+        projection={"_id": 0, "rating_sum": 1, "review_count": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not clinic:
+        # No aggregates yet: computing them counts this review too
+        await reconcile_ratings([clinic_id], defer_publish=True)
+        return review_doc
+    # Only the latest increment's write lands; an older one finds the
+    # count already moved on
+    result = await db.clinics.update_one(
+        {"clinic_id": clinic_id, "review_count": clinic["review_count"]},
+        {"$set": {
+            "rating": _rating(clinic["rating_sum"], clinic["review_count"]),
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }}
+    )
+    if result.modified_count:
+        pending_rating_clinics.add(clinic_id)
+    return review_doc
+
+@api_router.get("/clinics/{clinic_id}/reviews")
+async def get_reviews(clinic_id: str, limit: int = 20, cursor: Optional[str] = None):
+    """Newest reviews first; pass `next_cursor` back as `cursor` for the next page"""
+    limit = max(1, min(limit, REVIEWS_PAGE_MAX))
+    query = {"clinic_id": clinic_id}
+    if cursor:
+        created_at, _, review_id = cursor.partition("|")
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "review_id": {"$lt": review_id}}
+        ]
+    # From the primary, so a review shows up as soon as it is posted
+    reviews = await db.reviews.find(
+        query,
+        {"_id": 0},
+        max_time_ms=query_deadline_ms()
+    ).sort([("created_at", -1), ("review_id", -1)]).limit(limit + 1).to_list(None)
+    next_cursor = None
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        next_cursor = f"{reviews[-1]['created_at']}|{reviews[-1]['review_id']}"
+    return {"reviews": reviews, "next_cursor": next_cursor}
+
+# ==================== EXPORT ENDPOINTS ====================
+
+def _changed_since(since: str) -> dict:
+    """Match documents written at or after `since` (UTC ISO string)"""
+    return {"$or": [
+        {"updated_at": {"$gte": since}},
+        {"updated_at": {"$exists": False}, "created_at": {"$gte": since}}
+    ]}
+
+async def iter_catalog_export(since: Optional[datetime] = None) -> AsyncIterator[bytes]:
+    """Yield clinics joined with their offers as NDJSON, one clinic per line.
+
+    Clinics come from a single aggregation cursor read in batches of
+    EXPORT_BATCH_SIZE, so memory stays flat whatever the catalog size.
+    With `since`, only clinics whose own data, offers or offered
+    treatments changed at or after that instant are exported.
+    """
+    treatments = {
+        t["treatment_id"]: t
+        async for t in catalog_db.treatments.find({}, {"_id": 0, "updated_at": 0})
+    }
+
+    pipeline = [
+        {"$lookup": {
+            "from": "clinic_treatments",
+            "localField": "clinic_id",
+            "foreignField": "clinic_id",
+            "as": "offers"
+        }},
+        {"$project": {**CLINIC_PROJECTION, "offers._id": 0, "offers.clinic_id": 0}}
+    ]
+    if since:
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        since_iso = since.astimezone(timezone.utc).isoformat()
+        changed_treatments = await catalog_db.treatments.distinct(
+            "treatment_id", {"updated_at": {"$gte": since_iso}}
+        )
+        pipeline.insert(1, {"$match": {"$or": [
+            _changed_since(since_iso),
+            {"offers.updated_at": {"$gte": since_iso}},
+            {"offers.treatment_id": {"$in": changed_treatments}}
+        ]}})
+
+    buffer = []
+    buffered = 0
+    async for clinic in catalog_db.clinics.aggregate(pipeline, batchSize=EXPORT_BATCH_SIZE):
+        clinic["offers"] = [
+            {**treatments[offer["treatment_id"]], **offer}
+            for offer in clinic["offers"]
+            if offer["treatment_id"] in treatments
+        ]
+        line = (json.dumps(clinic, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        buffer.append(line)
+        buffered += len(line)
+        # Hand over ~64KB chunks: the client's read pace drives the cursor
+        if buffered >= 65536:
+            yield b"".join(buffer)
+            buffer.clear()
+            buffered = 0
+    if buffer:
+        yield b"".join(buffer)
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Compress a byte stream incrementally into a single gzip member"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@api_router.get("/export")
+async def export_catalog(
+    since: Optional[datetime] = None,
+    gzip: bool = False,
+    user: User = Depends(get_current_user)
+):
+    """Stream the full clinic/offer catalog as NDJSON.
+
+    `X-Export-Started-At` can be passed back as `since` on the next run
+    to fetch only what changed in between. It is backdated by the catalog
+    max staleness so writes not yet replicated to the secondary we read
+    from are picked up by the next run.
+    """
+    started_at = datetime.now(timezone.utc) - timedelta(seconds=CATALOG_MAX_STALENESS_SECONDS)
+    headers = {"X-Export-Started-At": started_at.isoformat()}
+    body = iter_catalog_export(since)
+    if gzip:
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
+
 # ==================== SEED DATA ====================
 
 @api_router.post("/seed")
@@ -515,6 +3228,8 @@ async def seed_database():
     await db.treatments.delete_many({})
     await db.clinics.delete_many({})
     await db.clinic_treatments.delete_many({})
+    await db.clinic_profiles.delete_many({})
+    await db.reviews.delete_many({})
     
     # Treatments
     treatments = [
@@ -562,6 +3277,9 @@ async def seed_database():
         }
     ]
     
+    now = datetime.now(timezone.utc).isoformat()
+    for treatment in treatments:
+        treatment["updated_at"] = now
     await db.treatments.insert_many(treatments)
     
     # Clinics
@@ -648,6 +3366,11 @@ async def seed_database():
         }
     ]
     
+    for clinic in clinics:
+        clinic["updated_at"] = now
+        # The seeded figures are the baseline reviews add to
+        clinic["base_rating_sum"] = clinic["rating_sum"] = clinic["rating"] * clinic["review_count"]
+        clinic["base_review_count"] = clinic["review_count"]
     await db.clinics.insert_many(clinics)
     
     # Clinic Treatments (prices and details for each clinic-treatment combo)
@@ -896,7 +3619,16 @@ async def seed_database():
         }
     ]
     
+    for ct in clinic_treatments:
+        ct["updated_at"] = now
     await db.clinic_treatments.insert_many(clinic_treatments)
+    await record_prices(clinic_treatments, {c["clinic_id"]: c["city"] for c in clinics})
+    
+    await publish_catalog_change(
+        "seed",
+        [c["clinic_id"] for c in clinics],
+        [t["treatment_id"] for t in treatments]
+    )
     
     return {
         "message": "Base de datos inicializada correctamente",
@@ -905,6 +3637,83 @@ async def seed_database():
         "clinic_treatments": len(clinic_treatments)
     }
 
+# ==================== BATCH ENDPOINT ====================
+
+# Read-only routes a page may bootstrap in one round trip
+BATCH_ROUTES = {
+    "/api/auth/me",
+    "/api/treatments",
+    "/api/treatments/{treatment_id}",
+    "/api/treatments/{treatment_id}/price-history",
+    "/api/clinics",
+    "/api/clinics/clusters",
+    "/api/clinics/{clinic_id}",
+    "/api/clinics/{clinic_id}/slots",
+    "/api/clinics/{clinic_id}/reviews",
+    "/api/cities",
+    "/api/compare/{snapshot_id}",
+}
+
+batch_handlers: dict = {}  # route path -> its handler (dependencies, validation, deadline)
+
+def batch_route(path: str) -> Optional[tuple]:
+    """(route, path params) of the batchable GET route serving `path`"""
+    scope = {"type": "http", "method": "GET", "path": path}
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.path in BATCH_ROUTES:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                return route, child_scope["path_params"]
+    return None
+
+async def run_batch_item(request: Request, item: BatchItem) -> tuple:
+    """(status, JSON body bytes) of one sub-request, run in-process"""
+    url = urlsplit(item.path)
+    found = batch_route(url.path)
+    if not found:
+        return 404, _dump_json({"detail": "Ruta no disponible en lote"})
+    route, path_params = found
+    handler = batch_handlers.get(route.path)
+    if handler is None:
+        handler = batch_handlers[route.path] = route.get_route_handler()
+    query = parse_qsl(url.query) + [
+        (key, value) for key, values in item.params.items()
+        for value in (values if isinstance(values, list) else [values]) if value is not None
+    ]
+    # Same caller, plain JSON: the batch response is what gets compressed
+    headers = [(k, v) for k, v in request.scope["headers"] if k not in (b"accept-encoding", b"content-length", b"content-type")]
+    scope = {
+        **request.scope,
+        "method": "GET",
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": urlencode(query).encode(),
+        "headers": headers,
+        "endpoint": route.endpoint,
+        "route": route,
+        "path_params": path_params,
+    }
+    try:
+        response = await handler(Request(scope))
+    except HTTPException as exc:
+        return exc.status_code, _dump_json({"detail": exc.detail})
+    except RequestValidationError as exc:
+        return 422, _dump_json({"detail": jsonable_encoder(exc.errors())})
+    except Exception:
+        logger.exception("Batch sub-request %s failed", url.path)
+        return 500, _dump_json({"detail": "Error interno del servidor"})
+    return response.status_code, response.body
+
+@api_router.post("/batch")
+async def batch(body: BatchRequest, request: Request):
+    """Run several read-only GETs concurrently; one status and body per item, in order"""
+    if len(body.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"Máximo {BATCH_MAX_REQUESTS} solicitudes por lote")
+    results = await asyncio.gather(*(run_batch_item(request, item) for item in body.requests))
+    # Sub-responses are already rendered JSON; splice them in rather than re-parse
+    items = [b'{"status":%d,"body":%s}' % (status, content or b"null") for status, content in results]
+    return Response(b'{"results":[' + b",".join(items) + b"]}", media_type="application/json")
+
 # ==================== ROOT ====================
 
 @api_router.get("/")
@@ -915,9 +3724,116 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+@api_router.get("/ready")
+async def ready():
+    """Readiness probe: warm-up finished and Mongo answers a ping"""
+    if warmup_state["status"] == "failed":
+        await warm_up()
+    started = time.perf_counter()
+    try:
+        await db.command("ping")
+        ping_ms = round((time.perf_counter() - started) * 1000, 2)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={
+            "status": "unavailable",
+            "mongo_error": str(e),
+            "warmup": warmup_state,
+            "circuit": mongo_breaker.state
+        })
+    is_ready = warmup_state["status"] == "ready"
+    return JSONResponse(status_code=200 if is_ready else 503, content={
+        "status": "ready" if is_ready else "warming",
+        "mongo_ping_ms": ping_ms,
+        "warmup": warmup_state,
+        "circuit": mongo_breaker.state
+    })
+
+# ==================== ADMIN ====================
+
+@api_router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Most recent request profiles, newest first"""
+    return [
+        {k: v for k, v in profile.items() if k != "stacks"}
+        for profile in reversed(profile_store.values())
+    ]
+
+@api_router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """One profile in collapsed-stack format (flamegraph.pl, speedscope)"""
+    profile = profile_store.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    lines = [f"{stack} {count}" for stack, count in profile["stacks"].most_common()]
+    return PlainTextResponse("\n".join(lines) + "\n")
+
+@api_router.post("/admin/clinic-profiles/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_profiles():
+    """Recompute every clinic profile, e.g. after a bulk import"""
+    if not CLINIC_PROFILES_ENABLED:
+        raise HTTPException(status_code=409, detail="Los perfiles de clínica están desactivados")
+    await rebuild_clinic_profiles()
+    return {"profiles": await db.clinic_profiles.count_documents({})}
+
+@api_router.post("/admin/ratings/reconcile", dependencies=[Depends(require_admin)])
+async def reconcile_ratings_now():
+    """Recompute every clinic's rating from its reviews"""
+    return {"clinics_updated": await reconcile_ratings()}
+
+@api_router.get("/admin/searches/top", dependencies=[Depends(require_admin)])
+async def get_top_searches(route: str = "clinics", limit: int = 20, hours: float = 24):
+    """Most frequent parameter combinations, with the analytics buffer's counters"""
+    return {
+        "route": route,
+        "searches": await top_searches(route, max(1, min(limit, 100)), hours),
+        "stats": {**search_stats, "buffered": len(search_buffer)}
+    }
+
 # Include the router
 app.include_router(api_router)
 
+class DiagnosticsMiddleware:
+    """Server-Timing and X-Profile-Id headers for /api requests.
+
+    Plain ASGI: requests that are neither timed nor possibly profiled go
+    straight through, so ordinary requests and SSE streams pay nothing.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api"):
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        timed = SERVER_TIMING_ENABLED or headers.get(b"x-debug-timing") == b"1"
+        profiled = PROFILER_SAMPLE_RATE > 0 or headers.get(b"x-profile") == b"1"
+        if not timed and not profiled:
+            return await self.app(scope, receive, send)
+
+        timing = RequestTiming() if timed else None
+        # profile_request stores the profile id here via request.state
+        state = scope.setdefault("state", {})
+
+        async def send_with_diagnostics(message):
+            if message["type"] == "http.response.start":
+                extra = []
+                if timing:
+                    extra.append((b"server-timing", timing.header().encode()))
+                if state.get("profile_id"):
+                    extra.append((b"x-profile-id", state["profile_id"].encode()))
+                message = {**message, "headers": [*message.get("headers", []), *extra]}
+            await send(message)
+
+        token = request_timing.set(timing) if timing else None
+        try:
+            await self.app(scope, receive, send_with_diagnostics)
+        finally:
+            if token:
+                request_timing.reset(token)
+
+app.add_middleware(DiagnosticsMiddleware)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -933,7 +3849,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
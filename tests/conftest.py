@@ -0,0 +1,239 @@
+"""Shared fixtures: the FastAPI app in-process against an isolated database.
+
+By default the app talks to mongomock-motor, so the suite runs fully offline.
+Set MONGO_TEST_URL (e.g. mongodb://localhost:27017) to run the same tests
+against a real mongod; each test then gets a throwaway database.
+"""
+import os
+import sys
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", MONGO_TEST_URL or "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "denticompare_test")
+
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+import server
+
+# Commands that hit collection data; pings, getMore and session bookkeeping
+# are not what the per-endpoint budgets are about.
+COUNTED_COMMANDS = {"find", "aggregate", "distinct", "count", "insert", "update", "delete", "findAndModify"}
+
+# mongomock issues no driver events, so its collection methods are mapped
+# to the command each would send, and reported to the app as the driver would
+MOCK_COMMANDS = {
+    "find": "find",
+    "find_one": "find",
+    "aggregate": "aggregate",
+    "distinct": "distinct",
+    "count_documents": "aggregate",
+    "insert_one": "insert",
+    "insert_many": "insert",
+    "update_one": "update",
+    "update_many": "update",
+    "replace_one": "update",
+    "delete_one": "delete",
+    "delete_many": "delete",
+    "bulk_write": "update",
+    "find_one_and_update": "findAndModify",
+    "find_one_and_delete": "findAndModify",
+}
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Records the Mongo commands the app sends"""
+
+    def __init__(self):
+        self.commands = []
+
+    @property
+    def count(self) -> int:
+        return len(self.commands)
+
+    def reset(self):
+        self.commands.clear()
+
+    def started(self, event):
+        if event.command_name in COUNTED_COMMANDS:
+            self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class CountingCollection:
+    def __init__(self, collection, counter: CommandCounter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        command = MOCK_COMMANDS.get(name)
+        if command is None:
+            return attr
+
+        def counted(*args, **kwargs):
+            self._counter.commands.append(command)
+            server.note_mongo_command()
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingDatabase:
+    """Wraps a mongomock database so collection calls are counted"""
+
+    def __init__(self, database, counter: CommandCounter):
+        self._database = database
+        self._counter = counter
+
+    def command(self, *args, **kwargs):
+        return self._database.command(*args, **kwargs)
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self._counter)
+
+    def __getattr__(self, name):
+        return CountingCollection(self._database[name], self._counter)
+
+
+def make_catalog(clinics: int, treatments: int = 6, offers_per_clinic: int = 3):
+    """Deterministic synthetic catalog: (treatments, clinics, clinic_treatments)"""
+    now = datetime.now(timezone.utc).isoformat()
+    cities = ["Madrid", "Barcelona", "Valencia", "Sevilla", "Bilbao", "Málaga", "Zaragoza"]
+    treatment_docs = [
+        {
+            "treatment_id": f"treatment-{t}",
+            "name": f"Tratamiento {t}",
+            "description": f"Descripción del tratamiento {t}",
+            "category": f"Categoría {t % 4}",
+            "icon": "tooth",
+            "updated_at": now
+        }
+        for t in range(treatments)
+    ]
+    clinic_docs = []
+    offer_docs = []
+    for c in range(clinics):
+        clinic_docs.append({
+            "clinic_id": f"clinic-{c}",
+            "name": f"Clínica {c}",
+            "description": f"Clínica dental número {c}",
+            "address": f"Calle Mayor {c}",
+            "city": cities[c % len(cities)],
+            "postal_code": f"{28000 + c % 1000:05d}",
+            "latitude": 36.0 + (c * 7 % 700) / 100,
+            "longitude": -9.0 + (c * 13 % 1200) / 100,
+            "phone": f"+34 600 {c:06d}",
+            "email": f"info@clinic{c}.es",
+            "image_url": f"https://example.com/clinic-{c}.jpg",
+            "rating": round(3.5 + (c % 15) / 10, 1),
+            "review_count": 10 + c % 300,
+            "created_at": now,
+            "updated_at": now
+        })
+        for o in range(min(offers_per_clinic, treatments)):
+            treatment_id = f"treatment-{(c + o) % treatments}"
+            offer_docs.append({
+                "id": f"ct_{c}_{o}",
+                "clinic_id": f"clinic-{c}",
+                "treatment_id": treatment_id,
+                "price": 50 + (c * 37 + o * 101) % 3000,
+                "duration_days": 1 + (c + o) % 365,
+                "warranty_months": (c + o) % 120,
+                "process_steps": [f"Paso {s}" for s in range(5)],
+                "includes": [f"Incluye {i}" for i in range(4)],
+                "updated_at": now
+            })
+    return treatment_docs, clinic_docs, offer_docs
+
+
+@pytest.fixture
+def command_counter():
+    return CommandCounter()
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path, command_counter):
+    monkeypatch.setattr(server, "CATALOG_SNAPSHOT_DIR", tmp_path / "snapshot")
+    monkeypatch.setattr(server, "CATALOG_SNAPSHOT_CHECK_SECONDS", 0)
+    # Tests flush and prewarm explicitly; only the startup pass runs
+    monkeypatch.setattr(server, "SEARCH_FLUSH_SECONDS", 3600)
+    monkeypatch.setattr(server, "search_buffer", server.deque(maxlen=server.SEARCH_BUFFER_SIZE))
+    monkeypatch.setattr(server, "result_cache", server.OrderedDict())
+    monkeypatch.setattr(server, "response_cache", server.ResponseCache(server.RESPONSE_CACHE_BYTES))
+    monkeypatch.setattr(server, "_snapshot", None)
+    monkeypatch.setattr(server, "rate_limiter", server.TokenBucketLimiter(server.RATE_LIMIT_MAX_KEYS))
+    monkeypatch.setattr(server, "revoked_sessions", {})
+    # Tests publish rating changes explicitly
+    monkeypatch.setattr(server, "RATING_PUBLISH_SECONDS", 3600)
+    monkeypatch.setattr(server, "pending_rating_clinics", set())
+    monkeypatch.setitem(server.revocation_sync, "since", None)
+    monkeypatch.setitem(server.MONGO_POOL_OPTIONS, "minPoolSize", 1)
+
+    if MONGO_TEST_URL:
+        monkeypatch.setitem(os.environ, "DB_NAME", f"denticompare_test_{uuid.uuid4().hex[:8]}")
+        monkeypatch.setattr(server, "create_mongo_client", lambda: AsyncIOMotorClient(
+            MONGO_TEST_URL,
+            event_listeners=[server.MongoTimingListener(), command_counter]
+        ))
+    else:
+        monkeypatch.setattr(server, "create_mongo_client", AsyncMongoMockClient)
+
+    with TestClient(server.app) as test_client:
+        if not MONGO_TEST_URL:
+            server.db = CountingDatabase(server.db, command_counter)
+            server.catalog_db = CountingDatabase(server.catalog_db, command_counter)
+        yield test_client
+        if MONGO_TEST_URL:
+            test_client.portal.call(server.client.drop_database, os.environ["DB_NAME"])
+
+
+@pytest.fixture
+def run(client):
+    """Run a coroutine function on the app's event loop"""
+    def _run(fn, *args, **kwargs):
+        return client.portal.call(lambda: fn(*args, **kwargs))
+    return _run
+
+
+@pytest.fixture
+def users(run):
+    """Insert users directly and return their bearer headers"""
+    def _users(count):
+        now = datetime.now(timezone.utc).isoformat()
+        docs = [
+            {"user_id": f"user_{u}", "email": f"u{u}@example.com", "name": f"U{u}", "created_at": now}
+            for u in range(count)
+        ]
+        run(server.db.users.insert_many, docs)
+        return [{"Authorization": f"Bearer {server.create_session_token(d)}"} for d in docs]
+    return _users
+
+
+@pytest.fixture
+def seed_catalog(run):
+    """Insert a synthetic catalog and publish it like a catalog write would"""
+    async def _seed(**sizes):
+        treatments, clinics, offers = make_catalog(**sizes)
+        await server.db.treatments.insert_many(treatments)
+        await server.db.clinics.insert_many(clinics)
+        if offers:
+            await server.db.clinic_treatments.insert_many(offers)
+        await server.refresh_catalog_snapshot(await server.bump_catalog_version())
+        return treatments, clinics, offers
+
+    def seed(**sizes):
+        return run(_seed, **sizes)
+    return seed
@@ -0,0 +1,59 @@
+import server
+
+
+def test_batch_matches_individual_requests(client, seed_catalog, command_counter):
+    seed_catalog(clinics=20)
+    requests = [
+        {"path": "/api/treatments"},
+        {"path": "/api/cities"},
+        {"path": "/api/clinics", "params": {"city": "Madrid", "treatment_id": "treatment-1"}},
+        {"path": "/api/clinics/clinic-3", "params": {"fields": "name,city"}},
+    ]
+
+    response = client.post("/api/batch", json={"requests": requests})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    for request, result in zip(requests, results):
+        direct = client.get(request["path"], params=request.get("params"))
+        assert result == {"status": 200, "body": direct.json()}
+
+
+def test_each_item_gets_its_own_status(client, seed_catalog):
+    seed_catalog(clinics=5)
+    requests = [
+        {"path": "/api/clinics/no-existe"},
+        {"path": "/api/clinics", "params": {"min_rating": "mucho"}},
+        {"path": "/api/auth/me"},
+        {"path": "/api/compare", "params": {}},
+        {"path": "/api/export"},
+        {"path": "/api/cities"},
+    ]
+
+    results = client.post("/api/batch", json={"requests": requests}).json()["results"]
+
+    assert [r["status"] for r in results] == [404, 422, 401, 404, 404, 200]
+    assert results[0]["body"]["detail"] == "Clínica no encontrada"
+
+
+def test_batch_uses_the_callers_credentials(client):
+    token = client.post(
+        "/api/auth/register",
+        json={"email": "lote@example.com", "password": "secreto", "name": "Lote"}
+    ).json()["token"]
+    client.cookies.clear()
+
+    results = client.post(
+        "/api/batch",
+        json={"requests": [{"path": "/api/auth/me"}]},
+        headers={"Authorization": f"Bearer {token}"}
+    ).json()["results"]
+
+    assert results[0]["body"]["email"] == "lote@example.com"
+
+
+def test_batch_size_is_capped(client, monkeypatch):
+    monkeypatch.setattr(server, "BATCH_MAX_REQUESTS", 2)
+    response = client.post("/api/batch", json={"requests": [{"path": "/api/cities"}] * 3})
+    assert response.status_code == 400
+    assert client.post("/api/batch", json={"requests": []}).status_code == 422
@@ -0,0 +1,130 @@
+"""Slot booking: lifecycle, hold expiry and a contention load test.
+
+The load test fires hundreds of concurrent holds at one popular slot and
+checks that exactly `capacity` of them win. Its latency budget is for the
+in-memory stand-in; scale it with PERF_BUDGET_SCALE, and run it against a
+real mongod with MONGO_TEST_URL to see actual write contention.
+"""
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import server
+
+ADMIN = {"X-Admin-Token": "test-admin-token"}
+BUDGET_SCALE = float(os.environ.get("PERF_BUDGET_SCALE", "1"))
+CONTENDERS = 300
+CAPACITY = 5
+# p95 of one contended hold request, in milliseconds
+CONTENDED_HOLD_P95_MS = 1500
+
+
+@pytest.fixture
+def slot(client, seed_catalog, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "test-admin-token")
+    seed_catalog(clinics=2, treatments=2, offers_per_clinic=1)
+    starts_at = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+
+    def _slot(capacity=CAPACITY):
+        client.post("/api/clinics/clinic-0/slots", headers=ADMIN, json={"slots": [
+            {"treatment_id": "treatment-0", "starts_at": starts_at, "capacity": capacity}
+        ]})
+        return client.get("/api/clinics/clinic-0/slots").json()[0]["slot_id"]
+    return _slot
+
+
+def test_hold_confirm_cancel(client, slot, users):
+    slot_id = slot(capacity=1)
+    alice, bob = users(2)
+
+    held = client.post("/api/bookings", json={"slot_id": slot_id}, headers=alice).json()
+    assert client.post("/api/bookings", json={"slot_id": slot_id}, headers=bob).status_code == 409
+    assert client.post("/api/bookings", json={"slot_id": slot_id}, headers=alice).status_code == 409
+    confirmed = client.post(f"/api/bookings/{held['booking_id']}/confirm", headers=alice).json()
+    assert confirmed["status"] == "confirmed"
+    assert client.get("/api/clinics/clinic-0/slots").json()[0]["available"] == 0
+
+    client.delete(f"/api/bookings/{held['booking_id']}", headers=alice)
+    client.delete(f"/api/bookings/{held['booking_id']}", headers=alice)
+
+    assert client.get("/api/clinics/clinic-0/slots").json()[0]["available"] == 1
+    assert client.post("/api/bookings", json={"slot_id": slot_id}, headers=bob).status_code == 200
+
+
+def test_slot_listing_reads_the_primary(client, slot, monkeypatch):
+    slot()
+    # A secondary may still show places that have just sold out
+    monkeypatch.setattr(server, "catalog_db", None)
+
+    assert client.get("/api/clinics/clinic-0/slots").status_code == 200
+
+
+def test_expired_hold_gives_place_back(client, slot, users, monkeypatch):
+    slot_id = slot(capacity=1)
+    alice, bob = users(2)
+    monkeypatch.setattr(server, "BOOKING_HOLD_SECONDS", 0)
+    held = client.post("/api/bookings", json={"slot_id": slot_id}, headers=alice).json()
+    monkeypatch.setattr(server, "BOOKING_HOLD_SECONDS", 600)
+
+    assert client.get("/api/clinics/clinic-0/slots").json()[0]["available"] == 1
+    assert client.post("/api/bookings", json={"slot_id": slot_id}, headers=bob).status_code == 200
+    # 404 once the TTL monitor has removed the hold, 410 before that
+    assert client.post(f"/api/bookings/{held['booking_id']}/confirm", headers=alice).status_code in (404, 410)
+
+
+def test_slot_times_are_normalized_to_utc(client, slot):
+    slot()
+    created = client.post("/api/clinics/clinic-0/slots", headers=ADMIN, json={"slots": [
+        {"treatment_id": "treatment-0", "starts_at": "2030-01-01T10:00:00+02:00"},
+        {"treatment_id": "treatment-0", "starts_at": "2030-01-01T08:00:00+00:00"},
+        {"treatment_id": "treatment-0", "starts_at": "2030-01-01T08:30:00-01:00"},
+    ]}).json()
+
+    listed = client.get("/api/clinics/clinic-0/slots", params={
+        "date_from": "2030-01-01T09:00:00+01:00", "date_to": "2030-01-01T12:00:00+02:00"
+    }).json()
+
+    # 10:00+02:00 and 08:00Z are the same instant
+    assert created == {"created": 2}
+    assert [s["starts_at"] for s in listed] == ["2030-01-01T08:00:00+00:00", "2030-01-01T09:30:00+00:00"]
+
+
+def test_slots_only_for_offered_treatments(client, slot):
+    slot()
+
+    response = client.post("/api/clinics/clinic-0/slots", headers=ADMIN, json={"slots": [
+        {"treatment_id": "treatment-1", "starts_at": "2030-01-01T10:00:00Z"}
+    ]})
+
+    assert response.status_code == 400
+
+
+def test_contended_slot_never_double_books(client, slot, users, run):
+    slot_id = slot()
+    headers = users(CONTENDERS)
+
+    async def contend():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as http:
+            async def attempt(h):
+                started = time.perf_counter()
+                response = await http.post("/api/bookings", json={"slot_id": slot_id}, headers=h)
+                return response.status_code, (time.perf_counter() - started) * 1000
+            return await asyncio.gather(*(attempt(h) for h in headers))
+
+    outcomes = run(contend)
+
+    statuses = [status for status, _ in outcomes]
+    assert statuses.count(200) == CAPACITY
+    assert statuses.count(409) == CONTENDERS - CAPACITY
+    stored = run(server.db.slots.find_one, {"slot_id": slot_id})
+    assert stored["available"] == 0
+    assert len({h["user_id"] for h in stored["holds"]}) == CAPACITY
+    assert run(server.db.bookings.count_documents, {"slot_id": slot_id}) == CAPACITY
+    p95 = statistics.quantiles([ms for _, ms in outcomes], n=20)[-1]
+    assert p95 <= CONTENDED_HOLD_P95_MS * BUDGET_SCALE
@@ -0,0 +1,67 @@
+import server
+
+ADMIN = {"X-Admin-Token": "test-admin-token"}
+
+
+def test_bulk_update_reports_each_item(client, seed_catalog, run, command_counter, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "test-admin-token")
+    seed_catalog(clinics=50, treatments=4, offers_per_clinic=2)
+    run(server.db.clinic_treatments.update_one, {"id": "ct_1_0"}, {"$set": {"version": 3}})
+    version_before = run(server.get_catalog_version)
+    items = [{"id": f"ct_{c}_0", "price": 99 + c, "version": 0} for c in range(2, 50)]
+    items += [
+        {"id": "ct_0_0", "price": 10, "version": 0},
+        {"id": "ct_1_0", "price": 11, "version": 2},
+        {"id": "missing", "price": 12, "version": 0},
+    ]
+    command_counter.reset()
+
+    response = client.post("/api/clinic-treatments/prices", json={"items": items}, headers=ADMIN)
+
+    body = response.json()
+    statuses = {r["id"]: r for r in body["results"]}
+    assert [r["id"] for r in body["results"]] == [item["id"] for item in items]
+    assert statuses["ct_0_0"] == {"id": "ct_0_0", "status": "updated", "version": 1}
+    assert statuses["ct_1_0"] == {"id": "ct_1_0", "status": "conflict", "version": 3}
+    assert statuses["missing"]["status"] == "not_found"
+    assert body["updated"] == 49
+    # One catalog change for the whole batch
+    assert body["catalog_version"] == version_before + 1
+    assert run(server.db.catalog_events.count_documents, {"kind": "prices"}) == 1
+    assert command_counter.commands.count("update") == 1
+    offer = run(server.db.clinic_treatments.find_one, {"id": "ct_0_0"})
+    assert (offer["price"], offer["version"]) == (10, 1)
+
+
+def test_stale_version_loses_race(client, seed_catalog, run, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "test-admin-token")
+    seed_catalog(clinics=2)
+    first = {"items": [{"id": "ct_0_0", "price": 10, "version": 0}]}
+    second = {"items": [{"id": "ct_0_0", "price": 20, "version": 0}]}
+
+    client.post("/api/clinic-treatments/prices", json=first, headers=ADMIN)
+    response = client.post("/api/clinic-treatments/prices", json=second, headers=ADMIN)
+
+    assert response.json()["results"][0] == {"id": "ct_0_0", "status": "conflict", "version": 1}
+    assert response.json()["catalog_version"] is None
+    assert run(server.db.clinic_treatments.find_one, {"id": "ct_0_0"})["price"] == 10
+
+
+def test_partner_only_edits_own_clinics(client, seed_catalog, run):
+    seed_catalog(clinics=2)
+    token = client.post(
+        "/api/auth/register",
+        json={"email": "socio@example.com", "password": "secreto", "name": "Socio"}
+    ).json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    items = {"items": [
+        {"id": "ct_0_0", "price": 10, "version": 0},
+        {"id": "ct_1_0", "price": 10, "version": 0},
+    ]}
+
+    assert client.post("/api/clinic-treatments/prices", json=items, headers=headers).status_code == 403
+
+    run(server.db.users.update_one, {"email": "socio@example.com"}, {"$set": {"clinic_ids": ["clinic-0"]}})
+    results = client.post("/api/clinic-treatments/prices", json=items, headers=headers).json()["results"]
+
+    assert [r["status"] for r in results] == ["updated", "forbidden"]
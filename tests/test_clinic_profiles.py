@@ -0,0 +1,110 @@
+"""The clinic_profiles read model serves the same responses in one read.
+
+mongomock has no $merge, so the full rebuild test only runs with
+MONGO_TEST_URL.
+"""
+import os
+
+import pytest
+
+import server
+
+needs_mongod = pytest.mark.skipif(not os.environ.get("MONGO_TEST_URL"), reason="needs MONGO_TEST_URL")
+
+
+@pytest.fixture
+def profiles(monkeypatch):
+    monkeypatch.setattr(server, "CATALOG_SNAPSHOT_ENABLED", False)
+    monkeypatch.setattr(server, "CLINIC_PROFILES_ENABLED", True)
+
+
+def refresh_all(run, clinics):
+    run(server.refresh_clinic_profiles, [c["clinic_id"] for c in clinics])
+
+
+def test_get_clinic_matches_join_path(client, seed_catalog, run, command_counter, profiles, monkeypatch):
+    _, clinics, _ = seed_catalog(clinics=4, treatments=6, offers_per_clinic=5)
+    refresh_all(run, clinics)
+    command_counter.reset()
+
+    from_profile = client.get("/api/clinics/clinic-1")
+
+    assert from_profile.status_code == 200
+    assert command_counter.count == 1
+    monkeypatch.setattr(server, "CLINIC_PROFILES_ENABLED", False)
+    assert from_profile.json() == client.get("/api/clinics/clinic-1").json()
+
+
+def test_get_clinic_missing_profile_is_404(client, seed_catalog, run, profiles):
+    _, clinics, _ = seed_catalog(clinics=2)
+    refresh_all(run, clinics)
+
+    assert client.get("/api/clinics/missing").status_code == 404
+
+
+def test_compare_matches_join_path(client, seed_catalog, run, command_counter, profiles, monkeypatch):
+    _, clinics, _ = seed_catalog(clinics=8, treatments=3, offers_per_clinic=2)
+    refresh_all(run, clinics)
+    body = {"clinic_ids": ["clinic-5", "missing", "clinic-0", "clinic-1"], "treatment_id": "treatment-1"}
+    command_counter.reset()
+
+    from_profile = client.post("/api/compare", json=body)
+
+    assert from_profile.status_code == 200
+    assert command_counter.count == 1
+    monkeypatch.setattr(server, "CLINIC_PROFILES_ENABLED", False)
+    assert from_profile.json() == client.post("/api/compare", json=body).json()
+
+
+def test_compare_unknown_treatment_is_404(client, seed_catalog, run, profiles):
+    _, clinics, _ = seed_catalog(clinics=2)
+    refresh_all(run, clinics)
+
+    response = client.post("/api/compare", json={"clinic_ids": ["clinic-0", "clinic-1"], "treatment_id": "nope"})
+
+    assert response.status_code == 404
+
+
+def test_refresh_follows_offer_changes_and_removals(client, seed_catalog, run, profiles):
+    _, clinics, _ = seed_catalog(clinics=3, treatments=4, offers_per_clinic=2)
+    refresh_all(run, clinics)
+
+    run(server.db.clinic_treatments.update_one, {"id": "ct_0_0"}, {"$set": {"price": 1}})
+    run(server.refresh_profiles_for_treatments, ["treatment-0"])
+    run(server.db.clinics.delete_one, {"clinic_id": "clinic-2"})
+    refresh_all(run, clinics)
+
+    offers = client.get("/api/clinics/clinic-0").json()["treatments"]
+    assert {o["treatment_id"]: o["price"] for o in offers}["treatment-0"] == 1
+    assert client.get("/api/clinics/clinic-2").status_code == 404
+
+
+def test_treatment_change_refreshes_offering_clinics(client, seed_catalog, run, profiles):
+    _, clinics, _ = seed_catalog(clinics=4, treatments=4, offers_per_clinic=2)
+    refresh_all(run, clinics)
+
+    run(server.db.treatments.update_one, {"treatment_id": "treatment-1"}, {"$set": {"name": "Implante"}})
+    run(server.publish_catalog_change, "treatments", [], ["treatment-1"])
+
+    # clinic-0 and clinic-1 offer treatment-1; clinic-2 and clinic-3 do not
+    for clinic_id in ("clinic-0", "clinic-1"):
+        offers = client.get(f"/api/clinics/{clinic_id}").json()["treatments"]
+        assert {o["treatment_id"]: o["name"] for o in offers}["treatment-1"] == "Implante"
+
+
+@needs_mongod
+def test_rebuild_matches_incremental_refresh(client, seed_catalog, run, profiles, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "test-admin-token")
+    _, clinics, _ = seed_catalog(clinics=6, treatments=4, offers_per_clinic=3)
+    refresh_all(run, clinics)
+    incremental = {c["clinic_id"]: client.get(f"/api/clinics/{c['clinic_id']}").json() for c in clinics}
+    run(server.db.clinics.delete_one, {"clinic_id": "clinic-5"})
+
+    response = client.post("/api/admin/clinic-profiles/rebuild", headers={"X-Admin-Token": "test-admin-token"})
+
+    assert response.status_code == 200
+    for clinic_id, expected in incremental.items():
+        if clinic_id == "clinic-5":
+            assert client.get(f"/api/clinics/{clinic_id}").status_code == 404
+        else:
+            assert client.get(f"/api/clinics/{clinic_id}").json() == expected
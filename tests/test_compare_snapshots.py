@@ -0,0 +1,68 @@
+import pytest
+
+import server
+
+ADMIN = {"X-Admin-Token": "test-admin-token"}
+BODY = {"clinic_ids": ["clinic-2", "clinic-0", "clinic-1"], "treatment_id": "treatment-0"}
+
+
+def clinic_order(result: dict) -> list:
+    return [c["clinic"]["clinic_id"] for c in result["comparisons"]]
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(server, "compare_snapshot_cache", server.OrderedDict())
+
+
+def test_shared_compare_is_served_from_memory(client, seed_catalog, command_counter):
+    seed_catalog(clinics=3, treatments=1, offers_per_clinic=1)
+
+    shared = client.post("/api/compare", json={**BODY, "share": True}).json()
+    command_counter.reset()
+    viewed = client.get(f"/api/compare/{shared['snapshot_id']}").json()
+
+    # Views list the clinics in id order; the sharer got their own order
+    assert clinic_order(viewed) == ["clinic-0", "clinic-1", "clinic-2"]
+    assert clinic_order(shared) == BODY["clinic_ids"]
+    assert sorted(viewed["comparisons"], key=str) == sorted(shared["comparisons"], key=str)
+    # The snapshot path reads the catalog version from the mapped file
+    assert command_counter.count == 0
+
+
+def test_snapshot_id_ignores_clinic_order(client, seed_catalog):
+    seed_catalog(clinics=3, treatments=1, offers_per_clinic=1)
+
+    first = client.post("/api/compare", json={**BODY, "share": True}).json()
+    second = client.post("/api/compare", json={**BODY, "clinic_ids": ["clinic-0", "clinic-1", "clinic-2"], "share": True}).json()
+
+    assert first["snapshot_id"] == second["snapshot_id"]
+    assert clinic_order(first) == BODY["clinic_ids"]
+    assert clinic_order(second) == ["clinic-0", "clinic-1", "clinic-2"]
+
+
+def test_survives_worker_restart_through_collection(client, seed_catalog, monkeypatch):
+    seed_catalog(clinics=3, treatments=1, offers_per_clinic=1)
+    shared = client.post("/api/compare", json={**BODY, "clinic_ids": sorted(BODY["clinic_ids"]), "share": True}).json()
+    server.compare_snapshot_cache.clear()
+
+    assert client.get(f"/api/compare/{shared['snapshot_id']}").json() == shared
+
+
+def test_catalog_change_recomputes_under_new_id(client, seed_catalog, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "test-admin-token")
+    seed_catalog(clinics=3, treatments=1, offers_per_clinic=1)
+    shared = client.post("/api/compare", json={**BODY, "share": True}).json()
+
+    client.post("/api/clinic-treatments/prices", headers=ADMIN, json={"items": [
+        {"id": "ct_0_0", "price": 1, "version": 0}
+    ]})
+    viewed = client.get(f"/api/compare/{shared['snapshot_id']}").json()
+
+    assert viewed["snapshot_id"] != shared["snapshot_id"]
+    prices = {c["clinic"]["clinic_id"]: c["treatment"]["price"] for c in viewed["comparisons"]}
+    assert prices["clinic-0"] == 1
+
+
+def test_unknown_snapshot_is_404(client):
+    assert client.get("/api/compare/nope").status_code == 404
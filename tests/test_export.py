@@ -0,0 +1,85 @@
+import argparse
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import export_catalog
+import server
+
+OLD = "2024-01-01T00:00:00+00:00"
+
+
+def lines(body: bytes) -> list:
+    return [json.loads(line) for line in body.decode("utf-8").splitlines()]
+
+
+@pytest.fixture
+def auth(users):
+    (headers,) = users(1)
+    return headers
+
+
+def test_export_streams_one_clinic_per_line(client, seed_catalog, auth):
+    _, clinics, offers = seed_catalog(clinics=12, offers_per_clinic=2)
+
+    response = client.get("/api/export", headers=auth)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    exported = lines(response.content)
+    assert [c["clinic_id"] for c in exported] == [c["clinic_id"] for c in clinics]
+    first = exported[0]
+    assert {o["id"] for o in first["offers"]} == {o["id"] for o in offers if o["clinic_id"] == "clinic-0"}
+    # Offers carry their treatment's details; internals stay out
+    assert first["offers"][0]["name"].startswith("Tratamiento")
+    assert "_id" not in first and "clinic_id" not in first["offers"][0]
+    assert not set(server.RATING_AGGREGATE_FIELDS) & set(first)
+
+
+def test_export_gzip(client, seed_catalog, auth):
+    seed_catalog(clinics=5)
+    plain = client.get("/api/export", headers=auth).content
+
+    with client.stream("GET", "/api/export", params={"gzip": "true"}, headers=auth) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        body = b"".join(response.iter_raw())
+
+    assert gzip.decompress(body) == plain
+
+
+def test_export_since_returns_only_changes(client, seed_catalog, run, auth):
+    seed_catalog(clinics=6)
+    for collection in (server.db.clinics, server.db.clinic_treatments, server.db.treatments):
+        run(collection.update_many, {}, {"$set": {"updated_at": OLD}})
+    since = datetime.now(timezone.utc) - timedelta(minutes=1)
+    now = datetime.now(timezone.utc).isoformat()
+    run(server.db.clinics.update_one, {"clinic_id": "clinic-1"}, {"$set": {"updated_at": now}})
+    run(server.db.clinic_treatments.update_one, {"id": "ct_3_0"}, {"$set": {"updated_at": now}})
+
+    response = client.get("/api/export", params={"since": since.isoformat()}, headers=auth)
+
+    assert sorted(c["clinic_id"] for c in lines(response.content)) == ["clinic-1", "clinic-3"]
+    started_at = datetime.fromisoformat(response.headers["x-export-started-at"])
+    assert started_at <= datetime.now(timezone.utc) - timedelta(seconds=server.CATALOG_MAX_STALENESS_SECONDS - 1)
+
+
+def test_export_requires_login(client):
+    assert client.get("/api/export").status_code == 401
+
+
+def test_export_script_writes_gzip_file(client, seed_catalog, run, monkeypatch, tmp_path):
+    seed_catalog(clinics=4)
+    expected = run(lambda: collect(server.iter_catalog_export()))
+    # Reuse the app's connection: a fresh in-memory client would be empty
+    monkeypatch.setattr(server, "connect_mongo", lambda: None)
+    output = tmp_path / "catalog.ndjson.gz"
+
+    run(export_catalog.main, argparse.Namespace(since=None, gzip=True, output=str(output)))
+
+    assert gzip.decompress(output.read_bytes()) == expected
+
+
+async def collect(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
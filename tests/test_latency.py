@@ -0,0 +1,68 @@
+"""Latency budgets on a scaled catalog.
+
+Budgets are for the in-memory stand-in on a developer laptop; scale them
+with PERF_BUDGET_SCALE on slower CI machines.
+"""
+import gc
+import os
+import statistics
+import time
+
+import pytest
+
+import server
+
+BUDGET_SCALE = float(os.environ.get("PERF_BUDGET_SCALE", "1"))
+SAMPLES = 15
+
+# p95 budgets in milliseconds
+LATENCY_BUDGETS_MS = {
+    "get_clinics": 300,
+    "get_clinic": 100,
+    "compare": 300,
+    "get_clinic_snapshot": 15,
+}
+
+
+def p95_ms(send) -> float:
+    # Earlier tests leave large catalogs behind; collect them now rather
+    # than in the middle of a timed request
+    gc.collect()
+    durations = []
+    for _ in range(SAMPLES):
+        started = time.perf_counter()
+        response = send()
+        durations.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200
+    return statistics.quantiles(durations, n=20)[-1]
+
+
+@pytest.fixture
+def scaled_catalog(seed_catalog):
+    return seed_catalog(clinics=1000, treatments=20, offers_per_clinic=8)
+
+
+@pytest.fixture
+def mongo_path(monkeypatch):
+    monkeypatch.setattr(server, "CATALOG_SNAPSHOT_ENABLED", False)
+
+
+def test_get_clinics_latency(client, scaled_catalog, mongo_path):
+    latency = p95_ms(lambda: client.get("/api/clinics", params={"treatment_id": "treatment-3", "min_rating": 4}))
+    assert latency <= LATENCY_BUDGETS_MS["get_clinics"] * BUDGET_SCALE
+
+
+def test_get_clinic_latency(client, scaled_catalog, mongo_path):
+    latency = p95_ms(lambda: client.get("/api/clinics/clinic-500"))
+    assert latency <= LATENCY_BUDGETS_MS["get_clinic"] * BUDGET_SCALE
+
+
+def test_compare_latency(client, scaled_catalog, mongo_path):
+    clinic_ids = [f"clinic-{c}" for c in range(0, 1000, 50)]
+    latency = p95_ms(lambda: client.post("/api/compare", json={"clinic_ids": clinic_ids, "treatment_id": "treatment-0"}))
+    assert latency <= LATENCY_BUDGETS_MS["compare"] * BUDGET_SCALE
+
+
+def test_get_clinic_snapshot_latency(client, scaled_catalog):
+    latency = p95_ms(lambda: client.get("/api/clinics/clinic-500"))
+    assert latency <= LATENCY_BUDGETS_MS["get_clinic_snapshot"] * BUDGET_SCALE
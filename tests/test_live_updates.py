@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+import server
+
+ADMIN = {"X-Admin-Token": "test-admin-token"}
+
+
+@pytest.fixture
+def feed(client, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "test-admin-token")
+    monkeypatch.setattr(server, "CHANGE_FEED_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(server.change_feed, "_mode", "poll")
+    yield server.change_feed
+    server.change_feed.stop()
+
+
+def next_event(run, sub, timeout=2):
+    return run(asyncio.wait_for, sub.queue.get(), timeout)
+
+
+def test_one_batch_reaches_only_affected_subscribers(client, seed_catalog, run, feed):
+    # clinic-0 offers treatments 0 and 1, clinic-1 offers 1 and 2
+    seed_catalog(clinics=3, treatments=6, offers_per_clinic=2)
+    watching = run(feed.subscribe, ["clinic-0", "clinic-1"], "treatment-0")
+    other = run(feed.subscribe, ["clinic-2"], "treatment-2")
+
+    client.post("/api/clinic-treatments/prices", headers=ADMIN, json={"items": [
+        {"id": "ct_0_0", "price": 123, "version": 0},
+        {"id": "ct_1_0", "price": 456, "version": 0},
+    ]})
+
+    event, event_id, data = next_event(run, watching)
+    assert event == "offer"
+    assert event_id == run(server.get_catalog_version)
+    assert data == {"clinic_id": "clinic-0", "treatment_id": "treatment-0", "price": 123,
+                    "duration_days": 1, "warranty_months": 0, "version": 1}
+    assert watching.queue.empty()
+    assert other.queue.empty()
+
+    feed.unsubscribe(watching)
+    feed.unsubscribe(other)
+    assert feed.subscriber_count == 0
+
+
+def test_removed_offer_is_pushed_as_removal(client, seed_catalog, run, feed):
+    seed_catalog(clinics=2, treatments=2, offers_per_clinic=1)
+    sub = run(feed.subscribe, ["clinic-0"], "treatment-0")
+
+    run(server.db.clinic_treatments.delete_one, {"id": "ct_0_0"})
+    run(server.publish_catalog_change, "offers", ["clinic-0"], ["treatment-0"])
+
+    assert next_event(run, sub)[2] == {"clinic_id": "clinic-0", "treatment_id": "treatment-0", "removed": True}
+    feed.unsubscribe(sub)
+
+
+class RacingDatabase:
+    """Lands `race` between the subscriber's offer read and its reply"""
+
+    def __init__(self, database, race):
+        self._database = database
+        self._race = race
+
+    def __getattr__(self, name):
+        collection = getattr(self._database, name)
+        if name != "clinic_treatments" or self._race is None:
+            return collection
+        race, self._race = self._race, None
+
+        class RacingCollection:
+            def __getattr__(self, attr):
+                return getattr(collection, attr)
+
+            def find(self, *args, **kwargs):
+                cursor = collection.find(*args, **kwargs)
+
+                class RacingCursor:
+                    async def to_list(self, length):
+                        offers = await cursor.to_list(length)
+                        await race()
+                        return offers
+                return RacingCursor()
+        return RacingCollection()
+
+
+def test_change_dispatched_during_subscribe_is_kept(client, seed_catalog, run, feed, monkeypatch):
+    seed_catalog(clinics=2, treatments=2, offers_per_clinic=1)
+    primary = server.db
+
+    async def price_change():
+        await primary.clinic_treatments.update_one({"id": "ct_0_0"}, {"$set": {"price": 99}, "$inc": {"version": 1}})
+        await server.publish_catalog_change("offers", ["clinic-0"], ["treatment-0"])
+        await feed._catch_up()
+
+    monkeypatch.setattr(server, "db", RacingDatabase(primary, price_change))
+    sub = run(feed.subscribe, ["clinic-0"], "treatment-0")
+
+    assert (sub.sent["clinic-0"]["price"], sub.sent["clinic-0"]["version"]) == (99, 1)
+    assert sub.queue.empty()
+
+
+def test_slow_client_is_told_to_resync(run, client):
+    async def overflow():
+        sub = server.Subscription(["clinic-0"], "treatment-0")
+        for version in range(server.LIVE_QUEUE_SIZE + 1):
+            sub.push(("offer", version, {}))
+        return [sub.queue.get_nowait() for _ in range(sub.queue.qsize())]
+
+    assert run(overflow) == [("resync", None, {})]
+
+
+def test_stream_rejects_too_many_clinics(client):
+    ids = ",".join(f"clinic-{c}" for c in range(server.LIVE_MAX_CLINICS + 1))
+
+    response = client.get("/api/compare/stream", params={"clinic_ids": ids, "treatment_id": "treatment-0"})
+
+    assert response.status_code == 400
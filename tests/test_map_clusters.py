@@ -0,0 +1,85 @@
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+SPAIN = {"south": 35.0, "west": -10.0, "north": 44.0, "east": 4.0}
+
+
+@pytest.fixture(autouse=True)
+def fresh_index(monkeypatch):
+    monkeypatch.setattr(server, "_geo_index", None)
+
+
+def test_geohash_matches_reference():
+    assert server.geohash_encode(57.64911, 10.40744, 6) == "u4pruy"
+    assert server.geohash_encode(40.4168, -3.7038, 5) == "ezjmg"
+
+
+def test_covering_cells_wrap_the_antimeridian():
+    assert server.covering_geohashes(-1, 179.9, 1, -179.9, 3) == ["rzz", "2pb", "xbp", "800"]
+
+
+@pytest.mark.parametrize("snapshot", [True, False])
+def test_clusters_cover_every_clinic_with_cheapest_price(client, seed_catalog, monkeypatch, snapshot):
+    monkeypatch.setattr(server, "CATALOG_SNAPSHOT_ENABLED", snapshot)
+    _, clinics, offers = seed_catalog(clinics=300, treatments=4, offers_per_clinic=2)
+
+    body = client.get("/api/clinics/clusters", params={**SPAIN, "zoom": 5, "treatment_id": "treatment-1"}).json()
+
+    assert sum(c["count"] for c in body["clusters"]) == len(clinics)
+    assert len(body["clusters"]) < len(clinics)
+    assert min(c["min_price"] for c in body["clusters"] if c["min_price"] is not None) == min(
+        ct["price"] for ct in offers if ct["treatment_id"] == "treatment-1"
+    )
+
+
+def test_payload_bounded_by_screen_not_catalog(client, seed_catalog):
+    seed_catalog(clinics=2000, treatments=2, offers_per_clinic=1)
+
+    body = client.get("/api/clinics/clusters", params={**SPAIN, "zoom": 12}).json()
+
+    assert len(body["clusters"]) <= server.MAP_MAX_CELLS
+    assert sum(c["count"] for c in body["clusters"]) == 2000
+
+
+def test_high_zoom_returns_individual_clinics(client, seed_catalog):
+    _, clinics, _ = seed_catalog(clinics=50)
+    clinic = clinics[7]
+    box = {
+        "south": clinic["latitude"] - 0.01, "north": clinic["latitude"] + 0.01,
+        "west": clinic["longitude"] - 0.01, "east": clinic["longitude"] + 0.01,
+    }
+
+    body = client.get("/api/clinics/clusters", params={**box, "zoom": 16}).json()
+
+    assert body["clusters"] == []
+    assert clinic["clinic_id"] in [c["clinic_id"] for c in body["clinics"]]
+
+
+def test_index_follows_catalog_version(client, seed_catalog, run):
+    seed_catalog(clinics=10)
+    client.get("/api/clinics/clusters", params={**SPAIN, "zoom": 4})
+    run(server.db.clinics.delete_many, {"clinic_id": {"$in": ["clinic-0", "clinic-1"]}})
+    run(server.publish_catalog_change, "clinics", ["clinic-0", "clinic-1"], [])
+
+    body = client.get("/api/clinics/clusters", params={**SPAIN, "zoom": 4}).json()
+
+    assert sum(c["count"] for c in body["clusters"]) == 8
+
+
+def test_index_built_from_the_primary(client, seed_catalog, monkeypatch):
+    monkeypatch.setattr(server, "CATALOG_SNAPSHOT_ENABLED", False)
+    seed_catalog(clinics=10)
+    # Secondaries that have not caught up with the catalog yet
+    monkeypatch.setattr(server, "catalog_db", AsyncMongoMockClient()["lagging"])
+
+    body = client.get("/api/clinics/clusters", params={**SPAIN, "zoom": 4}).json()
+
+    assert sum(c["count"] for c in body["clusters"]) == 10
+
+
+def test_rejects_invalid_box(client):
+    response = client.get("/api/clinics/clusters", params={**SPAIN, "north": 30.0, "zoom": 5})
+
+    assert response.status_code == 400
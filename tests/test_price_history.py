@@ -0,0 +1,60 @@
+"""Downsampled price trends from the price_history time-series collection.
+
+Time-series collections and $dateTrunc need a real mongod (5.0+), so the
+aggregation tests only run with MONGO_TEST_URL.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+needs_mongod = pytest.mark.skipif(not os.environ.get("MONGO_TEST_URL"), reason="needs MONGO_TEST_URL")
+
+
+@pytest.fixture
+def price_history(monkeypatch):
+    monkeypatch.setattr(server, "PRICE_HISTORY_ENABLED", True)
+
+
+def test_disabled_is_404(client):
+    assert client.get("/api/treatments/treatment-0/price-history").status_code == 404
+
+
+@pytest.mark.parametrize("params", [
+    {"interval": "hour"},
+    {"interval": "day", "since": "2024-01-01T00:00:00Z", "until": "2026-01-01T00:00:00Z"},
+    {"since": "2025-01-02T00:00:00Z", "until": "2025-01-01T00:00:00Z"},
+])
+def test_rejects_unbounded_queries(client, monkeypatch, params):
+    # Enabled after startup: mongomock cannot create time-series collections
+    monkeypatch.setattr(server, "PRICE_HISTORY_ENABLED", True)
+
+    response = client.get("/api/treatments/treatment-0/price-history", params=params)
+
+    assert response.status_code == 400
+
+
+@needs_mongod
+def test_weekly_buckets_per_city(price_history, client, seed_catalog, run):
+    treatments, clinics, offers = seed_catalog(clinics=14, treatments=1, offers_per_clinic=1)
+    city_by_clinic = {c["clinic_id"]: c["city"] for c in clinics}
+    monday = datetime(2025, 3, 3, tzinfo=timezone.utc)
+    for day in range(14):
+        for ct in offers:
+            ct["price"] += day
+        run(server.record_prices, offers, city_by_clinic, monday + timedelta(days=day, hours=12))
+
+    response = client.get("/api/treatments/treatment-0/price-history", params={
+        "interval": "week",
+        "city": "Madrid",
+        "since": monday.isoformat(),
+        "until": (monday + timedelta(days=14)).isoformat()
+    })
+
+    points = response.json()["points"]
+    assert len(points) == 2
+    assert [p["samples"] for p in points] == [14, 14]
+    assert all(p["clinics"] == 2 for p in points)
+    assert points[0]["max_price"] < points[1]["max_price"]
@@ -0,0 +1,30 @@
+import server
+
+ADMIN = {"X-Admin-Token": "test-admin-token"}
+
+
+def test_profile_captured_for_admin_and_readable(client, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "test-admin-token")
+    monkeypatch.setattr(server, "PROFILER_INTERVAL_MS", 0.5)
+
+    response = client.post(
+        "/api/auth/register",
+        json={"email": "perfil@example.com", "password": "secreto", "name": "Perfil"},
+        headers={**ADMIN, "X-Profile": "1"}
+    )
+    profile_id = response.headers["X-Profile-Id"]
+
+    listing = client.get("/api/admin/profiles", headers=ADMIN).json()
+    assert listing[0]["profile_id"] == profile_id
+    collapsed = client.get(f"/api/admin/profiles/{profile_id}", headers=ADMIN).text
+    # bcrypt runs synchronously inside hash_password
+    assert "hash_password" in collapsed
+
+
+def test_profiling_requires_admin_token(client, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "test-admin-token")
+
+    response = client.get("/api/health", headers={"X-Profile": "1", "X-Admin-Token": "wrong"})
+
+    assert "X-Profile-Id" not in response.headers
+    assert client.get("/api/admin/profiles").status_code == 403
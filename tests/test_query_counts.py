@@ -0,0 +1,106 @@
+"""Mongo command budgets per endpoint.
+
+The budgets must not depend on catalog size: an endpoint whose command
+count grows with the number of offers or compared clinics has an N+1.
+"""
+import pytest
+
+import server
+
+# Maximum data commands per request on the Mongo (non-snapshot) path
+COMMAND_BUDGETS = {
+    "get_treatments": 1,
+    "get_clinics": 2,
+    "get_clinic": 3,
+    "get_cities": 1,
+    "compare": 3,
+}
+
+
+@pytest.fixture
+def mongo_path(monkeypatch):
+    monkeypatch.setattr(server, "CATALOG_SNAPSHOT_ENABLED", False)
+
+
+@pytest.mark.parametrize("offers", [2, 40])
+def test_get_clinic_commands_constant_in_offer_count(client, seed_catalog, command_counter, mongo_path, offers):
+    seed_catalog(clinics=3, treatments=offers, offers_per_clinic=offers)
+    command_counter.reset()
+
+    response = client.get("/api/clinics/clinic-0")
+
+    assert response.status_code == 200
+    assert len(response.json()["treatments"]) == offers
+    assert command_counter.count <= COMMAND_BUDGETS["get_clinic"]
+
+
+@pytest.mark.parametrize("compared", [2, 40])
+def test_compare_commands_constant_in_clinic_count(client, seed_catalog, command_counter, mongo_path, compared):
+    # With one treatment every clinic offers it
+    seed_catalog(clinics=compared, treatments=1, offers_per_clinic=1)
+    command_counter.reset()
+
+    response = client.post("/api/compare", json={
+        "clinic_ids": [f"clinic-{c}" for c in range(compared)],
+        "treatment_id": "treatment-0"
+    })
+
+    assert response.status_code == 200
+    assert len(response.json()["comparisons"]) == compared
+    assert command_counter.count <= COMMAND_BUDGETS["compare"]
+
+
+def test_compare_keeps_request_order_and_skips_unknown_clinics(client, seed_catalog, mongo_path):
+    seed_catalog(clinics=3, treatments=1, offers_per_clinic=1)
+
+    response = client.post("/api/compare", json={
+        "clinic_ids": ["clinic-2", "missing", "clinic-0"],
+        "treatment_id": "treatment-0"
+    })
+
+    assert [c["clinic"]["clinic_id"] for c in response.json()["comparisons"]] == ["clinic-2", "clinic-0"]
+
+
+@pytest.mark.parametrize("clinics", [5, 200])
+def test_get_clinics_commands_constant_in_catalog_size(client, seed_catalog, command_counter, mongo_path, clinics):
+    seed_catalog(clinics=clinics, treatments=4, offers_per_clinic=2)
+    command_counter.reset()
+
+    response = client.get("/api/clinics", params={"treatment_id": "treatment-1", "max_price": 2000})
+
+    assert response.status_code == 200
+    assert command_counter.count <= COMMAND_BUDGETS["get_clinics"]
+
+
+@pytest.mark.parametrize("path,budget", [
+    ("/api/treatments", "get_treatments"),
+    ("/api/cities", "get_cities"),
+])
+def test_catalog_lists_within_budget(client, seed_catalog, command_counter, mongo_path, path, budget):
+    seed_catalog(clinics=20)
+    command_counter.reset()
+
+    assert client.get(path).status_code == 200
+    assert command_counter.count <= COMMAND_BUDGETS[budget]
+
+
+@pytest.mark.parametrize("path", [
+    "/api/treatments",
+    "/api/treatments/treatment-0",
+    "/api/clinics/clinic-0",
+    "/api/cities",
+])
+def test_snapshot_paths_issue_no_commands(client, seed_catalog, command_counter, path):
+    seed_catalog(clinics=20)
+    command_counter.reset()
+
+    assert client.get(path).status_code == 200
+    assert command_counter.count == 0
+
+
+def test_snapshot_matches_mongo_path(client, seed_catalog, monkeypatch):
+    seed_catalog(clinics=5, treatments=6, offers_per_clinic=4)
+    from_snapshot = client.get("/api/clinics/clinic-3").json()
+
+    monkeypatch.setattr(server, "CATALOG_SNAPSHOT_ENABLED", False)
+    assert client.get("/api/clinics/clinic-3").json() == from_snapshot
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+def test_bucket_allows_burst_then_asks_to_retry():
+    limiter = server.TokenBucketLimiter(max_keys=10)
+
+    waits = [asyncio.run(limiter.acquire("k", burst=3, rate=0.5)) for _ in range(4)]
+
+    assert waits[:3] == [0, 0, 0]
+    assert 1.9 < waits[3] <= 2.0
+
+
+def test_bucket_store_is_bounded():
+    limiter = server.TokenBucketLimiter(max_keys=100)
+
+    for i in range(1000):
+        asyncio.run(limiter.acquire(f"ip-{i}", burst=1, rate=1))
+
+    assert len(limiter._buckets) == 100
+
+
+@pytest.fixture
+def tight_limits(monkeypatch):
+    monkeypatch.setattr(server, "rate_limiter", server.TokenBucketLimiter(max_keys=1000))
+    monkeypatch.setitem(server.RATE_LIMITS, "auth/login", {
+        "ip": {"burst": 100, "rate": 1},
+        "email": {"burst": 2, "rate": 0.01},
+    })
+
+
+def test_login_limited_per_email_with_retry_after(client, tight_limits):
+    attempt = {"email": "victima@example.com", "password": "incorrecta"}
+
+    statuses = [client.post("/api/auth/login", json=attempt).status_code for _ in range(2)]
+    limited = client.post("/api/auth/login", json=attempt)
+    other_account = client.post("/api/auth/login", json={**attempt, "email": "otra@example.com"})
+
+    assert statuses == [401, 401]
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+    assert other_account.status_code == 401
+
+
+def request_from(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return server.Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "client": (peer, 40000)})
+
+
+@pytest.fixture
+def behind_ingress(monkeypatch):
+    monkeypatch.setattr(server, "TRUSTED_PROXIES", [server.ipaddress.ip_network("10.0.0.0/8")])
+
+
+def test_client_ip_through_trusted_proxies(behind_ingress):
+    assert server.client_ip(request_from("10.0.0.7", "203.0.113.9")) == "203.0.113.9"
+    # A client-supplied entry left of the real address is ignored
+    assert server.client_ip(request_from("10.0.0.7", "1.2.3.4, 203.0.113.9, 10.1.1.1")) == "203.0.113.9"
+    assert server.client_ip(request_from("10.0.0.7")) == "10.0.0.7"
+
+
+def test_forwarded_header_ignored_from_untrusted_peers(behind_ingress):
+    assert server.client_ip(request_from("198.51.100.4", "203.0.113.9")) == "198.51.100.4"
+
+
+def test_forwarded_header_ignored_without_trusted_proxies():
+    assert server.client_ip(request_from("10.0.0.7", "203.0.113.9")) == "10.0.0.7"
+
+
+def test_callers_behind_the_ingress_get_their_own_buckets(behind_ingress, monkeypatch):
+    monkeypatch.setattr(server, "rate_limiter", server.TokenBucketLimiter(max_keys=1000))
+    monkeypatch.setitem(server.RATE_LIMITS, "compare", {"ip": {"burst": 1, "rate": 0.01}})
+    limit = server.rate_limit("compare")
+
+    asyncio.run(limit(request_from("10.0.0.7", "203.0.113.9")))
+    asyncio.run(limit(request_from("10.0.0.7", "203.0.113.10")))
+    with pytest.raises(server.HTTPException) as limited:
+        asyncio.run(limit(request_from("10.0.0.7", "203.0.113.9")))
+    assert limited.value.status_code == 429
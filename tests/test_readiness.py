@@ -0,0 +1,67 @@
+from pymongo import ReadPreference
+from pymongo.errors import ServerSelectionTimeoutError
+
+import server
+
+
+def test_ready_after_warm_up(client):
+    response = client.get("/api/ready")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ready"
+    assert body["warmup"]["status"] == "ready"
+    assert body["mongo_ping_ms"] >= 0
+
+
+def test_ready_retries_a_failed_warm_up(client, run, monkeypatch):
+    refresh = server.refresh_catalog_snapshot
+
+    async def unavailable(*args, **kwargs):
+        raise ServerSelectionTimeoutError("sin servidor")
+
+    monkeypatch.setattr(server, "refresh_catalog_snapshot", unavailable)
+    run(server.warm_up)
+    assert server.warmup_state["status"] == "failed"
+
+    # Each probe retries the warm-up until it succeeds
+    response = client.get("/api/ready")
+    assert response.status_code == 503
+    warmup = response.json()["warmup"]
+    assert (warmup["status"], warmup["error"]) == ("failed", "sin servidor")
+
+    monkeypatch.setattr(server, "refresh_catalog_snapshot", refresh)
+    response = client.get("/api/ready")
+    assert response.status_code == 200
+    assert response.json()["warmup"]["error"] is None
+
+
+def test_warm_up_reaches_catalog_read_targets(client, run, monkeypatch):
+    pings = []
+
+    async def ping(*args, **kwargs):
+        pings.append(kwargs.get("read_preference"))
+
+    monkeypatch.setattr(server.catalog_db, "read_preference", ReadPreference.SECONDARY_PREFERRED, raising=False)
+    monkeypatch.setattr(server.catalog_db, "command", ping)
+    run(server.warm_up)
+
+    assert server.warmup_state["status"] == "ready"
+    assert pings and all(p == ReadPreference.SECONDARY_PREFERRED for p in pings)
+
+
+def test_not_ready_without_mongo(client, monkeypatch):
+    async def ping(*args, **kwargs):
+        raise ServerSelectionTimeoutError("sin servidor")
+
+    monkeypatch.setattr(server.db, "command", ping)
+    response = client.get("/api/ready")
+
+    assert response.status_code == 503
+    assert response.json()["status"] == "unavailable"
+
+
+def test_health_needs_no_mongo(client, command_counter):
+    command_counter.reset()
+    assert client.get("/api/health").status_code == 200
+    assert command_counter.count == 0
@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture
+def open_breaker(monkeypatch):
+    breaker = server.CircuitBreaker(window_s=30, min_requests=2, error_rate=0.5, cooldown_s=60)
+    monkeypatch.setattr(server, "mongo_breaker", breaker)
+    breaker.record(failed=True)
+    breaker.record(failed=True)
+    assert breaker.state == "open"
+    return breaker
+
+
+def test_breaker_opens_on_error_rate_and_closes_after_probe():
+    breaker = server.CircuitBreaker(window_s=30, min_requests=4, error_rate=0.5, cooldown_s=0.05)
+    for failed in (False, True, False):
+        breaker.record(failed)
+    assert breaker.state == "closed"
+
+    breaker.record(failed=True)
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    breaker.record(failed=False)
+    assert breaker.state == "closed"
+
+
+def test_open_breaker_serves_catalog_from_snapshot(client, seed_catalog, open_breaker, command_counter):
+    seed_catalog(clinics=10, treatments=3, offers_per_clinic=2)
+    command_counter.reset()
+
+    clinics = client.get("/api/clinics", params={"treatment_id": "treatment-1", "max_price": 2500})
+    compare = client.post("/api/compare", json={"clinic_ids": ["clinic-0", "clinic-1"], "treatment_id": "treatment-1"})
+
+    assert clinics.headers["X-Degraded"] == "1"
+    assert clinics.json() and all("treatment_price" in c for c in clinics.json())
+    assert compare.headers["X-Degraded"] == "1"
+    assert command_counter.count == 0
+
+
+@pytest.fixture
+def half_open_breaker(monkeypatch):
+    breaker = server.CircuitBreaker(window_s=30, min_requests=2, error_rate=0.5, cooldown_s=0.05)
+    monkeypatch.setattr(server, "mongo_breaker", breaker)
+    breaker.record(failed=True)
+    breaker.record(failed=True)
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    return breaker
+
+
+def test_snapshot_hits_do_not_close_half_open_breaker(client, seed_catalog, half_open_breaker, command_counter):
+    seed_catalog(clinics=5)
+    command_counter.reset()
+
+    assert client.get("/api/treatments").status_code == 200
+    assert client.get("/api/cities").status_code == 200
+
+    assert command_counter.count == 0
+    assert half_open_breaker.state == "half_open"
+
+    # The first request that reaches Mongo decides
+    client.post("/api/auth/login", json={"email": "a@example.com", "password": "x"})
+    assert half_open_breaker.state == "closed"
+
+
+def test_snapshot_hits_do_not_dilute_failures(client, seed_catalog, monkeypatch):
+    seed_catalog(clinics=5)
+    breaker = server.CircuitBreaker(window_s=30, min_requests=20, error_rate=0.5, cooldown_s=60)
+    monkeypatch.setattr(server, "mongo_breaker", breaker)
+    for _ in range(15):
+        client.get("/api/cities")
+    for _ in range(19):
+        breaker.record(failed=True)
+    assert breaker.state == "closed"
+
+    breaker.record(failed=True)
+
+    assert breaker.state == "open"
+
+
+def test_open_breaker_fails_fast_on_other_routes(client, open_breaker):
+    response = client.post("/api/auth/login", json={"email": "a@example.com", "password": "x"})
+    assert response.status_code == 503
+
+
+def test_route_budget_exceeded_returns_504(monkeypatch):
+    monkeypatch.setitem(server.ROUTE_BUDGETS_MS, "/slow", 50)
+    monkeypatch.setattr(server, "mongo_breaker", server.CircuitBreaker(30, 20, 0.5, 15))
+    router = APIRouter(route_class=server.DeadlineRoute)
+
+    @router.get("/slow")
+    async def slow():
+        assert server.query_deadline_ms() <= 50
+        await asyncio.sleep(1)
+
+    app = FastAPI()
+    app.include_router(router)
+
+    started = time.perf_counter()
+    response = TestClient(app).get("/slow")
+
+    assert response.status_code == 504
+    assert time.perf_counter() - started < 0.5
+
+
+def test_invalid_city_pattern_is_a_client_error(client, seed_catalog, monkeypatch):
+    seed_catalog(clinics=3)
+    breaker = server.CircuitBreaker(window_s=30, min_requests=2, error_rate=0.5, cooldown_s=60)
+    monkeypatch.setattr(server, "mongo_breaker", breaker)
+
+    statuses = [client.get("/api/clinics", params={"city": "("}).status_code for _ in range(3)]
+
+    assert statuses == [400] * 3
+    assert breaker.state == "closed"
+    assert client.post("/api/auth/login", json={"email": "a@example.com", "password": "x"}).status_code == 401
+
+
+@pytest.mark.parametrize("error, status, counted", [
+    (server.OperationFailure("Regular expression is invalid", code=51091), 400, False),
+    (server.DuplicateKeyError("E11000 duplicate key", code=11000), 409, False),
+    (server.OperationFailure("Document failed validation", code=121), 500, False),
+    (server.ServerSelectionTimeoutError("No servers found"), 503, True),
+    (server.AutoReconnect("connection reset"), 503, True),
+    (server.ExecutionTimeout("operation exceeded time limit", code=50), 504, True),
+    (server.httpx.ReadTimeout("proveedor lento"), 504, False),
+])
+def test_only_availability_errors_feed_the_breaker(monkeypatch, error, status, counted):
+    breaker = server.CircuitBreaker(window_s=30, min_requests=1, error_rate=0.5, cooldown_s=60)
+    monkeypatch.setattr(server, "mongo_breaker", breaker)
+    router = APIRouter(route_class=server.DeadlineRoute)
+
+    @router.get("/failing")
+    async def failing():
+        raise error
+
+    app = FastAPI()
+    app.include_router(router)
+
+    assert TestClient(app).get("/failing").status_code == status
+    assert breaker.state == ("open" if counted else "closed")
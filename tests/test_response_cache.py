@@ -0,0 +1,101 @@
+import gzip
+import json
+
+import brotli
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+
+def fetch(client, path, encoding, params=None):
+    """Raw (still encoded) response bytes for an Accept-Encoding"""
+    with client.stream("GET", path, params=params, headers={"Accept-Encoding": encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+
+@pytest.mark.parametrize("encoding, decode", [
+    ("br", brotli.decompress),
+    ("gzip", gzip.decompress),
+    ("identity", lambda body: body),
+])
+def test_encodings_decode_to_the_same_json(client, seed_catalog, encoding, decode):
+    seed_catalog(clinics=40)
+    expected = client.get("/api/clinics", params={"city": "Madrid"}, headers={"Accept-Encoding": "identity"}).json()
+
+    response, body = fetch(client, "/api/clinics", encoding, {"city": "Madrid"})
+    assert response.status_code == 200
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers.get("content-encoding", "identity") == encoding
+    assert json.loads(decode(body)) == expected
+
+
+def test_hits_skip_the_database(client, seed_catalog, command_counter):
+    seed_catalog(clinics=20)
+    client.get("/api/clinics", params={"city": "Madrid"})
+    client.get("/api/treatments")
+
+    command_counter.reset()
+    for encoding in ("br", "gzip", "identity"):
+        fetch(client, "/api/clinics", encoding, {"city": "Madrid"})
+        fetch(client, "/api/treatments", encoding)
+    assert command_counter.count == 0
+
+
+def test_catalog_change_misses(client, seed_catalog, run):
+    seed_catalog(clinics=10)
+    before = client.get("/api/treatments").json()
+
+    async def add_treatment():
+        await server.db.treatments.insert_one({
+            "treatment_id": "treatment-new", "name": "Nuevo", "description": "Nuevo tratamiento",
+            "category": "Categoría 0", "icon": "tooth",
+        })
+        await server.refresh_catalog_snapshot(await server.bump_catalog_version())
+    run(add_treatment)
+
+    after = client.get("/api/treatments").json()
+    assert len(after) == len(before) + 1
+
+
+def test_cache_fills_from_the_primary(client, seed_catalog, monkeypatch):
+    seed_catalog(clinics=20)
+    # Secondaries that have not caught up with the catalog yet
+    monkeypatch.setattr(server, "catalog_db", AsyncMongoMockClient()["lagging"])
+
+    clinics = client.get("/api/clinics", params={"city": "Madrid"}).json()
+
+    assert clinics and all(c["city"] == "Madrid" for c in clinics)
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("gzip, deflate, br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=0.5, br;q=0", "gzip"),
+    ("*", "br"),
+    ("*;q=0, gzip", "gzip"),
+    ("deflate", "identity"),
+    ("", "identity"),
+])
+def test_choose_encoding(accept, expected):
+    assert server.choose_encoding(accept, {"identity", "gzip", "br"}) == expected
+
+
+def test_small_bodies_are_not_compressed():
+    assert set(server.encode_body(b"[]")) == {"identity"}
+
+
+def test_byte_budget_evicts_least_recently_used():
+    cache = server.ResponseCache(400)
+    for key in "abcd":
+        cache.put(key, {"identity": b"x" * 100})
+    cache.get("a")
+    cache.put("e", {"identity": b"x" * 100})
+
+    assert cache.size <= 400
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    # Anything over a quarter of the budget is never stored
+    cache.put("huge", {"identity": b"x" * 101})
+    assert cache.get("huge") is None
@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+
+def clinic(run, clinic_id="clinic-0"):
+    return run(server.db.clinics.find_one, {"clinic_id": clinic_id}, {"_id": 0})
+
+
+def test_reviews_update_rating_incrementally(client, seed_catalog, run, users, command_counter):
+    _, clinics, _ = seed_catalog(clinics=2)
+    base_sum = clinics[0]["rating"] * clinics[0]["review_count"]
+    base_count = clinics[0]["review_count"]
+    first, second = users(2)
+
+    client.post("/api/clinics/clinic-0/reviews", json={"rating": 1}, headers=first)
+    command_counter.reset()
+    response = client.post("/api/clinics/clinic-0/reviews", json={"rating": 2, "comment": "Regular"}, headers=second)
+
+    assert response.status_code == 200
+    stored = clinic(run)
+    assert stored["review_count"] == base_count + 2
+    assert stored["rating"] == round((base_sum + 3) / (base_count + 2), 1)
+    # No pass over the clinic's reviews on the hot path
+    assert "aggregate" not in command_counter.commands
+
+
+def test_second_review_is_served(client, seed_catalog, run, users):
+    seed_catalog(clinics=2)
+    first, second = users(2)
+    client.post("/api/clinics/clinic-0/reviews", json={"rating": 1}, headers=first)
+    # The clinic now has aggregates, so this one takes the incremental path
+    client.post("/api/clinics/clinic-0/reviews", json={"rating": 1}, headers=second)
+    assert run(server.publish_rating_changes) == 1
+    stored = clinic(run)
+
+    detail = client.get("/api/clinics/clinic-0").json()
+    listed = {c["clinic_id"]: c for c in client.get("/api/clinics").json()}["clinic-0"]
+    compared = client.post(
+        "/api/compare", json={"clinic_ids": ["clinic-0", "clinic-1"], "treatment_id": "treatment-0"}
+    ).json()["comparisons"][0]["clinic"]
+
+    for served in (detail, listed, compared):
+        assert (served["rating"], served["review_count"]) == (stored["rating"], stored["review_count"])
+        assert not set(server.RATING_AGGREGATE_FIELDS) & set(served)
+    assert stored["updated_at"] > clinic(run, "clinic-1")["updated_at"]
+
+
+def test_reviews_publish_one_change_per_interval(client, seed_catalog, run, users):
+    seed_catalog(clinics=3)
+    version = run(server.get_catalog_version)
+
+    for c, headers in enumerate(users(6)):
+        client.post(f"/api/clinics/clinic-{c % 2}/reviews", json={"rating": 5}, headers=headers)
+
+    assert run(server.get_catalog_version) == version
+    assert server.pending_rating_clinics == {"clinic-0", "clinic-1"}
+
+    assert run(server.publish_rating_changes) == 2
+    assert run(server.publish_rating_changes) == 0
+    assert run(server.get_catalog_version) == version + 1
+    event = run(server.db.catalog_events.find_one, {"version": version + 1})
+    assert (event["kind"], event["clinic_ids"]) == ("ratings", ["clinic-0", "clinic-1"])
+
+
+def test_posted_review_is_listed_right_away(client, seed_catalog, monkeypatch, users):
+    seed_catalog(clinics=1)
+    (user,) = users(1)
+    client.post("/api/clinics/clinic-0/reviews", json={"rating": 4, "comment": "Bien"}, headers=user)
+    # Secondaries that have not caught up with the write yet
+    monkeypatch.setattr(server, "catalog_db", AsyncMongoMockClient()["lagging"])
+
+    reviews = client.get("/api/clinics/clinic-0/reviews").json()["reviews"]
+
+    assert [r["comment"] for r in reviews] == ["Bien"]
+
+
+def test_one_review_per_user_and_clinic(client, seed_catalog, users):
+    seed_catalog(clinics=1)
+    (user,) = users(1)
+
+    client.post("/api/clinics/clinic-0/reviews", json={"rating": 4}, headers=user)
+    response = client.post("/api/clinics/clinic-0/reviews", json={"rating": 5}, headers=user)
+
+    assert response.status_code == 409
+
+
+def test_reconcile_fixes_drift(client, seed_catalog, run, users):
+    seed_catalog(clinics=2)
+    for headers in users(3):
+        client.post("/api/clinics/clinic-0/reviews", json={"rating": 5}, headers=headers)
+    expected = clinic(run)
+    run(server.db.clinics.update_one, {"clinic_id": "clinic-0"}, {"$inc": {"rating_sum": 40, "review_count": 1}})
+
+    assert run(server.reconcile_ratings) == 2  # clinic-1 gets its aggregates too
+    restored = clinic(run)
+    assert (restored["rating"], restored["review_count"]) == (expected["rating"], expected["review_count"])
+    assert restored["rating_sum"] == pytest.approx(expected["rating_sum"])
+    assert run(server.reconcile_ratings) == 0
+
+
+def test_reviews_page_newest_first(client, seed_catalog, run):
+    seed_catalog(clinics=1)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    run(server.db.reviews.insert_many, [
+        {
+            "review_id": f"review_{r:03d}",
+            "clinic_id": "clinic-0",
+            "user_id": f"user_{r}",
+            "rating": 4,
+            "comment": "",
+            # Pairs share a timestamp so the cursor must break ties
+            "created_at": (start + timedelta(minutes=r // 2)).isoformat()
+        }
+        for r in range(25)
+    ])
+
+    seen = []
+    cursor = None
+    while True:
+        page = client.get("/api/clinics/clinic-0/reviews", params={"limit": 10, **({"cursor": cursor} if cursor else {})}).json()
+        seen += [r["review_id"] for r in page["reviews"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert seen == [f"review_{r:03d}" for r in reversed(range(25))]
+
+
+def test_review_for_unknown_clinic_is_404(client, seed_catalog, users):
+    seed_catalog(clinics=1)
+    (user,) = users(1)
+
+    assert client.post("/api/clinics/nope/reviews", json={"rating": 3}, headers=user).status_code == 404
@@ -0,0 +1,95 @@
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+ADMIN = {"X-Admin-Token": "test-admin-token"}
+POPULAR = {"treatment_id": "treatment-1", "max_price": 2000}
+
+
+def search(client, params, times=1):
+    for _ in range(times):
+        assert client.get("/api/clinics", params=params).status_code == 200
+
+
+def test_searches_are_flushed_in_one_batch(client, seed_catalog, run, command_counter):
+    seed_catalog(clinics=10)
+    command_counter.reset()
+
+    search(client, POPULAR, times=3)
+    search(client, {"city": "Madrid"}, times=2)
+    client.post("/api/compare", json={"clinic_ids": ["clinic-0", "clinic-6"], "treatment_id": "treatment-0"})
+
+    # Nothing is written on the request path
+    assert "insert" not in command_counter.commands
+    run(server.flush_searches)
+    assert command_counter.commands.count("insert") == 1
+    assert run(server.db.search_events.count_documents, {}) == 6
+
+
+def test_buffer_is_bounded(monkeypatch):
+    monkeypatch.setattr(server, "search_buffer", server.deque(maxlen=3))
+    monkeypatch.setitem(server.search_stats, "dropped", 0)
+
+    for c in range(5):
+        server.record_search("clinics", {"city": f"Ciudad {c}"})
+
+    assert [e["params"]["city"] for e in server.search_buffer] == ["Ciudad 2", "Ciudad 3", "Ciudad 4"]
+    assert server.search_stats["dropped"] == 2
+
+
+def test_top_searches_ignore_parameter_order_and_nones(client, seed_catalog, run, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "test-admin-token")
+    seed_catalog(clinics=10)
+    search(client, POPULAR, times=3)
+    search(client, {"max_price": 2000, "treatment_id": "treatment-1", "city": ""})
+    search(client, {"city": "Madrid"}, times=2)
+    run(server.flush_searches)
+
+    top = client.get("/api/admin/searches/top", params={"route": "clinics", "limit": 2}, headers=ADMIN).json()
+
+    assert top["searches"] == [
+        {"params": {"max_price": 2000.0, "treatment_id": "treatment-1"}, "count": 4},
+        {"params": {"city": "Madrid"}, "count": 2},
+    ]
+
+
+def test_prewarm_serves_popular_searches_without_queries(client, seed_catalog, run, command_counter):
+    seed_catalog(clinics=10)
+    search(client, POPULAR, times=3)
+    client.post("/api/compare", json={"clinic_ids": ["clinic-0", "clinic-6"], "treatment_id": "treatment-0"})
+    run(server.flush_searches)
+    server.result_cache.clear()
+
+    assert run(server.prewarm_result_cache) == 2
+    command_counter.reset()
+    search(client, POPULAR)
+    client.post("/api/compare", json={"clinic_ids": ["clinic-0", "clinic-6"], "treatment_id": "treatment-0"})
+
+    assert command_counter.count == 0
+
+
+def test_catalog_change_bypasses_cached_results(client, seed_catalog, run, command_counter):
+    seed_catalog(clinics=10)
+    search(client, POPULAR)
+    run(server.publish_catalog_change, "clinics", [], [])
+    command_counter.reset()
+
+    search(client, POPULAR)
+
+    assert command_counter.count > 0
+
+
+def test_prewarm_reads_the_primary(client, seed_catalog, run, monkeypatch):
+    seed_catalog(clinics=10)
+    compare = {"clinic_ids": ["clinic-0", "clinic-6"], "treatment_id": "treatment-0"}
+    client.post("/api/compare", json=compare)
+    run(server.flush_searches)
+    server.result_cache.clear()
+    # Secondaries that have not caught up with the catalog yet
+    monkeypatch.setattr(server, "catalog_db", AsyncMongoMockClient()["lagging"])
+
+    run(server.prewarm_result_cache)
+    response = client.post("/api/compare", json=compare)
+
+    assert response.status_code == 200
+    assert len(response.json()["comparisons"]) == 2
@@ -0,0 +1,39 @@
+import re
+
+import server
+
+PHASES = ["mongo", "auth", "app", "serialize", "total"]
+
+
+def phases(header: str) -> dict:
+    return {m.group(1): float(m.group(2)) for m in re.finditer(r"(\w+);dur=([\d.]+)", header)}
+
+
+def test_timing_on_request(client, seed_catalog):
+    seed_catalog(clinics=5)
+
+    response = client.get("/api/clinics", headers={"X-Debug-Timing": "1"})
+
+    timings = phases(response.headers["Server-Timing"])
+    assert list(timings) == PHASES
+    assert timings["total"] >= timings["serialize"]
+    assert 'desc="' in response.headers["Server-Timing"]
+
+
+def test_no_timing_by_default(client, seed_catalog):
+    seed_catalog(clinics=5)
+    response = client.get("/api/clinics")
+    assert "Server-Timing" not in response.headers
+
+
+def test_timing_enabled_for_all_api_requests(client, monkeypatch):
+    monkeypatch.setattr(server, "SERVER_TIMING_ENABLED", True)
+
+    assert "Server-Timing" in client.get("/api/cities").headers
+    assert "Server-Timing" in client.get("/api/clinics/no-existe").headers
+
+
+def test_auth_time_is_reported(client, users):
+    (headers,) = users(1)
+    response = client.get("/api/auth/me", headers={**headers, "X-Debug-Timing": "1"})
+    assert phases(response.headers["Server-Timing"])["auth"] > 0
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta, timezone
+
+import jwt
+
+import server
+
+def login(client, email="ana@example.com"):
+    client.post("/api/auth/register", json={"email": email, "password": "secreto", "name": "Ana"})
+    token = client.post("/api/auth/login", json={"email": email, "password": "secreto"}).json()["token"]
+    client.cookies.clear()
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_signed_session_needs_no_database_read(client, command_counter):
+    headers = login(client)
+    command_counter.reset()
+
+    response = client.get("/api/auth/me", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["email"] == "ana@example.com"
+    assert command_counter.count == 0
+
+
+def test_logout_revokes_on_this_worker(client):
+    headers = login(client)
+    assert client.post("/api/auth/logout", headers=headers).status_code == 200
+
+    response = client.get("/api/auth/me", headers=headers)
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Sesión cerrada"
+
+
+def test_other_workers_pick_up_revocations(client, run, monkeypatch):
+    headers = login(client)
+    other = login(client, "otra@example.com")
+    client.post("/api/auth/logout", headers=headers)
+
+    # A worker that did not handle the logout learns of it on its next sync
+    monkeypatch.setattr(server, "revoked_sessions", {})
+    monkeypatch.setitem(server.revocation_sync, "since", None)
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    run(server.sync_revocations)
+
+    assert client.get("/api/auth/me", headers=headers).status_code == 401
+    assert client.get("/api/auth/me", headers=other).status_code == 200
+
+
+def test_expired_revocations_are_forgotten(client, run):
+    server.revoked_sessions["old"] = (datetime.now(timezone.utc) - timedelta(seconds=1)).timestamp()
+    run(server.sync_revocations)
+    assert "old" not in server.revoked_sessions
+
+
+def test_invalid_token_is_rejected(client):
+    forged = jwt.encode({"sub": "user_x", "sid": "x", "exp": 2**31}, "otro-secreto", algorithm="HS256")
+    response = client.get("/api/auth/me", headers={"Authorization": f"Bearer {forged}"})
+    assert (response.status_code, response.json()["detail"]) == (401, "Token inválido")
+
+
+def test_legacy_tokens_still_authenticate(client, run):
+    now = datetime.now(timezone.utc)
+    run(server.db.users.insert_one, {"user_id": "user_1", "email": "u1@example.com", "name": "U1", "created_at": now.isoformat()})
+    run(server.db.user_sessions.insert_one, {
+        "user_id": "user_1",
+        "session_token": "session_abc",
+        "expires_at": (now + timedelta(days=1)).isoformat(),
+        "created_at": now.isoformat()
+    })
+    legacy_jwt = jwt.encode(
+        {"user_id": "user_1", "exp": now + timedelta(days=1), "iat": now},
+        server.JWT_SECRET,
+        algorithm=server.JWT_ALGORITHM
+    )
+
+    for token in (legacy_jwt, "session_abc"):
+        response = client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+        assert response.json()["user_id"] == "user_1"
+
+    client.cookies.set("session_token", "session_abc")
+    client.post("/api/auth/logout")
+    assert run(server.db.user_sessions.count_documents, {}) == 0
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def mongo_path(monkeypatch):
+    monkeypatch.setattr(server, "CATALOG_SNAPSHOT_ENABLED", False)
+
+
+def test_clinic_list_returns_only_requested_fields(client, seed_catalog, mongo_path):
+    seed_catalog(clinics=30, treatments=4, offers_per_clinic=2)
+    params = {"treatment_id": "treatment-1"}
+
+    full = client.get("/api/clinics", params=params)
+    cards = client.get("/api/clinics", params={**params, "fields": "name,city,rating,treatment_price"})
+
+    assert {tuple(sorted(c)) for c in cards.json()} == {("city", "clinic_id", "name", "rating", "treatment_price")}
+    assert [c["clinic_id"] for c in cards.json()] == [c["clinic_id"] for c in full.json()]
+    assert len(cards.content) * 3 < len(full.content)
+
+
+def test_unknown_field_is_rejected(client, seed_catalog):
+    seed_catalog(clinics=2)
+
+    assert client.get("/api/clinics", params={"fields": "name,password"}).status_code == 400
+    assert client.get("/api/clinics/clinic-0", params={"fields": "treatments.secret"}).status_code == 400
+
+
+@pytest.mark.parametrize("fields", ["name,city", "name,treatments.name,treatments.price", "rating,treatments"])
+def test_clinic_detail_fields_same_on_every_path(client, seed_catalog, run, monkeypatch, fields):
+    _, clinics, _ = seed_catalog(clinics=3, treatments=5, offers_per_clinic=3)
+    from_snapshot = client.get("/api/clinics/clinic-1", params={"fields": fields}).json()
+
+    monkeypatch.setattr(server, "CATALOG_SNAPSHOT_ENABLED", False)
+    from_joins = client.get("/api/clinics/clinic-1", params={"fields": fields}).json()
+    monkeypatch.setattr(server, "CLINIC_PROFILES_ENABLED", True)
+    run(server.refresh_clinic_profiles, [c["clinic_id"] for c in clinics])
+    from_profile = client.get("/api/clinics/clinic-1", params={"fields": fields}).json()
+
+    assert from_snapshot == from_joins == from_profile
+    expected = {"clinic_id", *(name.split(".")[0] for name in fields.split(","))}
+    assert set(from_snapshot) == expected
+
+
+def test_clinic_detail_without_offers_skips_offer_queries(client, seed_catalog, command_counter, mongo_path):
+    seed_catalog(clinics=2)
+    command_counter.reset()
+
+    response = client.get("/api/clinics/clinic-0", params={"fields": "name,phone"})
+
+    assert response.json() == {"clinic_id": "clinic-0", "name": "Clínica 0", "phone": "+34 600 000000"}
+    assert command_counter.count == 1
+
+
+def test_nested_offer_fields(client, seed_catalog, mongo_path):
+    seed_catalog(clinics=2, treatments=3, offers_per_clinic=2)
+
+    body = client.get("/api/clinics/clinic-0", params={"fields": "treatments.name,treatments.price"}).json()
+
+    assert body["treatments"] and all(set(t) == {"name", "price"} for t in body["treatments"])
+    assert "process_steps" not in json.dumps(body)